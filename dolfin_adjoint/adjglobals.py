@@ -1,6 +1,8 @@
 from . import coeffstore
+from . import tapegraph
 from . import expressions
 from . import caching
+from . import warmstart
 import libadjoint
 from dolfin_adjoint import backend
 
@@ -13,6 +15,17 @@ disk_checkpoints = set()
 
 adj_variables = coeffstore.CoeffStore()
 
+# What each registered equation depends on, for slicing the tape
+tape_graph = tapegraph.TapeGraph()
+
+# Map from block name to the solving.EquationTemplate shared by all equations with that
+# block, when compacting the tape
+equation_templates = {}
+
+# The (solving.EquationTemplate, adjrhs.RHS) of each equation annotated by solving.annotate,
+# for compiling their forms ahead of the adjoint sweeps (see jit.adj_jit_warmup)
+annotated_equations = []
+
 def adj_start_timestep(time=0.0):
     '''Dolfin does not supply us with information about timesteps, and so more information
     is required from the user for certain features. This function should be called at the
@@ -57,13 +70,38 @@ function_names = set()
 def adj_check_checkpoints():
     adjointer.check_checkpoints()
 
-def adj_reset_cache():
+def adj_reset_cache(controls=None):
+    '''Discard the cached assembled forms and factorizations. If controls are given,
+    only the values of the controls are about to change; then only what depends on them
+    is discarded, as far as the tape records what depends on what.'''
+
     if backend.parameters["adjoint"]["debug_cache"]:
         backend.info_blue("Resetting solver cache")
 
-    caching.assembled_fwd_forms.clear()
-    caching.assembled_adj_forms.clear()
-    caching.lu_solvers.clear()
+    affected = None
+    if controls is not None:
+        affected = controls_affect(controls)
+
+    if affected is None:
+        caching.assembled_fwd_forms.clear()
+        caching.assembled_adj_forms.clear()
+        caching.assembled_operators.clear()
+        caching.lu_solvers.clear()
+    else:
+        (variables, operators, constants) = affected
+        names = set(name for (name, timestep, iteration) in variables)
+
+        def depends(key, tag):
+            if tag is None:
+                return True
+            (functions, form_constants) = tag
+            return not (functions.isdisjoint(names) and form_constants.isdisjoint(constants))
+
+        caching.assembled_adj_forms.invalidate(depends)
+        caching.assembled_operators.invalidate(depends)
+        caching.lu_solvers.invalidate(lambda key, tag: tag is None or tag in operators)
+
+    # These record nothing about what they depend on
     caching.localsolvers.clear()
 
     caching.pis_fwd_to_tlm.clear()
@@ -73,11 +111,58 @@ def adj_reset_cache():
         from .petsc_krylov_solver import reset_petsc_krylov_solvers
         from .krylov_solver import reset_krylov_solvers
         from . import lusolver
-        lusolver.lu_solvers = [None] * len(lusolver.lu_solvers)
-        lusolver.adj_lu_solvers = [None] * len(lusolver.adj_lu_solvers)
+        if affected is None:
+            lusolver.lu_solvers = [None] * len(lusolver.lu_solvers)
+            lusolver.adj_lu_solvers = [None] * len(lusolver.adj_lu_solvers)
+        else:
+            for (idx, keys) in enumerate(lusolver.lu_variables):
+                if not keys.isdisjoint(operators):
+                    lusolver.lu_solvers[idx] = None
+                    lusolver.adj_lu_solvers[idx] = None
         reset_petsc_krylov_solvers()
         reset_krylov_solvers()
 
+def controls_affect(controls):
+    '''Work out what changes on the tape when the values of controls change: returns
+    (variables, operators, constants), the variables and operators as for
+    TapeGraph.affected and the names of the Constants among the controls; or None if
+    that is not known.'''
+
+    if len(tape_graph) != adjointer.equation_count:
+        return None
+
+    sources = control_sources(controls)
+    if sources is None:
+        return None
+
+    (variables, constants) = sources
+    (variables, operators) = tape_graph.affected(variables, constants)
+    return (variables, operators, set(constants))
+
+def control_sources(controls):
+    # The forward variables and the names of the Constants through which controls enter
+    variables = []
+    constants = []
+
+    for control in controls:
+        if hasattr(control, "controls"):
+            # A ListControl
+            sources = control_sources(control.controls)
+            if sources is None:
+                return None
+            variables += sources[0]
+            constants += sources[1]
+            continue
+
+        names = control.constants()
+        control_variables = control.variables()
+        if names is None or (control_variables is None and len(names) == 0):
+            return None
+        variables += control_variables or []
+        constants += names
+
+    return (variables, constants)
+
 def adj_html(*args, **kwargs):
     '''This routine dumps the current state of the adjglobals.adjointer to a HTML visualisation.
     Use it like:
@@ -90,10 +175,24 @@ def adj_html(*args, **kwargs):
 def adj_reset():
     '''Forget all annotation, and reset the entire dolfin-adjoint state.'''
     adjointer.reset()
-    expressions.expression_attrs.clear()
+    if backend.__name__ == "dolfin":
+        from . import arena
+        arena.reset_arenas()
+    expressions.expression_store.clear()
     adj_variables.__init__()
+    tape_graph.clear()
     function_names.__init__()
+    equation_templates.clear()
+    del annotated_equations[:]
     adj_reset_cache()
+    caching.clear_forward_operators()
+    caching.assembled_rhs_vectors.clear()
+    caching.function_assigners.clear()
+    caching.collapsed_spaces.clear()
+    caching.local_sizes.clear()
+    from . import preassembly
+    preassembly.reset()
+    warmstart.reset()
     backend.parameters["adjoint"]["stop_annotating"] = False
 
 # Map from FunctionSpace to LUSolver that has factorised the fsp mass matrix
@@ -9,6 +9,9 @@ from . import misc
 from . import caching
 from . import compatibility
 from . import utils
+from . import tapegraph
+from . import warmstart
+from . import preassembly
 
 class Vector(libadjoint.Vector):
     '''This class implements the libadjoint.Vector abstract base class for dolfin-adjoint.
@@ -39,11 +42,7 @@ class Vector(libadjoint.Vector):
             # The data type will be determined by the first addto.
             data = None
         elif isinstance(self.data, backend.Function):
-            try:
-                fn_space = self.data.function_space().collapse()
-            except:
-                fn_space = self.data.function_space()
-            data = backend.Function(fn_space)
+            data = backend.Function(collapsed_space(self.data.function_space()))
 
         elif isinstance(self.data, backend.MultiMeshFunction):
             try:
@@ -69,7 +68,7 @@ class Vector(libadjoint.Vector):
             self.nonlinear_bcs = x.nonlinear_bcs
             self.nonlinear_J = x.nonlinear_J
 
-        if x.zero:
+        if x.zero or alpha == 0.0:
             return
 
         if (self.data is None):
@@ -77,7 +76,7 @@ class Vector(libadjoint.Vector):
             if isinstance(x.data, backend.Function):
                 self.data = x.data.copy(deepcopy=True)
                 self.data.vector()._scale(alpha)
-            if isinstance(x.data, backend.MultiMeshFunction):
+            elif isinstance(x.data, backend.MultiMeshFunction):
                 self.data = backend.MultiMeshFunction(x.data.function_space(),
                         x.data.vector())
                 self.data.vector()._scale(alpha)
@@ -92,10 +91,7 @@ class Vector(libadjoint.Vector):
                     self.data.vector().axpy(alpha, x.data.vector())
                 except:
                     # Handle subfunctions
-                    # Fixme: use FunctionAssigner instead of a projection
-                    #assigner = backend.FunctionAssigner(self.data.function_space,
-                    #        x.data.function_space()
-                    x = backend.project(x.data, self.data.function_space())
+                    x = assign_function(x.data, self.data.function_space())
                     self.data.vector().axpy(alpha, x.vector())
             else:
                 # This occurs when adding a RHS derivative to an adjoint equation
@@ -105,7 +101,7 @@ class Vector(libadjoint.Vector):
                     self.data.vector().axpy(alpha,
                                             backend.assemble_multimesh(x.data))
                 else:
-                    self.data.vector().axpy(alpha, backend.assemble(x.data))
+                    self.data.vector().axpy(alpha, assemble_vector(x.data, copy=False))
                 self.data.form = alpha * x.data
         elif isinstance(x.data, ufl.form.Form) and isinstance(self.data, ufl.form.Form):
 
@@ -128,7 +124,7 @@ class Vector(libadjoint.Vector):
         elif isinstance(self.data, ufl.form.Form) and isinstance(x.data, backend.Function):
             #print "axpy assembling FormFunc. self.data is a %s; x.data is a %s" % (self.data.__class__, x.data.__class__)
             x_vec = x.data.vector().copy()
-            self_vec = backend.assemble(self.data)
+            self_vec = assemble_vector(self.data)
             self_vec.axpy(alpha, x_vec)
             new_fn = backend.Function(x.data.function_space())
             new_fn.vector()[:] = self_vec
@@ -149,7 +145,7 @@ class Vector(libadjoint.Vector):
         if isinstance(self.data, backend.Function):
             return (abs(backend.assemble(backend.inner(self.data, self.data)*backend.dx)))**0.5
         elif isinstance(self.data, ufl.form.Form):
-            return backend.assemble(self.data).norm("l2")
+            return assemble_vector(self.data, copy=False).norm("l2")
         elif isinstance(self.data, backend.MultiMeshFunction):
             raise NotImplementedError
 
@@ -159,7 +155,7 @@ class Vector(libadjoint.Vector):
             return backend.assemble(backend.inner(self.data, y.data)*backend.dx)
         elif isinstance(self.data, backend.Function):
             if isinstance(y.data, ufl.form.Form):
-                other = backend.assemble(y.data)
+                other = assemble_vector(y.data, copy=False)
             else:
                 other = y.data.vector()
             return self.data.vector().inner(other)
@@ -181,14 +177,16 @@ class Vector(libadjoint.Vector):
         self.zero = False
 
     def size(self):
+        # Work the size out from the function space, rather than making a Function or
+        # assembling a form just to ask its vector
         if hasattr(self, "fn_space") and self.data is None:
-            self.data = backend.Function(self.fn_space)
+            return local_size(self.fn_space)
 
         if isinstance(self.data, backend.Function):
             return self.data.vector().local_size()
 
         if isinstance(self.data, ufl.form.Form):
-            return backend.assemble(self.data).local_size()
+            return local_size(ufl.algorithms.extract_arguments(self.data)[0].function_space())
 
         raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to get the size.")
 
@@ -262,6 +260,88 @@ class Vector(libadjoint.Vector):
         except OSError:
             pass
 
+def collapsed_space(fn_space):
+    '''Return the collapsed fn_space, collapsing each (sub)space only once.'''
+
+    key = caching.function_space_key(fn_space)
+    collapsed = caching.collapsed_spaces.get(key)
+    if collapsed is None:
+        try:
+            collapsed = fn_space.collapse()
+        except:
+            collapsed = fn_space
+        if key is not None:
+            caching.collapsed_spaces[key] = collapsed
+    return collapsed
+
+def local_size(fn_space):
+    '''Return the number of degrees of freedom of fn_space owned by this process.'''
+
+    key = caching.function_space_key(fn_space)
+    size = caching.local_sizes.get(key)
+    if size is None:
+        try:
+            (first, last) = fn_space.dofmap().ownership_range()
+            size = last - first
+        except AttributeError:
+            size = backend.Function(fn_space).vector().local_size()
+        if key is not None:
+            caching.local_sizes[key] = size
+    return size
+
+def assign_function(fn, fn_space):
+    '''Return the values of fn (e.g. a subfunction) as a Function on fn_space. This copies
+    the degrees of freedom with a FunctionAssigner, cached per pair of spaces, where one
+    can be made; otherwise it projects.'''
+
+    if backend.__name__ == "dolfin" and hasattr(backend, "FunctionAssigner"):
+        # FunctionAssigners only accept the very spaces they were made for
+        key = (caching.space_id(fn_space), caching.space_id(fn.function_space()))
+        assigner = caching.function_assigners.get(key)
+        if assigner is None:
+            try:
+                assigner = backend.FunctionAssigner(fn_space, fn.function_space())
+            except RuntimeError:
+                # Remember that these spaces need a projection
+                assigner = False
+            caching.function_assigners[key] = assigner
+
+        if assigner:
+            out = backend.Function(fn_space)
+            try:
+                assigner.assign(out, fn)
+                return out
+            except RuntimeError:
+                pass
+
+    return backend.project(fn, fn_space)
+
+def storage_vector(data):
+    '''Wrap the value data in a Vector, for recording with libadjoint. data may be a Function,
+    or a Vector computed by libadjoint (a forward, adjoint or tangent linear solution).
+
+    The copy that libadjoint keeps of it is a Function if parameters["adjoint"]["forward_storage"]
+    is "function" (the default), or a row of an arena (see arena.py) if it is "arena" or "arena_mmap".
+    Setting parameters["adjoint"]["forward_storage_budget"] implies arena storage.'''
+
+    if isinstance(data, Vector):
+        if not isinstance(data.data, backend.Function):
+            return data
+        data = data.data
+
+    storage = backend.parameters["adjoint"]["forward_storage"]
+    if storage not in ["function", "arena", "arena_mmap"]:
+        raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Unknown forward_storage %s: must be one of function, arena or arena_mmap." % storage)
+
+    if storage == "function" and backend.parameters["adjoint"]["forward_storage_budget"] > 0:
+        storage = "arena"
+
+    if storage == "function" or backend.__name__ != "dolfin" or not isinstance(data, backend.Function):
+        return Vector(data)
+
+    from . import arena
+    return arena.ArenaSourceVector(data, mmap=(storage == "arena_mmap"))
+
 class Matrix(libadjoint.Matrix):
     '''This class implements the libadjoint.Matrix abstract base class for the Dolfin adjoint.
     In particular, it must implement the data callbacks for tasks such as adding two matrices
@@ -294,12 +374,14 @@ class Matrix(libadjoint.Matrix):
         else:
             if hasattr(self.data.arguments()[0], "_V_multi"):
                 assemble = backend.assemble_multimesh
+            elif backend.parameters["adjoint"]["preassemble_forms"]:
+                assemble = preassembly.assemble
             else:
                 assemble = backend.assemble
         if not self.cache:
             return assemble(self.data)
         else:
-            if self.data in caching.assembled_adj_forms:
+            if caching.assembled_adj_forms.contains_everywhere(self.data):
                 if backend.parameters["adjoint"]["debug_cache"]:
                     backend.info_green("Got an assembly cache hit")
                 return caching.assembled_adj_forms[self.data]
@@ -347,7 +429,7 @@ class Matrix(libadjoint.Matrix):
                 assembled_rhs = compatibility.assembled_rhs(b)
                 [bc.apply(assembled_rhs) for bc in bcs]
 
-                wrap_solve(assembled_lhs, x.data, assembled_rhs, self.solver_parameters)
+                wrap_solve(assembled_lhs, x.data, assembled_rhs, self.solver_parameters, var=var)
             else:
                 if hasattr(b, 'nonlinear_form'): # was a nonlinear solve
                     x = compatibility.assign_function_to_vector(x, b.nonlinear_u, function_space = test.function_space())
@@ -364,7 +446,7 @@ class Matrix(libadjoint.Matrix):
                     assembled_rhs = wrap_assemble(b.data, test)
                     [bc.apply(assembled_rhs) for bc in bcs]
 
-                    wrap_solve(assembled_lhs, x.data, assembled_rhs, self.solver_parameters)
+                    wrap_solve(assembled_lhs, x.data, assembled_rhs, self.solver_parameters, var=var)
 
         return x
 
@@ -397,7 +479,21 @@ class Matrix(libadjoint.Matrix):
                     assembled_rhs = b.data
             [bc.apply(assembled_rhs) for bc in bcs]
 
-            if not var in caching.lu_solvers:
+            if var.type in ['ADJ_ADJOINT', 'ADJ_SOA'] and caching.lu_solvers.get(var) is None:
+                (forward_solver, nbytes) = self.forward_factorization(var)
+                if forward_solver is not None:
+                    if backend.parameters["adjoint"]["debug_cache"]:
+                        backend.info_green("Reusing the forward factorization for %s" % var)
+                    # The entry keeps the forward factorization alive, even if that is
+                    # evicted from fwd_lu_solvers, so it is charged for it too
+                    if getattr(self, "self_adjoint", False):
+                        # The matrix is the forward matrix, with the same boundary rows
+                        caching.lu_solvers.set(var, forward_solver, nbytes, tag=forward_key(var))
+                    else:
+                        caching.lu_solvers.set(var, TransposeSolver(forward_solver, bcs), nbytes, tag=forward_key(var))
+
+            factorized = None
+            if not caching.lu_solvers.contains_everywhere(var):
                 if backend.parameters["adjoint"]["debug_cache"]:
                     backend.info_red("Got a cache miss for %s" % var)
 
@@ -409,20 +505,106 @@ class Matrix(libadjoint.Matrix):
                     [bc.apply(assembled_lhs) for bc in bcs]
 
                 solver_method = "mumps" if "mumps" in backend.lu_solver_methods().keys() else "default"
-                caching.lu_solvers[var] = compatibility.LUSolver(assembled_lhs,
-                        solver_method)
-                caching.lu_solvers[var].parameters["reuse_factorization"] = True
+                solver = compatibility.LUSolver(assembled_lhs, solver_method)
+                solver.parameters["reuse_factorization"] = True
+                caching.lu_solvers.set(var, solver, caching.factorization_nbytes(assembled_lhs), tag=forward_key(var))
+                factorized = assembled_lhs
             else:
                 if backend.parameters["adjoint"]["debug_cache"]:
                     backend.info_green("Got a cache hit for %s" % var)
 
-            caching.lu_solvers[var].solve(output.data.vector(), assembled_rhs)
+            solver = caching.lu_solvers[var]
+            solver.solve(output.data.vector(), assembled_rhs)
+            if factorized is not None:
+                # Now that the factorization exists, it can be measured
+                caching.lu_solvers.resize(var, caching.factorization_nbytes(factorized, solver))
 
         return output
 
+    def forward_factorization(self, var):
+        '''Return the cached forward factorization whose transpose is this (adjoint) matrix,
+        or None if there is none, with the memory it is counted as holding. The adjoint
+        matrices made by solving.EquationTemplate carry the forward form and boundary
+        conditions they were made from, to check against. If the operator is self-adjoint,
+        the factorization itself is this matrix.'''
+
+        forward_data = getattr(self, "forward_data", None)
+        solver = None
+        if forward_data is not None and not backend.parameters["adjoint"]["symmetric_bcs"]:
+            key = caching.forward_operator_key(forward_data, self.forward_bcs, self.solver_parameters)
+            solver = caching.fwd_lu_solvers.get(key)
+
+        usable = solver is not None and (getattr(self, "self_adjoint", False) or hasattr(solver, "solve_transpose"))
+
+        if not compatibility.all_processes(usable):
+            return (None, 0)
+        return (solver, caching.fwd_lu_solvers.entry_nbytes(key))
+
+    def direct_solvable(self, b):
+        '''Whether the solve with right-hand side b is a direct solve of a linear system,
+        which may reuse a cached factorization.'''
+
+        if backend.__name__ != "dolfin" or isinstance(self.data, IdentityMatrix):
+            return False
+        if b.data is None or hasattr(b, 'nonlinear_form'):
+            return False
+        if backend.parameters["adjoint"]["symmetric_bcs"] or hasattr(self.test_function(), '_V_multi'):
+            return False
+        if "nonlinear_solver" in self.solver_parameters or "newton_solver" in self.solver_parameters:
+            return False
+
+        return self.solver_parameters.get("linear_solver", "default") in direct_methods
+
+    def forward_caching_solve(self, var, b):
+        '''Solve the forward equation for var, reusing the factorization of an earlier solve
+        with the same operator, if there is one.'''
+
+        test = self.test_function()
+        x = Vector(backend.Function(test.function_space()))
+
+        if isinstance(b.data, backend.Function):
+            assembled_rhs = compatibility.assembled_rhs(b)
+        else:
+            assembled_rhs = wrap_assemble(b.data, test)
+        [bc.apply(assembled_rhs) for bc in self.bcs]
+
+        key = caching.forward_operator_key(self.data, self.bcs, self.solver_parameters)
+        caching.use_forward_operator(caching.lu_canonicalisation(var), key)
+
+        # Factorizing is collective: refactorize everywhere if anything changed anywhere
+        hit = caching.fwd_lu_solvers.contains_everywhere(key)
+
+        if not hit:
+            if backend.parameters["adjoint"]["debug_cache"]:
+                backend.info_red("Got a forward cache miss for %s" % var)
+
+            assembled_lhs = self.assemble_data()
+            [bc.apply(assembled_lhs) for bc in self.bcs]
+
+            method = self.solver_parameters.get("linear_solver", "default")
+            if method in ["default", "lu"]:
+                method = "mumps" if "mumps" in backend.lu_solver_methods().keys() else "default"
+            solver = compatibility.LUSolver(assembled_lhs, method)
+            solver.parameters["reuse_factorization"] = True
+            caching.fwd_lu_solvers.set(key, solver, caching.factorization_nbytes(assembled_lhs))
+        else:
+            if backend.parameters["adjoint"]["debug_cache"]:
+                backend.info_green("Got a forward cache hit for %s" % var)
+            solver = caching.fwd_lu_solvers[key]
+
+        solver.solve(x.data.vector(), assembled_rhs)
+        if not hit:
+            # Now that the factorization exists, it can be measured
+            caching.fwd_lu_solvers.resize(key, caching.factorization_nbytes(assembled_lhs, solver))
+        return x
+
     def solve(self, var, b):
         if backend.parameters["adjoint"]["cache_factorizations"] and var.type != "ADJ_FORWARD":
             x = self.caching_solve(var, b)
+        elif backend.parameters["adjoint"]["cache_forward_factorizations"] and var.type == "ADJ_FORWARD" and self.direct_solvable(b):
+            x = self.forward_caching_solve(var, b)
+        elif caching.shared_adjoint_solves and var.type == "ADJ_ADJOINT" and self.direct_solvable(b):
+            x = self.caching_solve(var, b)
         else:
             x = self.basic_solve(var, b)
 
@@ -466,13 +648,83 @@ class Matrix(libadjoint.Matrix):
 
         return ufl.algorithms.extract_arguments(self.data)[-1]
 
+class TransposeSolver(object):
+    '''Solves the adjoint of a linear system with the transpose of the factorization of the
+    forward system, instead of factorizing the adjoint matrix.
+
+    The forward matrix has identity rows for the Dirichlet dofs, so its transpose differs
+    from the adjoint matrix with the (homogenized) boundary conditions applied in the
+    Dirichlet columns. Both give the same solution away from the Dirichlet dofs, and the
+    adjoint solution is zero on them; so solve with the transpose, and zero the Dirichlet
+    dofs.'''
+
+    def __init__(self, solver, bcs):
+        self.solver = solver
+        self.bcs = [utils.homogenize(bc) for bc in bcs if isinstance(bc, backend.DirichletBC)]
+
+    def solve(self, x, b, annotate=False):
+        self.solver.solve_transpose(x, b)
+        [bc.apply(x) for bc in self.bcs]
+
+def forward_key(var):
+    '''Return the key of the forward variable whose equation var is solved with, for tagging
+    the factorizations cached for var with the operator they came from.'''
+    if var.type != 'ADJ_FORWARD':
+        var = var.to_forward()
+    return tapegraph.variable_key(var)
+
+def operator_action(form, fn, transpose=False):
+    '''Return the action of the bilinear form (or, if transpose, of its adjoint) on the
+    Function fn as a matrix-vector product, if the assembled form is cached or is one the
+    forward model assembled, and so worth caching. Otherwise return None, and the action
+    must be assembled from its form.'''
+
+    if backend.__name__ != "dolfin" or not isinstance(fn, backend.Function) or utils._has_multimesh(form):
+        return None
+
+    if caching.assembled_operators.contains_everywhere(form):
+        if backend.parameters["adjoint"]["debug_cache"]:
+            backend.info_green("Got an operator cache hit")
+        A = caching.assembled_operators[form]
+    elif form in caching.assembled_fwd_forms:
+        if backend.parameters["adjoint"]["debug_cache"]:
+            backend.info_red("Got an operator cache miss")
+        A = backend.assemble(form)
+        caching.assembled_operators[form] = A
+    else:
+        return None
+
+    # The rows of A belong to the test space, its columns to the trial space
+    args = form.arguments()
+    (output_space, input_dim) = (args[1], 0) if transpose else (args[0], 1)
+    x = fn.vector()
+    if x.size() != A.size(input_dim):
+        return None
+
+    output = backend.Function(output_space.function_space())
+    if transpose:
+        A.transpmult(x, output.vector())
+    else:
+        A.mult(x, output.vector())
+    output.vector().apply("insert")
+    return output
+
+def same_dirichlet_dofs(bcs, other_bcs):
+    '''Return whether the Dirichlet conditions bcs and other_bcs constrain the same dofs.'''
+
+    return compatibility.all_processes(caching.dirichlet_dofs(bcs) == caching.dirichlet_dofs(other_bcs))
+
+# The linear_solver values that ask for a direct solve
+direct_methods = ["default", "lu", "mumps", "umfpack", "spooles", "superlu", "superlu_dist", "pastix", "petsc"]
+
 class IdentityMatrix(object):
     '''Placeholder object for identity matrices'''
     pass
 
-def wrap_solve(A, x, b, solver_parameters):
+def wrap_solve(A, x, b, solver_parameters, var=None):
     '''Make my own solve, since solve(A, x, b) can't handle other solver_parameters
-    like linear solver tolerances'''
+    like linear solver tolerances. var is the variable solved for, if any, for
+    warm-starting iterative solves.'''
 
     # Comment. Why does list_lu_solver_methods() not return, a, uhm, list?
     lu_solvers = ["lu", "mumps", "umfpack", "spooles", "superlu", "superlu_dist", "pastix", "petsc"]
@@ -510,7 +762,13 @@ def wrap_solve(A, x, b, solver_parameters):
             if "krylov_solver" in solver_parameters:
                 solver.parameters.update(solver_parameters["krylov_solver"])
 
-            solver.solve(A, x, b)
+            warm = var is not None and warmstart.initial_guess(None, var, x)
+            if warm:
+                solver.parameters["nonzero_initial_guess"] = True
+
+            its = solver.solve(A, x, b)
+            if var is not None:
+                warmstart.record(None, var, x, its, warm)
             return
     else:
         backend.solve(A, x, b, solver_parameters=solver_parameters)
@@ -532,9 +790,34 @@ def wrap_assemble(form, test):
         if hasattr(form.arguments()[0], '_V_multi'):
             b = backend.assemble_multimesh(form)
         else:
-            b = backend.assemble(form)
+            b = assemble_vector(form)
     except RuntimeError:
         assert len(form.integrals()) == 0
         b = backend.Function(test.function_space()).vector()
 
     return b
+
+def assemble_vector(form, copy=True):
+    '''Assemble the linear form, taking the vector from the cache of assembled right-hand
+    sides if parameters["adjoint"]["cache_rhs_assembly"] is set, and pre-assembling what it
+    can if parameters["adjoint"]["preassemble_forms"] is set. Pass copy=False if the vector
+    will not be modified.'''
+
+    if backend.parameters["adjoint"]["preassemble_forms"]:
+        assemble = preassembly.assemble
+    else:
+        assemble = backend.assemble
+
+    if not backend.parameters["adjoint"]["cache_rhs_assembly"] or len(form.arguments()) != 1:
+        return assemble(form)
+
+    key = caching.rhs_key(form)
+    if caching.assembled_rhs_vectors.contains_everywhere(key):
+        if backend.parameters["adjoint"]["debug_cache"]:
+            backend.info_green("Got a right-hand side cache hit")
+        b = caching.assembled_rhs_vectors[key]
+        return b.copy() if copy else b
+
+    b = assemble(form)
+    caching.assembled_rhs_vectors[key] = b.copy()
+    return b
@@ -4,6 +4,9 @@ import ufl
 import ufl.algorithms
 from . import adjglobals
 from . import adjlinalg
+from . import caching
+from . import constant
+from . import expressions
 from . import utils
 
 def find_previous_variable(var):
@@ -27,6 +30,13 @@ class RHS(libadjoint.RHS):
     '''This class implements the libadjoint.RHS abstract base class for the Dolfin adjoint.
     It takes in a form, and implements the necessary routines such as calling the right-hand side
     and taking its derivative.'''
+
+    # The Expression and Constant state at the time of annotation, which the source terms
+    # may depend on. The block of the equation only restores the state it can see, as it
+    # may be shared with equations whose sources differ.
+    frozen_expressions = None
+    frozen_constants = None
+
     def __init__(self, form):
 
         self.form=form
@@ -41,9 +51,22 @@ class RHS(libadjoint.RHS):
         else:
             self.coeffs = []
 
+        # The derivatives of the form, built the first time they are needed
+        self.derivatives = caching.SymbolicCache()
+
+        self.frozen_expressions = expressions.freeze_dict()
+        self.frozen_constants = constant.freeze_dict()
+
+    def restore(self):
+        '''Restore the Expression and Constant state at the time of annotation.'''
+        if self.frozen_expressions is not None:
+            expressions.update_expressions(self.frozen_expressions)
+            constant.update_constants(self.frozen_constants)
+
     def __call__(self, dependencies, values):
 
         if isinstance(self.form, ufl.form.Form):
+            self.restore()
 
             dolfin_dependencies=[dep for dep in _extract_function_coeffs(self.form)]
 
@@ -63,23 +86,9 @@ class RHS(libadjoint.RHS):
             return adjlinalg.Vector(None)
 
         if isinstance(self.form, ufl.form.Form):
-            # Find the dolfin Function corresponding to variable.
-            dolfin_variable = values[dependencies.index(variable)].data
-
-            dolfin_dependencies = [dep for dep in _extract_function_coeffs(self.form)]
-
-            dolfin_values = [val.data for val in values]
-
-            current_form = backend.replace(self.form, dict(zip(dolfin_dependencies, dolfin_values)))
-            trial = backend.TrialFunction(dolfin_variable.function_space())
-
-            d_rhs = backend.derivative(current_form, dolfin_variable, trial)
-
-            if hermitian:
-                action = backend.action(backend.adjoint(d_rhs), contraction_vector.data)
-            else:
-                action = backend.action(d_rhs, contraction_vector.data)
-
+            self.restore()
+            action = self.derivative_action_form(dependencies.index(variable), hermitian, [val.data for val in values],
+                                                 contraction_vector.data)
             return adjlinalg.Vector(action)
         else:
             # RHS is a adjlinalg.Vector. Its derivative is therefore zero.
@@ -88,37 +97,88 @@ class RHS(libadjoint.RHS):
     def second_derivative_action(self, dependencies, values, inner_variable, inner_contraction_vector, outer_variable, hermitian, action_vector):
 
         if isinstance(self.form, ufl.form.Form):
-            # Find the dolfin Function corresponding to variable.
-            dolfin_inner_variable = values[dependencies.index(inner_variable)].data
-            dolfin_outer_variable = values[dependencies.index(outer_variable)].data
+            self.restore()
+            action = self.second_derivative_action_form(dependencies.index(inner_variable), dependencies.index(outer_variable),
+                                                        hermitian, [val.data for val in values],
+                                                        inner_contraction_vector.data, action_vector.data)
+            if action is None:
+                return None
+
+            return adjlinalg.Vector(action)
+        else:
+            # RHS is a adjlinalg.Vector. Its derivative is therefore zero.
+            raise libadjoint.exceptions.LibadjointErrorNotImplemented("No derivative method for constant RHS.")
+
+    def derivative_action_form(self, j, hermitian, values, contraction):
+        dolfin_dependencies = [dep for dep in _extract_function_coeffs(self.form)]
 
-            dolfin_dependencies = [dep for dep in _extract_function_coeffs(self.form)]
+        def build(contraction):
+            trial = backend.TrialFunction(dolfin_dependencies[j].function_space())
+            d_rhs = backend.derivative(self.form, dolfin_dependencies[j], trial)
+            d_rhs = ufl.algorithms.expand_derivatives(d_rhs)
+            if len(d_rhs.integrals()) == 0:
+                return None
+
+            if hermitian:
+                return backend.action(backend.adjoint(d_rhs), contraction)
+            else:
+                return backend.action(d_rhs, contraction)
+
+        return self.derivatives.form(("derivative_action", j, hermitian), build, dolfin_dependencies,
+                                     values, [contraction])
 
-            dolfin_values = [val.data for val in values]
+    def second_derivative_action_form(self, j_inner, j_outer, hermitian, values, inner_contraction, action_vector):
+        dolfin_dependencies = [dep for dep in _extract_function_coeffs(self.form)]
 
-            current_form = backend.replace(self.form, dict(zip(dolfin_dependencies, dolfin_values)))
-            trial = backend.TrialFunction(dolfin_outer_variable.function_space())
+        def build(inner_contraction, action_vector):
+            trial = backend.TrialFunction(dolfin_dependencies[j_outer].function_space())
 
-            d_rhs = backend.derivative(current_form, dolfin_inner_variable, inner_contraction_vector.data)
+            d_rhs = backend.derivative(self.form, dolfin_dependencies[j_inner], inner_contraction)
             d_rhs = ufl.algorithms.expand_derivatives(d_rhs)
             if len(d_rhs.integrals()) == 0:
                 return None
 
-            d_rhs = backend.derivative(d_rhs, dolfin_outer_variable, trial)
+            d_rhs = backend.derivative(d_rhs, dolfin_dependencies[j_outer], trial)
             d_rhs = ufl.algorithms.expand_derivatives(d_rhs)
 
             if len(d_rhs.integrals()) == 0:
                 return None
 
             if hermitian:
-                action = backend.action(backend.adjoint(d_rhs), action_vector.data)
+                return backend.action(backend.adjoint(d_rhs), action_vector)
             else:
-                action = backend.action(d_rhs, action_vector.data)
+                return backend.action(d_rhs, action_vector)
 
-            return adjlinalg.Vector(action)
-        else:
-            # RHS is a adjlinalg.Vector. Its derivative is therefore zero.
-            raise libadjoint.exceptions.LibadjointErrorNotImplemented("No derivative method for constant RHS.")
+        return self.derivatives.form(("second_derivative_action", j_inner, j_outer, hermitian), build, dolfin_dependencies,
+                                     values, [inner_contraction, action_vector])
+
+    def backward_forms(self, hessian=False):
+        '''Return the forms the adjoint sweeps assemble for this right-hand side, built in
+        its own coefficients, so that they can be compiled before the sweeps need them. If
+        hessian, also return those of the tangent linear and second order adjoint sweeps.'''
+
+        if not isinstance(self.form, ufl.form.Form):
+            return []
+
+        test = backend.Function(ufl.algorithms.extract_arguments(self.form)[0].function_space())
+        coeffs = [dep for dep in _extract_function_coeffs(self.form)]
+        hermitians = [True, False] if hessian else [True]
+
+        forms = []
+        for (j, coeff) in enumerate(coeffs):
+            for hermitian in hermitians:
+                other = test if hermitian else backend.Function(coeff.function_space())
+                forms.append(self.derivative_action_form(j, hermitian, coeffs, other))
+
+                if not hessian:
+                    continue
+
+                for (k, outer_coeff) in enumerate(coeffs):
+                    other = test if hermitian else backend.Function(outer_coeff.function_space())
+                    forms.append(self.second_derivative_action_form(j, k, hermitian, coeffs,
+                                                                    backend.Function(coeff.function_space()), other))
+
+        return [form for form in forms if form is not None]
 
     def dependencies(self):
 
@@ -175,7 +235,7 @@ class NonlinearRHS(RHS):
 
     def __call__(self, dependencies, values):
         assert isinstance(self.form, ufl.form.Form)
-
+        self.restore()
 
         if hasattr(self, "ic_copy"):
             ic = self.ic_copy
@@ -234,7 +294,12 @@ class NonlinearRHS(RHS):
         else:
             return RHS.second_derivative_action(self, dependencies, values, inner_variable, inner_contraction_vector, outer_variable, hermitian, action)
 
+    def backward_forms(self, hessian=False):
+        # The adjoint of the linearisation of F, as derivative_assembly builds it
+        return RHS.backward_forms(self, hessian) + [backend.adjoint(backend.derivative(self.form, self.u))]
+
     def derivative_assembly(self, dependencies, values, variable, hermitian):
+        self.restore()
         replace_map = {}
 
         for i in range(len(self.deps)):
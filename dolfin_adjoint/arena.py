@@ -0,0 +1,370 @@
+import bisect
+import os
+import tempfile
+import weakref
+
+import numpy
+
+import backend
+from . import adjlinalg
+from . import caching
+
+# Storage of recorded forward values in arenas: one growable two-dimensional array
+# per function space, with one row of degrees of freedom per recorded value. The
+# values libadjoint keeps are then ArenaVectors, which only hold their row number;
+# a Function is made from the row when one is asked for.
+#
+# Select it with parameters["adjoint"]["forward_storage"] = "arena" (in memory) or
+# "arena_mmap" (in a memory-mapped temporary file).
+#
+# parameters["adjoint"]["forward_storage_budget"] limits the number of bytes of
+# recorded values held in memory. Beyond it, values are spilled to a file per arena,
+# oldest first during the forward run, as those are the last ones the adjoint
+# needs. When the backward sweep asks for a spilled value, it is read back along with
+# the values recorded before it, making room by spilling the values the sweep has
+# already gone past.
+
+itemsize = numpy.dtype(numpy.float64).itemsize
+
+class Arena(object):
+    '''The rows of degrees of freedom for the values on one function space.'''
+
+    def __init__(self, fn_space, size, mmap=False):
+        self.fn_space = fn_space
+        self.size = size
+        self.rowbytes = size * itemsize
+        self.mmap = mmap
+
+        self.capacity = 0
+        self.used = 0
+        self.free = []
+        self.filename = None
+        self.rows = numpy.empty((0, size))
+
+        # The rows spilled to disk
+        self.spill_file = None
+        self.spill_filename = None
+        self.spill_used = 0
+        self.spill_free = []
+
+    def allocate(self):
+        '''Return the index of an unused row.'''
+
+        if len(self.free) > 0:
+            return self.free.pop()
+
+        if self.used == self.capacity:
+            self.grow(max(16, 2*self.capacity))
+
+        slot = self.used
+        self.used += 1
+        return slot
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def row(self, slot):
+        '''Return a view of the given row. Do not hold on to it: the view is invalidated
+        when the arena grows.'''
+        return self.rows[slot]
+
+    def grow(self, capacity):
+        if self.mmap:
+            if self.filename is None:
+                (fd, self.filename) = tempfile.mkstemp(prefix="dolfin_adjoint_arena_", suffix=".dat")
+                os.close(fd)
+
+            # Growing the file keeps the rows already in it, so there is nothing to copy
+            self.rows = None
+            with open(self.filename, "r+b") as f:
+                f.truncate(capacity * self.rowbytes)
+            if capacity * self.size > 0:
+                self.rows = numpy.memmap(self.filename, dtype=numpy.float64, mode="r+", shape=(capacity, self.size))
+            else:
+                self.rows = numpy.empty((capacity, self.size))
+        else:
+            rows = numpy.empty((capacity, self.size))
+            rows[:self.capacity] = self.rows[:self.capacity]
+            self.rows = rows
+
+        self.capacity = capacity
+
+    def spill(self, slot):
+        '''Write the given row to the spill file, and return where it went.'''
+
+        if self.spill_file is None:
+            (fd, self.spill_filename) = tempfile.mkstemp(prefix="dolfin_adjoint_spill_", suffix=".dat")
+            self.spill_file = os.fdopen(fd, "r+b")
+
+        if len(self.spill_free) > 0:
+            spill_slot = self.spill_free.pop()
+        else:
+            spill_slot = self.spill_used
+            self.spill_used += 1
+
+        self.spill_file.seek(spill_slot * self.rowbytes)
+        self.spill_file.write(numpy.ascontiguousarray(self.rows[slot]).tobytes())
+        return spill_slot
+
+    def unspill(self, spill_slot, slot):
+        '''Read a spilled row back into the given row.'''
+
+        self.spill_file.seek(spill_slot * self.rowbytes)
+        self.rows[slot] = numpy.frombuffer(self.spill_file.read(self.rowbytes), dtype=numpy.float64)
+
+    def release_spill(self, spill_slot):
+        self.spill_free.append(spill_slot)
+
+    def nbytes(self):
+        return self.capacity * self.rowbytes
+
+    def __del__(self):
+        self.rows = None
+        if self.spill_file is not None:
+            self.spill_file.close()
+        for filename in [self.filename, self.spill_filename]:
+            if filename is not None:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+class Budget(object):
+    '''Keeps track of the bytes of recorded values held in memory, and spills values
+    to disk to stay within parameters["adjoint"]["forward_storage_budget"].'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # Values are numbered in the order they are recorded
+        self.sequence = 0
+        self.vectors = weakref.WeakValueDictionary()
+        # The sorted numbers of the values held in memory
+        self.resident = []
+        self.resident_bytes = 0
+        # The number of the last value read back from disk: the backward sweep has
+        # gone past everything after it
+        self.cursor = None
+        # The number of values written to and read back from disk
+        self.spills = 0
+        self.unspills = 0
+
+    def limit(self):
+        return backend.parameters["adjoint"]["forward_storage_budget"]
+
+    def register(self, vec):
+        vec.seq = self.sequence
+        self.sequence += 1
+        self.vectors[vec.seq] = vec
+
+    def add(self, vec):
+        bisect.insort(self.resident, vec.seq)
+        self.resident_bytes += vec.arena.rowbytes
+
+    def remove(self, vec):
+        i = bisect.bisect_left(self.resident, vec.seq)
+        if i < len(self.resident) and self.resident[i] == vec.seq:
+            del self.resident[i]
+            self.resident_bytes -= vec.arena.rowbytes
+
+    def victim(self, keep, consumed_only=False):
+        '''Choose a value to spill, other than keep.'''
+
+        candidates = []
+        if self.cursor is not None and len(self.resident) > 0 and self.resident[-1] > self.cursor:
+            candidates.append(self.resident[-1])
+        if not consumed_only and len(self.resident) > 0:
+            candidates += [self.resident[0], self.resident[-1]]
+
+        for seq in candidates:
+            if seq != keep:
+                return self.vectors.get(seq)
+        return None
+
+    def make_room(self, nbytes, keep=None, consumed_only=False):
+        '''Spill values until nbytes more fit in the budget. Returns whether they do.'''
+
+        limit = self.limit()
+        if limit <= 0:
+            return True
+
+        while self.resident_bytes + nbytes > limit:
+            victim = self.victim(keep, consumed_only=consumed_only)
+            if victim is None:
+                return False
+            victim.spill()
+
+        return True
+
+budget = Budget()
+
+# Map from (function space, mmap) to Arena
+arenas = {}
+
+def get_arena(fn_space, mmap=False):
+    # Collapsing a subspace gives a new FunctionSpace every time, with the same layout;
+    # identify spaces by what determines that layout.
+    space_key = caching.function_space_key(fn_space)
+    key = (space_key if space_key is not None else id(fn_space), mmap)
+    arena = arenas.get(key)
+    if arena is None:
+        arena = Arena(fn_space, adjlinalg.local_size(fn_space), mmap=mmap)
+        arenas[key] = arena
+    return arena
+
+def reset_arenas():
+    '''Start new arenas for the values recorded from now on. The old arenas live on
+    for as long as any of their values do.'''
+    global budget
+    arenas.clear()
+    budget = Budget()
+
+class ArenaSourceVector(adjlinalg.Vector):
+    '''Wraps a forward value that is about to be recorded, so that the copy libadjoint
+    makes of it is stored in an arena.'''
+
+    def __init__(self, data, mmap=False):
+        adjlinalg.Vector.__init__(self, data)
+        self.mmap = mmap
+
+    def duplicate(self):
+        return ArenaVector(get_arena(adjlinalg.collapsed_space(self.data.function_space()), mmap=self.mmap))
+
+class ArenaVector(adjlinalg.Vector):
+    '''A Vector whose values are stored in a row of an Arena, or spilled to its file.'''
+
+    def __init__(self, arena):
+        self.arena = arena
+        self.fn_space = arena.fn_space
+        self.zero = True
+        self.function = None
+        self.spill_slot = None
+
+        self.budget = budget
+        self.budget.register(self)
+        self.budget.make_room(arena.rowbytes)
+        self.slot = arena.allocate()
+        self.budget.add(self)
+
+    def values(self):
+        '''Return a view of the values, reading them back from disk if necessary.'''
+
+        if self.slot is None:
+            self.load()
+        return self.arena.row(self.slot)
+
+    def modified(self):
+        self.zero = False
+        self.function = None
+        if self.spill_slot is not None:
+            self.arena.release_spill(self.spill_slot)
+            self.spill_slot = None
+
+    def spill(self):
+        if self.slot is None:
+            return
+        if self.spill_slot is None and not self.zero:
+            self.spill_slot = self.arena.spill(self.slot)
+        self.arena.release(self.slot)
+        self.slot = None
+        self.budget.remove(self)
+        self.budget.spills += 1
+
+    def unspill(self):
+        self.slot = self.arena.allocate()
+        if not self.zero:
+            self.arena.unspill(self.spill_slot, self.slot)
+        self.budget.add(self)
+        self.budget.unspills += 1
+
+    def load(self):
+        self.budget.cursor = self.seq
+        self.budget.make_room(self.arena.rowbytes, keep=self.seq)
+        self.unspill()
+
+        # Read back the values the backward sweep will ask for next, as far as we can
+        # without spilling anything it still needs.
+        seq = self.seq - 1
+        while seq >= 0:
+            vec = self.budget.vectors.get(seq)
+            seq -= 1
+            if vec is None:
+                continue
+            if vec.slot is not None:
+                break
+            if not self.budget.make_room(vec.arena.rowbytes, consumed_only=True):
+                break
+            vec.unspill()
+
+    def get_data(self):
+        # Hand out the same Function for as long as someone holds on to it, so that
+        # the callbacks see one object per value.
+        fn = self.function() if self.function is not None else None
+        if fn is None:
+            fn = backend.Function(self.fn_space)
+            if not self.zero:
+                vec = fn.vector()
+                vec.set_local(numpy.ascontiguousarray(self.values()))
+                vec.apply("insert")
+            self.function = weakref.ref(fn)
+        return fn
+
+    def set_data(self, data):
+        if data is None:
+            self.zero = True
+            self.function = None
+        else:
+            self.store(data)
+
+    data = property(get_data, set_data)
+
+    def store(self, fn):
+        self.values()[:] = fn.vector().get_local()
+        self.modified()
+
+    def duplicate(self):
+        return adjlinalg.Vector(backend.Function(self.fn_space), zero=True, fn_space=self.fn_space)
+
+    def axpy(self, alpha, x):
+        if x.zero:
+            return
+
+        if isinstance(x.data, backend.Function) and x.data.vector().local_size() == self.arena.size:
+            values = x.data.vector().get_local()
+            row = self.values()
+            if self.zero:
+                row[:] = alpha * values
+            else:
+                row += alpha * values
+            self.modified()
+        else:
+            # Anything else (forms, subfunctions, ...) goes through a Function.
+            tmp = adjlinalg.Vector(self.data)
+            tmp.zero = self.zero
+            tmp.axpy(alpha, x)
+            if not tmp.zero:
+                self.store(tmp.data)
+
+    def set_values(self, array):
+        self.values()[:] = array
+        self.modified()
+
+    def get_values(self, array):
+        if self.zero:
+            array[:] = 0.0
+        else:
+            array[:] = self.values()
+
+    def size(self):
+        return self.arena.size
+
+    def __del__(self):
+        try:
+            if self.slot is not None:
+                self.arena.release(self.slot)
+                self.budget.remove(self)
+            if self.spill_slot is not None:
+                self.arena.release_spill(self.spill_slot)
+        except AttributeError:
+            pass
@@ -16,7 +16,7 @@ def register_assign(new, old, op=None):
     dep = adjglobals.adj_variables.next(new)
 
     if backend.parameters["adjoint"]["record_all"] and isinstance(old, backend.Function):
-        adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.Vector(old)))
+        adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.storage_vector(old)))
 
     rhs = IdentityRHS(old, fn_space, op)
     register_initial_conditions(zip(rhs.coefficients(),rhs.dependencies()), linear=True)
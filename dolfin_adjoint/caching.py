@@ -1,7 +1,11 @@
-import re
+import collections
+import hashlib
+import backend
 import ufl.algorithms
 from ufl import Form
 from backend import Constant
+from . import compatibility
+from . import expressions
 
 ### A general dictionary that applies a key function before lookup
 class KeyedDict(dict):
@@ -31,7 +35,7 @@ class KeyedDict(dict):
         def _comparable(key):
             # Form may be None when this is called during process cleanup
             if Form and isinstance(key, Form):
-                return form.signature()
+                return key.signature()
             return key
         try:
             keys = self.keys()
@@ -45,9 +49,226 @@ class KeyedDict(dict):
     def __del__(self):
         self.clear()
 
-### Stuff for LU caching
+### Bounding the memory held by the caches
+
+# The factorizations cost about this many times the memory of the matrix they factorize.
+# They are made lazily, on the first solve, so when they are cached there is nothing to
+# measure yet; after the first solve, PETSc's factor info gives their size, where it can be
+# got at.
+fill_ratio = 5.0
+
+def matrix_nbytes(A):
+    # Compressed row storage: a value and a column index per nonzero, a pointer per row
+    try:
+        return A.nnz() * 12 + A.size(0) * 4
+    except (AttributeError, RuntimeError, TypeError):
+        return 0
+
+def measured_factorization_nbytes(solver, A):
+    # The memory of the factor matrix of a PETSc LU solver that has solved once, or None
+    try:
+        info = solver.ksp().getPC().getFactorMatrix().getInfo()
+    except (AttributeError, RuntimeError, TypeError, KeyError):
+        return None
+    if info.get("memory", 0) > 0:
+        return int(info["memory"])
+    if info.get("fill_ratio_needed", 0) > 0:
+        return int(info["fill_ratio_needed"] * matrix_nbytes(A))
+    return None
+
+def factorization_nbytes(A, solver=None):
+    '''Estimate the memory held by the factorization of A: from PETSc's factor info if solver
+    has factorized it, otherwise from the nonzeros of A and fill_ratio.'''
+    if solver is not None:
+        nbytes = measured_factorization_nbytes(solver, A)
+        if nbytes is not None:
+            return nbytes
+    return int(fill_ratio * matrix_nbytes(A))
+
+def estimate_nbytes(value):
+    if isinstance(value, tuple):
+        return sum(estimate_nbytes(v) for v in value)
+    elif hasattr(value, "nnz"):
+        return matrix_nbytes(value)
+    elif hasattr(value, "local_size"):
+        return value.local_size() * 8
+    else:
+        return 0
+
+class CacheBudget(object):
+    '''Keeps the entries of all BoundedCaches in order of last use, and evicts the least
+    recently used ones when their estimated size exceeds
+    parameters["adjoint"]["cache_budget"] bytes.'''
+
+    def __init__(self):
+        # (id(cache), key) -> estimated size in bytes, least recently used first
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.caches = {}
+
+    def register(self, cache):
+        self.caches[id(cache)] = cache
+
+    def add(self, cache, key, nbytes):
+        self.entries[(id(cache), key)] = nbytes
+        self.nbytes += nbytes
+        self.enforce(cache, key)
+
+    def resize(self, cache, key, nbytes):
+        entry = (id(cache), key)
+        if entry not in self.entries:
+            return
+        self.nbytes += nbytes - self.entries[entry]
+        self.entries[entry] = nbytes
+        self.enforce(cache, key)
+
+    def enforce(self, cache, key):
+        '''Evict the least recently used entries, other than the entry key of cache, until
+        the budget is met.'''
+
+        limit = backend.parameters["adjoint"]["cache_budget"]
+        if limit <= 0:
+            return
+
+        while self.nbytes > limit and len(self.entries) > 1:
+            (cache_id, victim) = next(iter(self.entries))
+            if (cache_id, victim) == (id(cache), key):
+                break
+            self.caches[cache_id].evict(victim)
+
+    def touch(self, cache, key):
+        entry = (id(cache), key)
+        if entry in self.entries:
+            self.entries[entry] = self.entries.pop(entry)
+
+    def remove(self, cache, key):
+        nbytes = self.entries.pop((id(cache), key), None)
+        if nbytes is not None:
+            self.nbytes -= nbytes
+
+cache_budget = CacheBudget()
+
+class BoundedCache(KeyedDict):
+    '''A KeyedDict whose entries count against the cache budget, and may be evicted when
+    it is exceeded. Membership tests count as hits or misses. Entries may carry a tag,
+    saying what they depend on, for invalidate. If max_entries is given, it returns the
+    most entries the cache may hold, beyond which its least recently used are evicted.'''
+
+    def __init__(self, name, keyfunc=lambda x: x, tagfunc=lambda x: None, max_entries=None):
+        KeyedDict.__init__(self, keyfunc)
+        self.name = name
+        self.tagfunc = tagfunc
+        self.max_entries = max_entries
+        self.tags = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        cache_budget.register(self)
+
+    def count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def __contains__(self, x):
+        hit = KeyedDict.__contains__(self, x)
+        self.count(hit)
+        return hit
+
+    def contains_everywhere(self, x):
+        '''Whether x is in the cache on every process. The processes evict entries
+        independently, so use this rather than "in" where a miss leads to a collective
+        operation, such as assembling or factorizing.'''
+        hit = compatibility.all_processes(KeyedDict.__contains__(self, x))
+        self.count(hit)
+        return hit
+
+    def __getitem__(self, x):
+        key = self.keyfunc(x)
+        value = dict.__getitem__(self, key)
+        cache_budget.touch(self, key)
+        return value
+
+    def get(self, x, default=None):
+        key = self.keyfunc(x)
+        if not dict.__contains__(self, key):
+            return default
+        cache_budget.touch(self, key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, x, value):
+        self.set(x, value, estimate_nbytes(value))
+
+    def set(self, x, value, nbytes, tag=None):
+        '''Store value, which holds about nbytes of memory.'''
+        key = self.keyfunc(x)
+        cache_budget.remove(self, key)
+        dict.__setitem__(self, key, value)
+        self.tags[key] = tag if tag is not None else self.tagfunc(x)
+        cache_budget.add(self, key, nbytes)
+
+        if self.max_entries is not None:
+            excess = len(self) - self.max_entries()
+            if excess > 0:
+                # cache_budget.entries is in order of last use
+                victims = [k for (cache_id, k) in cache_budget.entries.keys() if cache_id == id(self) and k != key]
+                for victim in victims[:excess]:
+                    self.evict(victim)
+
+    def resize(self, x, nbytes):
+        '''Change the memory that the entry for x is counted as holding.'''
+        cache_budget.resize(self, self.keyfunc(x), nbytes)
+
+    def entry_nbytes(self, x):
+        return cache_budget.entries.get((id(self), self.keyfunc(x)), 0)
+
+    def __delitem__(self, x):
+        key = self.keyfunc(x)
+        dict.__delitem__(self, key)
+        self.tags.pop(key, None)
+        cache_budget.remove(self, key)
+
+    def evict(self, key):
+        if backend.parameters["adjoint"]["debug_cache"]:
+            backend.info_red("Evicting an entry from the %s cache" % self.name)
+        self.evictions += 1
+        dict.__delitem__(self, key)
+        self.tags.pop(key, None)
+        cache_budget.remove(self, key)
+
+    def invalidate(self, predicate):
+        '''Delete the entries for which predicate(key, tag) is true.'''
+        for key in [key for key in self.keys() if predicate(key, self.tags.get(key))]:
+            dict.__delitem__(self, key)
+            self.tags.pop(key, None)
+            cache_budget.remove(self, key)
+
+    def nbytes(self):
+        return sum(nbytes for ((cache_id, key), nbytes) in cache_budget.entries.items() if cache_id == id(self))
+
+    def clear(self):
+        KeyedDict.clear(self)
+        self.tags.clear()
+        if cache_budget is None:
+            # Called during process cleanup
+            return
+        for (cache_id, key) in list(cache_budget.entries.keys()):
+            if cache_id == id(self) and not dict.__contains__(self, key):
+                cache_budget.remove(self, key)
+
+    def stats(self):
+        return {"entries": len(self), "bytes": self.nbytes(), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
 
-soa_to_adj = re.compile(r'\[(?P<func>Functional:.*?):.*\]')
+def adj_cache_stats():
+    '''Return, for each of the factorization and assembly caches, the number of entries, their
+    estimated size in bytes, and the number of hits, misses and evictions so far. The size of
+    the caches is bounded by :py:data:`parameters["adjoint"]["cache_budget"]` (in bytes).'''
+    return dict((cache.name, cache.stats()) for cache in [lu_solvers, fwd_lu_solvers, assembled_adj_forms, assembled_operators,
+                                                           assembled_rhs_vectors, preassembled_terms])
+
+### Stuff for LU caching
 
 # For caching strategies: a dictionary that maps adj_variable to LUSolver
 # Not used by default
@@ -55,29 +276,228 @@ soa_to_adj = re.compile(r'\[(?P<func>Functional:.*?):.*\]')
 def lu_canonicalisation(var):
     # Return a string representation of var for indexing into the LU cache.
 
-    s = str(var)
+    # The adjoint operator does not depend on the functional, and the SOA operator is
+    # always the same as the ADM, so all of these share one factorization
+    if var.type in ['ADJ_ADJOINT', 'ADJ_SOA']:
+        return "%s:%d:%d:Adjoint" % (var.name, var.timestep, var.iteration)
+
+    return str(var)
+
+lu_solvers = BoundedCache("lu_solvers", keyfunc=lu_canonicalisation)
+
+# Set by drivers.compute_gradients while it solves the adjoint equations for several
+# functionals, so that the direct adjoint solves share factorizations through lu_solvers
+# even if parameters["adjoint"]["cache_factorizations"] is not set.
+shared_adjoint_solves = False
+
+# For replaying the forward model: a dictionary that maps the forward_operator_key of an
+# assembled operator, which describes the values of everything it depends on, to the LUSolver
+# that factorized it. Equations with the same operator, such as the timesteps of a time loop
+# whose operator does not change, share one factorization. The key changes with the values,
+# so unlike the other caches this one survives adj_reset_cache.
+fwd_lu_solvers = BoundedCache("fwd_lu_solvers")
+
+# Map from the canonical name of a forward variable to the key of the operator of its last
+# solve, and from each key to the number of variables whose last solve used it. A
+# factorization is dropped once no variable's last solve used it, so that there is at most
+# one per variable, as the adjoint solves may reuse them (see adjlinalg.Matrix.forward_factorization).
+fwd_operator_keys = {}
+fwd_operator_users = collections.Counter()
+
+def use_forward_operator(name, key):
+    '''Record that the last solve for the variable with the given canonical name used the
+    operator with the given key.'''
+
+    old = fwd_operator_keys.get(name)
+    if old == key:
+        return
+
+    fwd_operator_keys[name] = key
+    fwd_operator_users[key] += 1
+    if old is not None:
+        fwd_operator_users[old] -= 1
+        if fwd_operator_users[old] <= 0:
+            del fwd_operator_users[old]
+            if dict.__contains__(fwd_lu_solvers, old):
+                del fwd_lu_solvers[old]
 
-    # Since the SOA operator is always the same as the ADM, we can replace all
-    # requests for SOA operators with ADM ones
-    if var.type == 'ADJ_SOA':
-        s = soa_to_adj.sub(r'[\1]', s).replace("SecondOrderAdjoint", "Adjoint")
+def clear_forward_operators():
+    fwd_lu_solvers.clear()
+    fwd_operator_keys.clear()
+    fwd_operator_users.clear()
 
-    return s
+def coefficient_state(coeff):
+    # Describe the current value of a coefficient of a form. For Functions this hashes their
+    # whole local vector, on every forward solve that looks up a factorization: a pass over
+    # the values, cheap next to assembling and factorizing, but not free.
+    if isinstance(coeff, (int, float)):
+        return ("float", float(coeff))
+    elif isinstance(coeff, Constant):
+        return ("Constant", tuple(coeff.values()))
+    elif hasattr(coeff, "vector"):
+        values = coeff.vector().get_local()
+        return ("Function", str(values.dtype), len(values), hashlib.md5(values.tobytes()).hexdigest())
+    elif isinstance(coeff, backend.Expression):
+        # The parameters of an Expression may be Constants, Functions or Expressions too
+        return (coeff.__class__.__name__, id(coeff), expressions.expression_store.state(coeff),
+                tuple(coefficient_state(param) for param in expressions.parameter_coefficients(coeff)))
+    else:
+        return (coeff.__class__.__name__, id(coeff), expressions.expression_store.state(coeff))
 
-lu_solvers = KeyedDict(keyfunc=lu_canonicalisation)
+def dirichlet_dofs(bcs):
+    '''Return the set of the local dofs that the Dirichlet conditions among bcs constrain.'''
+    dofs = set()
+    for bc in bcs:
+        if isinstance(bc, backend.DirichletBC):
+            dofs.update(bc.get_boundary_values().keys())
+    return dofs
+
+def forward_operator_key(form, bcs, solver_parameters):
+    '''Return a key that changes whenever the matrix assembled from form, with bcs applied,
+    may change: the values of its coefficients, and the dofs the boundary conditions
+    constrain. The values of Dirichlet conditions only enter the right-hand side, so
+    time-dependent boundary values do not call for a new factorization.'''
+
+    coeffs = [coefficient_state(coeff) for coeff in ufl.algorithms.extract_coefficients(form)]
+
+    dofs = ",".join(str(dof) for dof in sorted(dirichlet_dofs(bcs)))
+    others = [id(bc) for bc in bcs if not isinstance(bc, backend.DirichletBC)]
+
+    return (form.signature(), tuple(coeffs), hashlib.md5(dofs.encode('utf8')).hexdigest(), tuple(others),
+            repr(solver_parameters))
 
 ### Stuff for preassembly caching
 
+# Forms are keyed by their signature, the coefficients and function spaces the signature
+# numbers, and the values of their Constants. UFL computes the signature, coefficients and
+# arguments of a form once and keeps them, so after the first lookup of a form its key costs
+# no traversal of the form; only the Constant values are read each time, as they may change.
+
+def space_id(fn_space):
+    try:
+        return fn_space.id()
+    except AttributeError:
+        return id(fn_space)
+
+def form_structure_key(form):
+    if not isinstance(form, Form):
+        return form
+    coeffs = form.coefficients()
+    return (form.signature(),
+            tuple(coeff.count() for coeff in coeffs),
+            tuple(space_id(arg.ufl_function_space()) for arg in form.arguments()),
+            tuple(domain.ufl_id() for domain in form.ufl_domains()))
+
 def form_constants(form):
-    constants = tuple([float(x) for x in ufl.algorithms.extract_coefficients(form) if isinstance(x, Constant)])
+    constants = tuple([tuple(x.values()) for x in form.coefficients() if isinstance(x, Constant)])
     return constants
 
 def form_key(form):
-    constants = form_constants(form)
-    return (form, constants)
+    if not isinstance(form, Form):
+        return (form, ())
+    return (form_structure_key(form), form_constants(form))
+
+def form_tag(form):
+    # What an assembled form depends on, for adjglobals.adj_reset_cache: the names of its
+    # Functions and of its Constants
+    if not isinstance(form, Form):
+        return None
+    coeffs = form.coefficients()
+    return (frozenset(str(coeff) for coeff in coeffs if hasattr(coeff, "vector")),
+            frozenset(coeff.adj_name for coeff in coeffs if hasattr(coeff, "adj_name")))
+
+class KeyedSet(set):
+    '''A set that applies a key function to its elements.'''
+
+    def __init__(self, keyfunc):
+        set.__init__(self)
+        self.keyfunc = keyfunc
+
+    def add(self, x):
+        set.add(self, self.keyfunc(x))
+
+    def __contains__(self, x):
+        return set.__contains__(self, self.keyfunc(x))
+
+assembled_fwd_forms = KeyedSet(form_structure_key)
+assembled_adj_forms = BoundedCache("assembled_adj_forms", keyfunc=form_key, tagfunc=form_tag)
+
+# For block actions: the operators assembled from the forms in assembled_fwd_forms, without
+# boundary conditions, so that the action of a block (or of its adjoint) is a matrix-vector
+# product rather than the assembly of an action form
+assembled_operators = BoundedCache("assembled_operators", keyfunc=form_key, tagfunc=form_tag)
+
+# For right-hand sides: a dictionary that maps the rhs_key of a linear form to its assembled
+# vector. The key describes the values of the coefficients, so like fwd_lu_solvers this
+# survives adj_reset_cache; as stale keys are never looked up again, it keeps only the
+# parameters["adjoint"]["cache_rhs_entries"] most recently used vectors, whatever the
+# cache budget.
+def rhs_key(form):
+    '''Return a key that changes whenever the vector assembled from form may change.'''
+    coeffs = [coefficient_state(coeff) for coeff in ufl.algorithms.extract_coefficients(form)]
+    domains = [id(domain) for domain in form.ufl_domains()]
+    spaces = [function_space_key(arg.ufl_function_space()) or space_id(arg.ufl_function_space()) for arg in form.arguments()]
+    return (form.signature(), tuple(domains), tuple(spaces), tuple(coeffs))
+
+assembled_rhs_vectors = BoundedCache("assembled_rhs_vectors",
+                                     max_entries=lambda: backend.parameters["adjoint"]["cache_rhs_entries"])
+
+# For preassembly: a dictionary that maps a key made from a form's plan_key, the index of a
+# term and the values of its Constants to the assembled term (see preassembly.py)
+preassembled_terms = BoundedCache("preassembled_terms")
+
+### Stuff for symbolic derivative caching
+
+def placeholder(fn):
+    # A Coefficient to stand in for fn in a cached form. It has no vector, so the cached
+    # forms keep no storage alive.
+    return ufl.Coefficient(fn.ufl_function_space())
+
+class SymbolicCache(dict):
+    '''Maps a key, saying which derivative (or adjoint, or action) of a form is taken, to
+    that derived form. Differentiating, expanding and taking adjoints depend only on the
+    structure of the form, so each derived form is built once, with placeholder Coefficients
+    in place of the Functions it is contracted with and acts on; each use of it only
+    replaces coefficients.'''
+
+    def form(self, key, build, coefficients, values, fns):
+        '''Return build(*fns), a form in the coefficients of the original form, with
+        coefficients replaced by values. build may return None for a form that is zero.'''
+
+        replacements = dict(zip(coefficients, values))
+
+        # Only Functions can be replaced by placeholders
+        if not all(isinstance(fn, backend.Function) for fn in fns):
+            form = build(*fns)
+        else:
+            if key not in self:
+                placeholders = [placeholder(fn) for fn in fns]
+                self[key] = (build(*placeholders), placeholders)
+            (form, placeholders) = self[key]
+            replacements.update(zip(placeholders, fns))
+
+        if form is None:
+            return None
+        return backend.replace(form, replacements)
+
+### Stuff for function space caching
+
+def function_space_key(fn_space):
+    # Identify function spaces (and subspaces) by what determines their layout; None if
+    # they cannot be
+    try:
+        return (repr(fn_space.ufl_element()), fn_space.mesh().id(), fn_space.dim(), tuple(fn_space.component()))
+    except (AttributeError, RuntimeError, TypeError):
+        return None
+
+# Map from (space_id of the receiving space, of the assigning space) to the FunctionAssigner
+# between them, or False if there is none
+function_assigners = {}
 
-assembled_fwd_forms = set()
-assembled_adj_forms = KeyedDict(keyfunc=form_key)
+# Map from function_space_key to the collapsed space, and to the number of degrees of
+# freedom owned by this process
+collapsed_spaces = {}
+local_sizes = {}
 
 ### Stuff for PointIntegralSolver caching
 pis_fwd_to_tlm = {}
@@ -1,55 +1,127 @@
+import array
 import libadjoint
 
 class CoeffStore(object):
     '''This object manages the mapping from Dolfin coefficients to libadjoint Variables.
     In the process, it also manages the incrementing of the timestep associated with each
-    variable, so that the user does not have to manually manage the time information.'''
+    variable, so that the user does not have to manually manage the time information.
+
+    Coefficients are identified by integer ids, allocated the first time their name is
+    seen, and the current (timestep, iteration) of each is kept in flat arrays. The store
+    also keeps track of which of the current variables are known to the adjointer, so
+    that checkpointing only needs to visit those.'''
+
+    __slots__ = ("ids", "names", "coeffs", "timesteps", "iterations", "libadjoint_timestep", "known", "live")
+
     def __init__(self):
-        self.coeffs = {}
+        # Map from coefficient name to id, and back
+        self.ids = {}
+        self.names = []
+        # The most recent coefficient object seen with each id (None if only seen by name)
+        self.coeffs = []
+        # The current timestep and iteration of each id; a timestep of -1 means the
+        # coefficient is not (or no longer) in the store
+        self.timesteps = array.array('l')
+        self.iterations = array.array('l')
         self.libadjoint_timestep = 0
-        self.str_to_coeff = {}
+        # (id, timestep, iteration) of the variables registered with the adjointer
+        self.known = set()
+        # The ids whose current variable is known to the adjointer
+        self.live = set()
+
+    def _id(self, coeff):
+        if isinstance(coeff, str):
+            name = coeff
+        else:
+            name = str(coeff)
+
+        try:
+            idx = self.ids[name]
+        except KeyError:
+            idx = len(self.names)
+            self.ids[name] = idx
+            self.names.append(name)
+            self.coeffs.append(None)
+            self.timesteps.append(-1)
+            self.iterations.append(0)
+
+        if not isinstance(coeff, str):
+            self.coeffs[idx] = coeff
+
+        return idx
+
+    def _set(self, idx, timestep, iteration):
+        self.timesteps[idx] = timestep
+        self.iterations[idx] = iteration
+
+        if (idx, timestep, iteration) in self.known:
+            self.live.add(idx)
+        else:
+            self.live.discard(idx)
 
     def next(self, coeff):
         '''Increment the timestep corresponding to the provided Dolfin
         coefficient and then return the corresponding libadjoint variable.'''
 
-        if not isinstance(coeff, str):
-            self.str_to_coeff[str(coeff)] = coeff
-
-        coeff = str(coeff)
+        idx = self._id(coeff)
 
-        try:
-            (timestep, iteration) = self.coeffs[coeff]
-            if timestep == self.libadjoint_timestep:
-                self.coeffs[coeff] = (timestep, iteration + 1)
-            else:
-                self.coeffs[coeff] = (self.libadjoint_timestep, 0)
-        except KeyError:
-            self.coeffs[coeff] = (self.libadjoint_timestep, 0)
+        if self.timesteps[idx] == self.libadjoint_timestep:
+            self._set(idx, self.libadjoint_timestep, self.iterations[idx] + 1)
+        else:
+            self._set(idx, self.libadjoint_timestep, 0)
 
-        (timestep, iteration) = self.coeffs[coeff]
-        return libadjoint.Variable(coeff, timestep, iteration)
+        return libadjoint.Variable(self.names[idx], self.timesteps[idx], self.iterations[idx])
 
     def __getitem__(self, coeff):
         '''Return the libadjoint variable corresponding to coeff.'''
 
-        if not isinstance(coeff, str):
-            self.str_to_coeff[str(coeff)] = coeff
+        idx = self._id(coeff)
 
-        coeff = str(coeff)
+        if self.timesteps[idx] == -1:
+            self._set(idx, self.libadjoint_timestep, 0)
 
-        if coeff not in self.coeffs:
-            self.coeffs[coeff] = (self.libadjoint_timestep, 0)
-
-        (timestep, iteration) = self.coeffs[coeff]
-        return libadjoint.Variable(coeff, timestep, iteration)
+        return libadjoint.Variable(self.names[idx], self.timesteps[idx], self.iterations[idx])
 
     def keys(self):
-        for i in self.coeffs:
-            yield self.str_to_coeff[i]
+        for idx in range(len(self.names)):
+            if self.timesteps[idx] != -1 and self.coeffs[idx] is not None:
+                yield self.coeffs[idx]
+
+    def coefficient(self, name):
+        '''Return the most recent coefficient seen with the given name, or None.'''
+
+        idx = self.ids.get(name)
+        if idx is None:
+            return None
+        return self.coeffs[idx]
+
+    def mark_known(self, var):
+        '''Record that the adjointer knows about the libadjoint variable var.'''
+
+        idx = self._id(var.name)
+        self.known.add((idx, var.timestep, var.iteration))
+
+        if self.timesteps[idx] == var.timestep and self.iterations[idx] == var.iteration:
+            self.live.add(idx)
+
+    def known_variables(self):
+        '''Iterate over the coefficients whose current variable is known to the
+        adjointer, yielding (coefficient, variable) pairs.'''
+
+        for idx in sorted(self.live):
+            coeff = self.coeffs[idx]
+            if coeff is None:
+                continue
+            yield (coeff, libadjoint.Variable(self.names[idx], self.timesteps[idx], self.iterations[idx]))
 
     def increment_timestep(self):
         self.libadjoint_timestep += 1
 
     def forget(self, coeff):
-        del self.coeffs[str(coeff)]
+        idx = self.ids[str(coeff)]
+        if self.timesteps[idx] == -1:
+            raise KeyError(str(coeff))
+
+        self.timesteps[idx] = -1
+        self.iterations[idx] = 0
+        self.live.discard(idx)
@@ -171,6 +171,24 @@ def rank(comm):
         return comm.rank
 
 
+def size(comm):
+    if backend.__name__ == "dolfin":
+        return backend.MPI.size(comm)
+    else:
+        return comm.size
+
+
+def all_processes(flag):
+    """Return whether flag is true on every process, for decisions that lead to collective operations."""
+    if size(backend.comm_world) > 1:
+        if backend.__name__ == "dolfin":
+            return backend.MPI.min(backend.comm_world, float(flag)) > 0
+        else:
+            from mpi4py import MPI
+            return backend.comm_world.allreduce(float(flag), op=MPI.MIN) > 0
+    return flag
+
+
 def form_comm(form):
     """Return the communicator associated with a form."""
     if backend.__name__ == "dolfin":
@@ -1,10 +1,19 @@
 import backend
 import copy
+from . import paramstore
 
 constant_values = {}
 constant_objects = {}
 scalar_parameters = []
 
+def assign_constant(name, key, value):
+    # The values of Constants that are controls are set by the optimisation, not the tape.
+    if name in scalar_parameters:
+        return False
+    backend.Constant.assign(constant_objects[name], backend.Constant(value))
+
+constant_store = paramstore.ParameterStore(assign_constant)
+
 class Constant(backend.Constant):
     '''The Constant class is overloaded so that you can give :py:class:`Constants` *names*. For example,
 
@@ -29,10 +38,12 @@ class Constant(backend.Constant):
 
         constant_values[name] = value
         constant_objects[name] = self
+        constant_store.record(name, "value", copy.copy(value))
 
     def assign(self, value):
         backend.Constant.assign(self, value)
         constant_values[self.adj_name] = value
+        constant_store.record(self.adj_name, "value", copy.copy(value))
 
 def get_constant(a):
     if isinstance(a, Constant):
@@ -41,14 +52,10 @@ def get_constant(a):
         return constant_objects[a]
 
 def freeze_dict():
-    new_dict = {}
-    for name in constant_objects:
-        new_dict[constant_objects[name]] = copy.copy(constant_values[name])
-
-    return new_dict
+    '''Return a handle to the current state of the named Constants.'''
+    return constant_store.freeze()
 
-def update_constants(d):
-    for constant in d:
-        name = constant.adj_name
-        if name not in scalar_parameters:
-            backend.Constant.assign(constant_objects[name], backend.Constant(d[constant]))
+def update_constants(version, names=None):
+    '''Restore the named Constants (only those named in names, if given) to the state
+    returned by freeze_dict.'''
+    constant_store.restore(version, names)
@@ -74,6 +74,16 @@ class DolfinAdjointControl(libadjoint.Parameter):
         direction m_dot.'''
         raise NotImplementedError
 
+    def variables(self):
+        '''Return the forward variables through which the Control enters the model, or None if
+        it may enter any equation directly (as a Constant in a form does).'''
+        return None
+
+    def constants(self):
+        '''Return the names of the Constants through which the Control enters the model, or
+        None if it is not known which parts of the model it enters.'''
+        return None
+
 class FunctionControl(DolfinAdjointControl):
     '''This Parameter is used as input to the tangent linear model (TLM)
     when one wishes to compute dJ/d(initial condition) in a particular direction (perturbation).'''
@@ -118,6 +128,12 @@ class FunctionControl(DolfinAdjointControl):
     def __str__(self):
         return self.var.name + ':InitialCondition'
 
+    def variables(self):
+        return [self.var]
+
+    def constants(self):
+        return []
+
     def equation_partial_derivative(self, adjointer, adjoint, i, variable):
         if self.var == variable:
             return adjoint
@@ -376,6 +392,11 @@ dictionary.")
         direction m_dot.'''
         return ConstantControl(self.a, coeff=m_dot)
 
+    def constants(self):
+        if isinstance(self.a, str):
+            return [self.a]
+        return [self.a.adj_name]
+
 class ConstantControls(DolfinAdjointControl):
     '''This Parameter is used as input to the tangent linear model (TLM)
     when one wishes to compute dJ/dv . delta v, where v is a vector of ControlControls.'''
@@ -384,6 +405,9 @@ class ConstantControls(DolfinAdjointControl):
         if dv is not None:
             self.dv = dv
 
+    def constants(self):
+        return [a.adj_name for a in self.v]
+
     def __call__(self, adjointer, i, dependencies, values, variable):
         diff_form = None
         assert self.dv is not None, "Need a perturbation direction to use in the TLM."
@@ -515,6 +539,24 @@ class ListControl(DolfinAdjointControl):
     def __getitem__(self, i):
         return self.controls[i]
 
+    def variables(self):
+        out = []
+        for p in self.controls:
+            variables = p.variables()
+            if variables is None:
+                return None
+            out += variables
+        return out
+
+    def constants(self):
+        out = []
+        for p in self.controls:
+            constants = p.constants()
+            if constants is None:
+                return None
+            out += constants
+        return out
+
 def _add(x, y):
     if x is None:
         return y
@@ -3,6 +3,7 @@ from .controls import *
 from backend import info_red, info_blue, info, info_green, parameters
 import backend
 from . import adjglobals
+from . import adjlinalg
 import backend
 from . import constant
 from . import adjresidual
@@ -11,6 +12,7 @@ from .enlisting import enlist, delist
 from numpy import ndarray
 from .functional import Functional
 from . import misc
+from . import caching
 
 def replay_dolfin(forget=False, tol=0.0, stop=False):
 
@@ -21,7 +23,7 @@ def replay_dolfin(forget=False, tol=0.0, stop=False):
         success = True
         for i in range(adjglobals.adjointer.equation_count):
             (fwd_var, output) = adjglobals.adjointer.get_forward_solution(i)
-            storage = libadjoint.MemoryStorage(output)
+            storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output))
             storage.set_compare(tol=tol)
             storage.set_overwrite(True)
             out = adjglobals.adjointer.record_variable(fwd_var, storage)
@@ -49,20 +51,25 @@ def compute_adjoint(functional, forget=True, ignore=[]):
     for i in range(adjglobals.adjointer.timestep_count):
         adjglobals.adjointer.set_functional_dependencies(functional, i)
 
+    active = adjoint_slice(functional)
+
     for i in range(adjglobals.adjointer.equation_count)[::-1]:
         fwd_var = adjglobals.adjointer.get_forward_variable(i)
         if fwd_var in ignorelist:
             info("Ignoring the adjoint equation for %s" % fwd_var)
             continue
 
-        (adj_var, output) = adjglobals.adjointer.get_adjoint_solution(i, functional)
+        if active is not None and i not in active:
+            (adj_var, output) = zero_adjoint_solution(i, functional)
+        else:
+            (adj_var, output) = adjglobals.adjointer.get_adjoint_solution(i, functional)
         if output.data:
             if backend.__name__ == "dolfin":
                 output.data.rename(str(adj_var) , "a Function from dolfin-adjoint")
             else:
                 output.data.name = str(adj_var)
 
-        storage = libadjoint.MemoryStorage(output)
+        storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output))
         storage.set_overwrite(True)
         adjglobals.adjointer.record_variable(adj_var, storage)
 
@@ -78,17 +85,58 @@ def compute_adjoint(functional, forget=True, ignore=[]):
 
         yield (output.data, adj_var)
 
+    report_slice(active)
+
+def adjoint_slice(functional):
+    '''If parameters["adjoint"]["slice_tape"] is set, return the set of indices of the
+    equations that the functional depends on, directly or indirectly. The adjoint
+    solutions of all the other equations are zero. Returns None if every adjoint
+    equation must be solved.'''
+
+    if not backend.parameters["adjoint"]["slice_tape"]:
+        return None
+
+    adjointer = adjglobals.adjointer
+    if len(adjglobals.tape_graph) != adjointer.equation_count:
+        # Some equations were registered behind our back; we know nothing about them
+        return None
+
+    targets = []
+    for timestep in range(adjointer.timestep_count):
+        targets += functional.dependencies(adjointer, timestep)
+
+    return adjglobals.tape_graph.backward_slice(targets)
+
+def zero_adjoint_solution(i, functional):
+    '''Return the adjoint variable and (zero) solution of equation i, for an equation
+    outside the slice of the functional.'''
+
+    adj_var = adjglobals.adjointer.get_forward_variable(i).to_adjoint(functional)
+    output = adjlinalg.Vector(backend.Function(adjglobals.tape_graph.fn_space(i)), zero=True)
+    return (adj_var, output)
+
+def report_slice(active, kind="adjoint"):
+    if active is not None:
+        count = adjglobals.adjointer.equation_count
+        info("Slicing the tape skipped %d of %d %s solves" % (count - len(active), count, kind))
+
 def compute_tlm(parameter, forget=False):
 
     if isinstance(parameter, (list, tuple)):
         parameter = ListControl(parameter)
 
+    active = tlm_slice(parameter)
+
     for i in range(adjglobals.adjointer.equation_count):
-        (tlm_var, output) = adjglobals.adjointer.get_tlm_solution(i, parameter)
+        if active is not None and i not in active:
+            tlm_var = adjglobals.adjointer.get_forward_variable(i).to_tlm(parameter)
+            output = adjlinalg.Vector(backend.Function(adjglobals.tape_graph.fn_space(i)), zero=True)
+        else:
+            (tlm_var, output) = adjglobals.adjointer.get_tlm_solution(i, parameter)
         if output.data:
             output.data.rename(str(tlm_var), "a Function from dolfin-adjoint")
 
-        storage = libadjoint.MemoryStorage(output)
+        storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output))
         storage.set_overwrite(True)
         adjglobals.adjointer.record_variable(tlm_var, storage)
 
@@ -104,29 +152,58 @@ def compute_tlm(parameter, forget=False):
         else:
             adjglobals.adjointer.forget_tlm_values(i)
 
+    report_slice(active, "tangent linear")
+
+def tlm_slice(parameter):
+    '''If parameters["adjoint"]["slice_tape"] is set, return the set of indices of the
+    equations that depend on the control parameter, directly or indirectly. The
+    tangent linear solutions of all the other equations are zero. Returns None if
+    every tangent linear equation must be solved.'''
+
+    if not backend.parameters["adjoint"]["slice_tape"]:
+        return None
+
+    if len(adjglobals.tape_graph) != adjglobals.adjointer.equation_count:
+        return None
+
+    sources = parameter.variables() if hasattr(parameter, "variables") else None
+    if sources is None:
+        return None
+
+    return adjglobals.tape_graph.forward_slice(sources)
 
 def compute_gradient(J, param, forget=True, ignore=[], callback=lambda var, output: None, project=False):
     if not isinstance(J, Functional):
         raise ValueError("J must be of type dolfin_adjoint.Functional.")
 
+    return compute_gradients([J], param, forget=forget, ignore=ignore, callback=callback, project=project)[0]
+
+def compute_gradients(Js, param, forget=True, ignore=[], callback=lambda var, output: None, project=False):
+    '''Compute the gradients of each of the functionals Js with respect to param, in one
+    backward sweep. At each equation, the adjoint equations of all the functionals are
+    solved one after the other, so that they share the assembly and factorization of
+    the adjoint operator where it is solved with a direct method. Returns a list with
+    the gradient of each functional.'''
+
+    for J in Js:
+        if not isinstance(J, Functional):
+            raise ValueError("Each of Js must be of type dolfin_adjoint.Functional.")
+
     flag = misc.pause_annotation()
 
     enlisted_controls = enlist(param)
     param = ListControl(enlisted_controls)
 
-    if backend.parameters["adjoint"]["allow_zero_derivatives"]:
-        dJ_init = []
-        for c in enlisted_controls:
-            if isinstance(c.data(), backend.Constant):
-                dJ_init.append(backend.Constant(0))
-            elif isinstance(c.data(), backend.Function):
-                space = c.data().function_space()
-                dJ_init.append(backend.Function(space))
-
-    else:
-        dJ_init = [None] * len(enlisted_controls)
-
-    dJdparam = enlisted_controls.__class__(dJ_init)
+    dJdparams = []
+    for J in Js:
+        if backend.parameters["adjoint"]["allow_zero_derivatives"]:
+            dJ_init = []
+            for c in enlisted_controls:
+                if isinstance(c.data(), (backend.Constant, backend.Function)):
+                    dJ_init.append(zero_derivative(c))
+        else:
+            dJ_init = [None] * len(enlisted_controls)
+        dJdparams.append(enlisted_controls.__class__(dJ_init))
 
     last_timestep = adjglobals.adjointer.timestep_count
 
@@ -139,46 +216,90 @@ def compute_gradient(J, param, forget=True, ignore=[], callback=lambda var, outp
         else:
             ignorelist.append(fn)
 
-    for i in range(adjglobals.adjointer.timestep_count):
-        adjglobals.adjointer.set_functional_dependencies(J, i)
-
-    for i in range(adjglobals.adjointer.equation_count)[::-1]:
-        fwd_var = adjglobals.adjointer.get_forward_variable(i)
-        if fwd_var in ignorelist:
-            info("Ignoring the adjoint equation for %s" % fwd_var)
-            continue
+    actives = []
+    # Whether any equations were skipped for each functional
+    sliced = [False] * len(Js)
+    for J in Js:
+        for i in range(adjglobals.adjointer.timestep_count):
+            adjglobals.adjointer.set_functional_dependencies(J, i)
+        actives.append(adjoint_slice(J))
+
+    # Share the factorizations of the adjoint operators between the functionals. Unless
+    # they are cached anyway, each is dropped once all the functionals are done with it,
+    # so that no more than one is held at a time.
+    shared = caching.shared_adjoint_solves
+    share = len(Js) > 1 and not shared
+    drop = share and not backend.parameters["adjoint"]["cache_factorizations"]
+    if share:
+        caching.shared_adjoint_solves = True
+
+    try:
+        for i in range(adjglobals.adjointer.equation_count)[::-1]:
+            fwd_var = adjglobals.adjointer.get_forward_variable(i)
+            if fwd_var in ignorelist:
+                info("Ignoring the adjoint equation for %s" % fwd_var)
+                continue
+
+            for (k, J) in enumerate(Js):
+                skipped = actives[k] is not None and i not in actives[k]
+                if skipped:
+                    sliced[k] = True
+                    (adj_var, output) = zero_adjoint_solution(i, J)
+                else:
+                    (adj_var, output) = adjglobals.adjointer.get_adjoint_solution(i, J)
+
+                callback(adj_var, output.data)
+
+                storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output))
+                storage.set_overwrite(True)
+                adjglobals.adjointer.record_variable(adj_var, storage)
 
-        (adj_var, output) = adjglobals.adjointer.get_adjoint_solution(i, J)
+                if not skipped:
+                    out = param.equation_partial_derivative(adjglobals.adjointer, output.data, i, fwd_var)
+                    dJdparams[k] = _add(dJdparams[k], out)
 
-        callback(adj_var, output.data)
+                if last_timestep > adj_var.timestep:
+                    # We have hit a new timestep, and need to compute this timesteps' \partial J/\partial m contribution
+                    out = param.functional_partial_derivative(adjglobals.adjointer, J, adj_var.timestep)
+                    dJdparams[k] = _add(dJdparams[k], out)
 
-        storage = libadjoint.MemoryStorage(output)
-        storage.set_overwrite(True)
-        adjglobals.adjointer.record_variable(adj_var, storage)
-        fwd_var = libadjoint.Variable(adj_var.name, adj_var.timestep, adj_var.iteration)
+            last_timestep = fwd_var.timestep
 
-        out = param.equation_partial_derivative(adjglobals.adjointer, output.data, i, fwd_var)
-        dJdparam = _add(dJdparam, out)
+            if drop:
+                name = caching.lu_canonicalisation(fwd_var.to_adjoint(Js[0]))
+                caching.lu_solvers.invalidate(lambda key, tag: key == name)
 
-        if last_timestep > adj_var.timestep:
-            # We have hit a new timestep, and need to compute this timesteps' \partial J/\partial m contribution
-            out = param.functional_partial_derivative(adjglobals.adjointer, J, adj_var.timestep)
-            dJdparam = _add(dJdparam, out)
+            if forget is None:
+                pass
+            elif forget:
+                adjglobals.adjointer.forget_adjoint_equation(i)
+            else:
+                adjglobals.adjointer.forget_adjoint_values(i)
+    finally:
+        caching.shared_adjoint_solves = shared
 
-        last_timestep = adj_var.timestep
+    for active in actives:
+        report_slice(active)
 
-        if forget is None:
-            pass
-        elif forget:
-            adjglobals.adjointer.forget_adjoint_equation(i)
-        else:
-            adjglobals.adjointer.forget_adjoint_values(i)
+    # The skipped equations would have contributed zero derivatives; if none of the
+    # others reached a control, its derivative is zero rather than missing
+    for (k, dJdparam) in enumerate(dJdparams):
+        if sliced[k]:
+            dJdparams[k] = dJdparam.__class__([zero_derivative(c) if dJdm is None else dJdm
+                                               for (c, dJdm) in zip(enlisted_controls, dJdparam)])
 
-    rename(J, dJdparam, param)
+    for (J, dJdparam) in zip(Js, dJdparams):
+        rename(J, dJdparam, param)
 
     misc.continue_annotation(flag)
 
-    return postprocess(dJdparam, project, list_type=enlisted_controls)
+    return [postprocess(dJdparam, project, list_type=enlisted_controls) for dJdparam in dJdparams]
+
+def zero_derivative(control):
+    '''Return the derivative of a functional that does not depend on control.'''
+    if isinstance(control.data(), backend.Function):
+        return backend.Function(control.data().function_space())
+    return backend.Constant(0)
 
 def rename(J, dJdparam, param):
     if isinstance(dJdparam, list):
@@ -263,7 +384,7 @@ class BasicHessian(libadjoint.Matrix):
                 adj = adjglobals.adjointer.get_adjoint_solution(i, self.J)[1]
                 adj_timer.stop()
 
-                storage = libadjoint.MemoryStorage(adj)
+                storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(adj))
                 adjglobals.adjointer.record_variable(adj_var, storage)
 
             adj = adj.data
@@ -301,7 +422,7 @@ class BasicHessian(libadjoint.Matrix):
 
             func_timer.stop()
 
-            storage = libadjoint.MemoryStorage(soa_vec)
+            storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(soa_vec))
             storage.set_overwrite(True)
             adjglobals.adjointer.record_variable(soa_var, storage)
 
@@ -1,13 +1,17 @@
 import backend
-import collections
 import copy
+import ufl
+from . import paramstore
 
 # Our equation may depend on Expressions, and those Expressions may have parameters
 # (e.g. for time-dependent boundary conditions).
 # In order to successfully replay the forward solve, we need to keep those parameters around.
-# Here, we overload the Expression class to record all of the parameters
+# Here, we overload the Expression class to record all of the parameters as they are set.
 
-expression_attrs = collections.defaultdict(set)
+def assign_expression_attr(expression, k, v):
+    expression_setattr(expression, k, v)
+
+expression_store = paramstore.ParameterStore(assign_expression_attr)
 
 if backend.__name__ == "dolfin":
     # A rant:
@@ -19,36 +23,40 @@ if backend.__name__ == "dolfin":
     # and go down the rabbit hole.)
     # Instead, I am forced into my own piece of underhanded trickery.
 
-    expression_init = backend.Expression.__init__
-    def __init__(self, *args, **kwargs):
-        expression_init(self, *args, **kwargs)
-        attr_list = expression_attrs[self]
-        attr_list.union(list(kwargs.keys()))
-
-    backend.Expression.__init__ = __init__
-
     expression_setattr = backend.Expression.__setattr__
     def __setattr__(self, k, v):
         expression_setattr(self, k, v)
         if k not in ["_ufl_element", "_ufl_shape", "_ufl_function_space", "_count", "_countedclass", "_repr", 
                      "_element", "this", "_value_shape", "user_parameters", "_hash"]: # <-- you may need to add more here as dolfin changes
-            attr_list = expression_attrs[self]
-            attr_list.add(k)
+            expression_store.record(self, k, copy.copy(v))
     backend.Expression.__setattr__ = __setattr__
 
-def update_expressions(d):
-    for expression in d:
-        expr_dict = d[expression]
-        for k in expr_dict:
-            backend.Expression.__setattr__(expression, k, expr_dict[k])
+def parameter_coefficients(expression):
+    '''Return the coefficients (Constants, Functions and other Expressions) that the
+    parameters of expression are set to.'''
+
+    keys = set(expression_store.current(expression).keys())
+    for attr in ["user_parameters", "_parameters"]:
+        try:
+            keys.update(getattr(expression, attr).keys())
+        except (AttributeError, TypeError, RuntimeError):
+            pass
+
+    coeffs = []
+    for key in sorted(keys):
+        try:
+            value = getattr(expression, key)
+        except (AttributeError, RuntimeError):
+            continue
+        if isinstance(value, ufl.Coefficient) and value is not expression:
+            coeffs.append(value)
+    return coeffs
+
+def update_expressions(version, objs=None):
+    '''Restore the Expression parameters (of the Expressions objs, if given) to the state
+    returned by freeze_dict.'''
+    expression_store.restore(version, objs)
 
 def freeze_dict():
-    new_dict = {}
-    for expression in expression_attrs:
-        attr_list = expression_attrs[expression]
-        new_dict[expression] = {}
-
-        for attr in attr_list:
-            new_dict[expression][attr] = copy.copy(getattr(expression, attr))
-
-    return new_dict
+    '''Return a handle to the current state of the Expression parameters.'''
+    return expression_store.freeze()
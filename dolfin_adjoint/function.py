@@ -77,7 +77,7 @@ def dolfin_adjoint_assign(self, other, annotate=None, *args, **kwargs):
     dep = adjglobals.adj_variables.next(self)
 
     if backend.parameters["adjoint"]["record_all"]:
-        adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.Vector(self)))
+        adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.storage_vector(self)))
 
     rhs = LinComRHS(functions, weights, fn_space)
     register_initial_conditions(zip(rhs.coefficients(),rhs.dependencies()), linear=True)
@@ -109,7 +109,7 @@ def dolfin_adjoint_interpolate(self, other, annotate=None):
     out = dolfin_interpolate(self, other)
     if annotate is True:
         assignment.register_assign(self, other, op=backend.interpolate)
-        adjglobals.adjointer.record_variable(adjglobals.adj_variables[self], libadjoint.MemoryStorage(adjlinalg.Vector(self)))
+        adjglobals.adjointer.record_variable(adjglobals.adj_variables[self], libadjoint.MemoryStorage(adjlinalg.storage_vector(self)))
 
     return out
 
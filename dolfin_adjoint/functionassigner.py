@@ -34,7 +34,7 @@ if hasattr(backend, 'FunctionAssigner'):
 
                 solving.register_initial_conditions(zip(rhs.coefficients(),rhs.dependencies()), linear=True)
                 if backend.parameters["adjoint"]["record_all"]:
-                    adjglobals.adjointer.record_variable(receiving_dep, libadjoint.MemoryStorage(adjlinalg.Vector(receiving_super)))
+                    adjglobals.adjointer.record_variable(receiving_dep, libadjoint.MemoryStorage(adjlinalg.storage_vector(receiving_super)))
 
                 eq = libadjoint.Equation(receiving_dep, blocks=[receiving_identity], targets=[receiving_dep], rhs=rhs)
                 cs = adjglobals.adjointer.register_equation(eq)
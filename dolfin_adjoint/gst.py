@@ -175,7 +175,7 @@ def perturbed_replay(parameter, perturbation, perturbation_scale, observation, p
         if callback is not None:
             callback(fwd_var, output.data, unperturbed)
 
-        storage = libadjoint.MemoryStorage(output)
+        storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output))
         storage.set_compare(tol=None)
         storage.set_overwrite(True)
         out = adjglobals.adjointer.record_variable(fwd_var, storage)
@@ -34,7 +34,7 @@ def interpolate(v, V, annotate=None, name=None):
                 dep = adjglobals.adj_variables.next(out)
 
                 if backend.parameters["adjoint"]["record_all"]:
-                    adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.Vector(out)))
+                    adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.storage_vector(out)))
 
                 initial_eq = libadjoint.Equation(dep, blocks=[identity_block], targets=[dep], rhs=rhs)
                 cs = adjglobals.adjointer.register_equation(initial_eq)
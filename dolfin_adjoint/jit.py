@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+
+import backend
+import ufl
+
+from . import adjglobals
+from . import compatibility
+from . import utils
+
+# Compiling the forms of the adjoint sweeps ahead of time. The adjoint operators and the
+# derivatives of the annotated equations only appear once the first adjoint (or Hessian)
+# sweep starts, which then spends most of its time in the form compiler. After the
+# forward run,
+#
+#   adj_jit_warmup()
+#
+# builds the forms the callbacks of each equation on the tape will build, and compiles
+# them into the form cache, where the sweeps find them. Forms are compiled once for each
+# signature, so the equations of a timestep loop cost no more than one of them.
+
+# The forms being compiled by the process pool, which its worker processes inherit, as they
+# are forked (see fork_pool)
+pending = []
+
+def compile_form(form):
+    '''Compile form into the form cache. Returns whether it compiled.'''
+    try:
+        backend.Form(form)
+        return True
+    except Exception as e:
+        backend.warning("Could not compile a form for the adjoint: %s" % e)
+        return False
+
+def compile_pending(i):
+    return compile_form(pending[i])
+
+def fork_pool(processes):
+    '''Return a pool of processes forked from this one, which see the pending forms, or
+    None if processes cannot be forked here.'''
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        return None
+    except AttributeError:
+        # Python 2, whose pools fork wherever they can
+        if os.name != "posix":
+            return None
+        context = multiprocessing
+    return context.Pool(processes)
+
+def backward_forms(hessian=False):
+    '''Return the forms the callbacks of the equations on the tape build, one for each
+    signature.'''
+
+    forms = {}
+    seen = set()
+
+    for (template, rhs) in adjglobals.annotated_equations:
+        for obj in [template, rhs]:
+            # Templates are shared between equations on a compacted tape
+            if id(obj) in seen or not hasattr(obj, "backward_forms"):
+                continue
+            seen.add(id(obj))
+
+            if isinstance(getattr(obj, "form", None), ufl.Form) and utils._has_multimesh(obj.form):
+                continue
+            if hasattr(obj, "eq_lhs") and utils._has_multimesh(obj.eq_lhs):
+                continue
+
+            for form in obj.backward_forms(hessian=hessian):
+                if len(form.integrals()) > 0:
+                    forms.setdefault(form.signature(), form)
+
+    return list(forms.values())
+
+def adj_jit_warmup(hessian=False, processes=1):
+    '''Compile the forms the adjoint sweeps will assemble for the equations annotated so far,
+    so that the first gradient does not wait for the form compiler. If hessian, also compile
+    those of the tangent linear and second order adjoint sweeps, for Hessian actions.
+
+    With processes greater than 1, the forms are compiled in that many processes at once.
+    This is only done when running in serial, on platforms that can fork: the processes are
+    forked from this one, which has already initialised MPI through dolfin. They only run
+    the form compiler and exit without finalising MPI, but some MPI implementations warn
+    about (or do not support) forking at all, so it is not done by default. Returns the
+    number of forms compiled.
+
+    The right-hand sides that the adjoint sweeps sum from several of these forms, and the
+    derivatives of functionals, are still compiled when first assembled.'''
+
+    global pending
+
+    if backend.__name__ != "dolfin":
+        return 0
+
+    forms = backward_forms(hessian=hessian)
+
+    if processes > 1 and len(forms) > 1 and compatibility.size(backend.comm_world) == 1:
+        # The workers write the compiled forms to the disk cache, from which this process
+        # then loads them below
+        pool = fork_pool(processes)
+        if pool is not None:
+            pending = forms
+            try:
+                pool.map(compile_pending, range(len(forms)))
+            finally:
+                pool.close()
+                pool.join()
+                pending = []
+
+    return len([form for form in forms if compile_form(form)])
@@ -7,6 +7,7 @@ from . import adjlinalg
 from . import adjglobals
 from . import misc
 from . import utils
+from . import warmstart
 
 krylov_solvers = []
 adj_krylov_solvers = []
@@ -227,7 +228,12 @@ class KrylovSolver(dolfin.KrylovSolver):
                     if tnsp_ is not None:
                         tnsp_.orthogonalize(rhs)
 
-                    solver.solve(x.vector(), rhs)
+                    warm = warmstart.initial_guess(("krylov", idx), var, x.vector())
+                    if warm:
+                        solver.parameters["nonzero_initial_guess"] = True
+
+                    its = solver.solve(x.vector(), rhs)
+                    warmstart.record(("krylov", idx), var, x.vector(), its, warm)
                     return adjlinalg.Vector(x)
 
             solving.annotate(A == b, u, bcs, matrix_class=KrylovSolverMatrix, initial_guess=parameters['nonzero_initial_guess'], replace_map=True)
@@ -235,7 +241,7 @@ class KrylovSolver(dolfin.KrylovSolver):
         out = dolfin.KrylovSolver.solve(self, *args, **kwargs)
 
         if to_annotate and dolfin.parameters["adjoint"]["record_all"]:
-            adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.Vector(u)))
+            adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.storage_vector(u)))
 
         return out
 
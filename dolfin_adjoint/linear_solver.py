@@ -179,7 +179,7 @@ class LinearSolver(dolfin.LinearSolver):
         out = dolfin.LinearSolver.solve(self, *args, **kwargs)
 
         if to_annotate and dolfin.parameters["adjoint"]["record_all"]:
-            adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.Vector(u)))
+            adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.storage_vector(u)))
 
         return out
 
@@ -74,7 +74,7 @@ class LocalSolver(dolfin.LocalSolver):
             # checkpointing
             if dolfin.parameters["adjoint"]["record_all"]:
                 adjglobals.adjointer.record_variable(adjglobals.adj_variables[x],
-                           libadjoint.MemoryStorage(adjlinalg.Vector(x)))
+                           libadjoint.MemoryStorage(adjlinalg.storage_vector(x)))
 
         return out
 
@@ -6,9 +6,13 @@ from . import adjglobals
 from . import adjlinalg
 from . import misc
 from . import utils
+from . import tapegraph
 
 lu_solvers = []
 adj_lu_solvers = []
+# The keys of the variables solved for with each of the lu_solvers, so that
+# adjglobals.adj_reset_cache can tell which factorizations are affected by the controls
+lu_variables = []
 
 def make_LUSolverMatrix(idx, reuse_factorization):
     class LUSolverMatrix(adjlinalg.Matrix):
@@ -31,6 +35,14 @@ def make_LUSolverMatrix(idx, reuse_factorization):
                 solver = lu_solvers[idx]
 
             else:
+                if adj_lu_solvers[idx] is None and lu_solvers[idx] is not None and transposable(lu_solvers[idx], bcs):
+                    if getattr(self, "self_adjoint", False):
+                        # The forward solver has factorized this matrix already
+                        adj_lu_solvers[idx] = lu_solvers[idx]
+                    else:
+                        # The forward solver has factorized the transpose of this matrix already
+                        adj_lu_solvers[idx] = adjlinalg.TransposeSolver(lu_solvers[idx], bcs)
+
                 if adj_lu_solvers[idx] is None:
                     A = assembly.assemble(self.data); [bc.apply(A) for bc in bcs]
                     adj_lu_solvers[idx] = LUSolver(A)
@@ -55,8 +67,20 @@ def make_LUSolverMatrix(idx, reuse_factorization):
                 solver.solve(x.data.vector(), b_vec, annotate=False)
 
             return x
+
+    # Lets solving.annotate share blocks between solves with the same LUSolver.
+    LUSolverMatrix.block_key = ("LUSolverMatrix", idx, reuse_factorization)
     return LUSolverMatrix
 
+def transposable(solver, bcs):
+    '''Return whether the adjoint solves with the boundary conditions bcs can use the transpose
+    of the factorization in the forward solver.'''
+
+    if not hasattr(solver, "solve_transpose") or dolfin.parameters["adjoint"]["symmetric_bcs"]:
+        return False
+
+    return adjlinalg.same_dirichlet_dofs(getattr(solver, "op_bcs", []), bcs)
+
 class LUSolver(dolfin.LUSolver):
     '''This object is overloaded so that solves using this class are automatically annotated,
     so that libadjoint can automatically derive the adjoint and tangent linear models.'''
@@ -136,13 +160,17 @@ class LUSolver(dolfin.LUSolver):
                 self.__global_list_idx__ = len(lu_solvers)
                 lu_solvers.append(self)
                 adj_lu_solvers.append(None)
+                lu_variables.append(set())
 
             solving.annotate(A == b, x, eq_bcs, solver_parameters={"linear_solver": "lu"}, matrix_class=make_LUSolverMatrix(self.__global_list_idx__, self.parameters["reuse_factorization"]))
 
+            if self.__global_list_idx__ is not None:
+                lu_variables[self.__global_list_idx__].add(tapegraph.variable_key(adjglobals.adj_variables[x]))
+
         out = dolfin.LUSolver.solve(self, *args, **kwargs)
 
         if to_annotate:
             if dolfin.parameters["adjoint"]["record_all"]:
-                adjglobals.adjointer.record_variable(adjglobals.adj_variables[x], libadjoint.MemoryStorage(adjlinalg.Vector(x)))
+                adjglobals.adjointer.record_variable(adjglobals.adj_variables[x], libadjoint.MemoryStorage(adjlinalg.storage_vector(x)))
 
         return out
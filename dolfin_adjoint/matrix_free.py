@@ -203,13 +203,13 @@ class AdjointPETScKrylovSolver(backend.PETScKrylovSolver):
 
             eqn = libadjoint.Equation(var, blocks=[diag_block], targets=[var], rhs=rhs)
             cs = adjglobals.adjointer.register_equation(eqn)
-            solving.do_checkpoint(cs, var, rhs)
+            solving.do_checkpoint(cs, var, rhs, dependencies, operator_constants=None)
 
         out = backend.PETScKrylovSolver.solve(self, *args)
 
         if annotate:
             if backend.parameters["adjoint"]["record_all"]:
-                adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.Vector(x.function)))
+                adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.storage_vector(x.function)))
 
         timer.stop()
 
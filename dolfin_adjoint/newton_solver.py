@@ -35,6 +35,6 @@ class NewtonSolver(dolfin.NewtonSolver):
         out = dolfin.NewtonSolver.solve(*newargs, **kwargs)
 
         if to_annotate and dolfin.parameters["adjoint"]["record_all"]:
-            adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.Vector(u)))
+            adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.storage_vector(u)))
 
         return out
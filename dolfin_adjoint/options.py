@@ -7,8 +7,20 @@ adj_params.add("test_derivative", False)
 adj_params.add("fussy_replay", True)
 adj_params.add("stop_annotating", False)
 adj_params.add("cache_factorizations", False)
+adj_params.add("cache_forward_factorizations", False)
+adj_params.add("cache_rhs_assembly", False)
+adj_params.add("cache_rhs_entries", 32) # the most assembled right-hand sides kept
+adj_params.add("preassemble_forms", False)
+adj_params.add("cache_budget", 0.0) # in bytes; 0 means no limit
+adj_params.add("warm_start_krylov", False)
 adj_params.add("debug_cache", False)
 adj_params.add("symmetric_bcs", False)
 adj_params.add("allow_zero_derivatives", False)
+adj_params.add("structural_block_names", False)
+adj_params.add("compact_tape", False)
+adj_params.add("profile_annotation", False)
+adj_params.add("forward_storage", "function")
+adj_params.add("forward_storage_budget", 0.0) # in bytes; 0 means no limit
+adj_params.add("slice_tape", False)
 
 parameters.add(adj_params)
@@ -0,0 +1,75 @@
+import bisect
+
+class ParameterStore(object):
+    '''This object keeps the history of the parameters (of Expressions, Constants, ...)
+    that the annotated equations depend on, so that the state at annotation time can
+    be restored in the callbacks.
+
+    Every change to a parameter bumps a global version number and records the new
+    value against it. Freezing the state is then just a matter of remembering the
+    current version, and restoring a version only touches the parameters whose
+    values differ from the ones currently set.
+
+    The assign argument is called as assign(obj, key, value) to set a parameter. It
+    may return False to decline, in which case the parameter is left alone.'''
+
+    def __init__(self, assign):
+        self.assign = assign
+        self.clear()
+
+    def clear(self):
+        self.version = 0
+        # obj -> key -> ([versions], [values])
+        self.history = {}
+        # obj -> key -> the version of the value currently set
+        self.applied = {}
+        # The version last restored, if nothing has changed since.
+        self.restored = None
+
+    def record(self, obj, key, value):
+        '''Record that parameter key of obj has been set to value.'''
+
+        self.version += 1
+        (versions, values) = self.history.setdefault(obj, {}).setdefault(key, ([], []))
+        versions.append(self.version)
+        values.append(value)
+        self.applied.setdefault(obj, {})[key] = self.version
+        self.restored = None
+
+    def freeze(self):
+        '''Return a handle to the current state.'''
+        return self.version
+
+    def restore(self, version, objs=None):
+        '''Restore the state at the given version. Parameters which did not exist
+        at that version are left alone. If objs is given, only the parameters of those
+        objects are restored.'''
+
+        if version == self.restored:
+            return
+
+        for obj in (self.history if objs is None else objs):
+            if obj not in self.history:
+                continue
+            applied = self.applied[obj]
+            for key, (versions, values) in self.history[obj].items():
+                i = bisect.bisect_right(versions, version) - 1
+                if i < 0 or applied[key] == versions[i]:
+                    continue
+
+                if self.assign(obj, key, values[i]) is not False:
+                    applied[key] = versions[i]
+
+        # After a partial restore, the other parameters may not be in that state
+        self.restored = version if objs is None else None
+
+    def state(self, obj):
+        '''Return a hashable description of the parameter values currently set on obj.'''
+        return tuple(sorted(self.applied.get(obj, {}).items()))
+
+    def objects(self):
+        return self.history.keys()
+
+    def current(self, obj):
+        '''Return a dictionary of the latest recorded values of the parameters of obj.'''
+        return dict((key, values[-1]) for (key, (versions, values)) in self.history.get(obj, {}).items())
@@ -7,6 +7,7 @@ from . import adjlinalg
 from . import adjglobals
 from . import misc
 from . import utils
+from . import warmstart
 
 petsc_krylov_solvers = []
 adj_petsc_krylov_solvers = []
@@ -243,7 +244,12 @@ class PETScKrylovSolver(dolfin.PETScKrylovSolver):
                         tnsp_.orthogonalize(rhs)
 
                     print("%s: |b|: %.6e" % (var, rhs.norm("l2")))
-                    solver.solve(x.vector(), rhs)
+                    warm = warmstart.initial_guess(("petsc_krylov", idx), var, x.vector())
+                    if warm:
+                        solver.parameters["nonzero_initial_guess"] = True
+
+                    its = solver.solve(x.vector(), rhs)
+                    warmstart.record(("petsc_krylov", idx), var, x.vector(), its, warm)
                     return adjlinalg.Vector(x)
 
             solving.annotate(A == b, u, bcs, matrix_class=PETScKrylovSolverMatrix, initial_guess=parameters['nonzero_initial_guess'], replace_map=True)
@@ -251,7 +257,7 @@ class PETScKrylovSolver(dolfin.PETScKrylovSolver):
         out = dolfin.PETScKrylovSolver.solve(self, *args, **kwargs)
 
         if to_annotate and dolfin.parameters["adjoint"]["record_all"]:
-            adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.Vector(u)))
+            adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.storage_vector(u)))
 
         return out
 
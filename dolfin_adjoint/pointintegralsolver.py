@@ -42,7 +42,7 @@ class PointIntegralSolver(dolfin.PointIntegralSolver):
             solving.do_checkpoint(cs, next_var, rhs)
 
             if dolfin.parameters["adjoint"]["record_all"]:
-                adjglobals.adjointer.record_variable(next_var, libadjoint.MemoryStorage(adjlinalg.Vector(var)))
+                adjglobals.adjointer.record_variable(next_var, libadjoint.MemoryStorage(adjlinalg.storage_vector(var)))
 
 class PointIntegralRHS(libadjoint.RHS):
     def __init__(self, solver, dt, ic_var, frozen_expressions, frozen_constants):
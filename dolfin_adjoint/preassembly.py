@@ -0,0 +1,161 @@
+import backend
+import ufl
+import ufl.algorithms
+import ufl.classes
+
+from . import caching
+from . import utils
+
+# Pre-assembly of the forms assembled by the adjoint and tangent linear callbacks, in the
+# manner of timestepping's PAForm. Enable it with
+#
+#   parameters["adjoint"]["preassemble_forms"] = True
+#
+# The integrand of each form is split into its terms, and the terms sorted into
+#
+#   - static terms, whose only coefficients are Constants: assembled once, and cached for
+#     the values of the Constants;
+#   - terms of a linear form that are linear in a single Function f: the bilinear form
+#     found by replacing f with a TrialFunction is assembled once and cached, and the term
+#     is then computed as that matrix times the vector of f;
+#   - everything else, which is assembled as usual.
+#
+# The split of a form depends only on its structure, so it is worked out once for all forms
+# with the same signature, spaces and meshes, which are the forms of one equation at every
+# timestep; the coefficients of each form take the place of those of the first one.
+
+class Plan(object):
+    '''The split of a form into terms that are pre-assembled and a remainder.'''
+
+    def __init__(self, form):
+        self.coefficients = form.coefficients()
+        self.rank = len(form.arguments())
+
+        # Terms assembled into cached tensors
+        self.static = []
+        # (bilinear form, index of the coefficient it acts on in self.coefficients)
+        self.actions = []
+        remainder = []
+
+        for (term, integral) in terms(ufl.algorithms.expand_derivatives(form)):
+            term_form = ufl.Form([integral.reconstruct(integrand=term)])
+            dynamic = [coeff for coeff in term_form.coefficients() if not isinstance(coeff, backend.Constant)]
+
+            if len(dynamic) == 0:
+                self.static.append(term_form)
+                continue
+
+            if self.rank == 1 and len(dynamic) == 1:
+                bilinear = linearise(term_form, dynamic[0])
+                if bilinear is not None:
+                    self.actions.append((bilinear, self.coefficients.index(dynamic[0])))
+                    continue
+
+            remainder.append(term_form)
+
+        self.remainder = sum(remainder[1:], remainder[0]) if len(remainder) > 0 else None
+
+    def worthwhile(self):
+        return len(self.static) + len(self.actions) > 0
+
+def terms(form):
+    '''Yield the terms of the integrands of form, with their integrals.'''
+    for integral in form.integrals():
+        stack = [integral.integrand()]
+        while len(stack) > 0:
+            expr = stack.pop()
+            if isinstance(expr, ufl.classes.Sum):
+                stack.extend(expr.ufl_operands)
+            else:
+                yield (expr, integral)
+
+def linearise(form, coeff):
+    '''If form is linear (and not merely affine) in the Function coeff, return the bilinear
+    form whose action on coeff it is; otherwise return None.'''
+
+    if not isinstance(coeff, backend.Function):
+        return None
+    fn_space = coeff.function_space()
+    # The vectors of subfunctions are those of the Functions they are part of
+    if len(fn_space.component()) > 0:
+        return None
+
+    trial = backend.TrialFunction(fn_space)
+    bilinear = ufl.algorithms.expand_derivatives(backend.derivative(form, coeff, trial))
+    if coeff in bilinear.coefficients() or len(bilinear.integrals()) == 0:
+        return None
+
+    # An affine term, such as inner(u - c, v)*dx, has a constant derivative too; it is only
+    # the action of its derivative if it vanishes with coeff
+    zero = ufl.algorithms.expand_derivatives(backend.replace(form, {coeff: ufl.classes.Zero(coeff.ufl_shape)}))
+    if len(zero.integrals()) > 0:
+        return None
+
+    return bilinear
+
+# Map from plan_key to the Plan for the forms with that key, or None if none of their terms
+# are worth pre-assembling
+plans = {}
+
+def plan_key(form):
+    # The signature numbers the coefficients in the order of form.coefficients(), so forms
+    # with the same key have the same coefficients in the same places.
+    return (form.signature(),
+            tuple(caching.space_id(arg.ufl_function_space()) for arg in form.arguments()),
+            tuple(domain.ufl_id() for domain in form.ufl_domains()))
+
+def get_plan(form):
+    key = plan_key(form)
+    if key not in plans:
+        plan = Plan(form)
+        plans[key] = plan if plan.worthwhile() else None
+    return (key, plans[key])
+
+def cached_tensor(key, form, replacements):
+    if caching.preassembled_terms.contains_everywhere(key):
+        if backend.parameters["adjoint"]["debug_cache"]:
+            backend.info_green("Got a pre-assembly cache hit")
+        return caching.preassembled_terms[key]
+
+    if backend.parameters["adjoint"]["debug_cache"]:
+        backend.info_red("Got a pre-assembly cache miss")
+    tensor = backend.assemble(backend.replace(form, replacements))
+    caching.preassembled_terms[key] = tensor
+    return tensor
+
+def assemble(form):
+    '''Assemble form, taking the terms that can be pre-assembled from the cache.'''
+
+    if backend.__name__ != "dolfin" or not isinstance(form, ufl.Form) or \
+       len(form.arguments()) not in [1, 2] or utils._has_multimesh(form):
+        return backend.assemble(form)
+
+    (key, plan) = get_plan(form)
+    if plan is None:
+        return backend.assemble(form)
+
+    coefficients = form.coefficients()
+    replacements = dict(zip(plan.coefficients, coefficients))
+    constants = caching.form_constants(form)
+
+    pieces = []
+    for (i, term) in enumerate(plan.static):
+        pieces.append(cached_tensor((key, "static", i, constants), term, replacements))
+    for (i, (bilinear, j)) in enumerate(plan.actions):
+        matrix = cached_tensor((key, "action", i, constants), bilinear, replacements)
+        pieces.append(matrix * coefficients[j].vector())
+    if plan.remainder is not None:
+        pieces.append(backend.assemble(backend.replace(plan.remainder, replacements)))
+
+    # The cached tensors are copied, as the callers apply boundary conditions to the result
+    tensor = pieces[0].copy()
+    for piece in pieces[1:]:
+        if plan.rank == 2:
+            tensor.axpy(1.0, piece, False)
+        else:
+            tensor.axpy(1.0, piece)
+    return tensor
+
+def reset():
+    plans.clear()
+    caching.preassembled_terms.clear()
@@ -0,0 +1,164 @@
+import collections
+import json
+import os.path
+import sys
+import timeit
+
+import backend
+
+# Profiling of the time spent annotating, as opposed to solving. Enable it with
+#
+#   parameters["adjoint"]["profile_annotation"] = True
+#
+# Each phase of solving.annotate is then timed, together with the backend solve,
+# and accumulated per call site: the first frame in the user's code that led to
+# the annotation. The timings are local to each process. Phases timed outside of
+# an annotated call go to the site "<unknown>".
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+
+class Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add(self.name, timeit.default_timer() - self.start)
+
+class NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+null_phase = NullPhase()
+
+class CallSite(object):
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler.begin()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.end()
+
+class AnnotationProfiler(object):
+    '''Accumulates the time spent in each phase of annotation, per call site.'''
+
+    def __init__(self):
+        # The number of annotated calls entered and not yet left; nested ones (such as
+        # solving.annotate inside solving.solve) belong to the outermost call site
+        self.depth = 0
+        self.reset()
+
+    def reset(self):
+        # call site -> phase -> [calls, total time, maximum time]
+        self.stats = collections.OrderedDict()
+        self.site = "<unknown>"
+
+    def enabled(self):
+        return backend.parameters["adjoint"]["profile_annotation"]
+
+    def begin(self):
+        '''Called when an annotated call starts: work out where it was called from.'''
+
+        self.depth += 1
+        if self.depth > 1 or not self.enabled():
+            return
+
+        frame = sys._getframe(1)
+        while frame is not None and os.path.dirname(os.path.abspath(frame.f_code.co_filename)).startswith(package_dir):
+            frame = frame.f_back
+
+        if frame is None:
+            self.site = "<unknown>"
+        else:
+            self.site = "%s:%d (%s)" % (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+
+    def end(self):
+        '''Called when an annotated call ends.'''
+
+        self.depth -= 1
+        if self.depth == 0:
+            self.site = "<unknown>"
+
+    def call_site(self):
+        '''Return a context manager for an annotated call, whose phases are timed against
+        its call site.'''
+        return CallSite(self)
+
+    def phase(self, name):
+        '''Return a context manager that times the phase name of the current annotation.'''
+
+        if not self.enabled():
+            return null_phase
+        return Phase(self, name)
+
+    def add(self, name, elapsed):
+        phases = self.stats.setdefault(self.site, collections.OrderedDict())
+        record = phases.setdefault(name, [0, 0.0, 0.0])
+        record[0] += 1
+        record[1] += elapsed
+        record[2] = max(record[2], elapsed)
+
+    def to_dict(self):
+        out = collections.OrderedDict()
+        for site, phases in self.stats.items():
+            out[site] = collections.OrderedDict()
+            for name, (calls, total, maximum) in phases.items():
+                out[site][name] = {"calls": calls, "total": total, "mean": total/calls, "max": maximum}
+        return out
+
+    def table(self):
+        lines = []
+        header = "%-12s %-28s %8s %12s %12s %12s" % ("", "Phase", "Calls", "Total (s)", "Mean (s)", "Max (s)")
+
+        for site, phases in self.stats.items():
+            lines.append(site)
+            lines.append(header)
+            annotation = 0.0
+            solving = 0.0
+            for name, (calls, total, maximum) in phases.items():
+                lines.append("%-12s %-28s %8d %12.6f %12.6f %12.6f" % ("", name, calls, total, total/calls, maximum))
+                if name in backend_phases:
+                    solving += total
+                else:
+                    annotation += total
+            lines.append("%-12s %-28s %8s %12.6f" % ("", "annotation total", "", annotation))
+            if solving > 0.0:
+                lines.append("%-12s %-28s %8s %12.6f" % ("", "backend total", "", solving))
+            lines.append("")
+
+        return "\n".join(lines)
+
+# The phases that time the backend, rather than dolfin-adjoint
+backend_phases = ["backend solve"]
+
+annotation_profile = AnnotationProfiler()
+
+def adj_profile_table():
+    '''Return a table of the time spent annotating the forward model, broken down
+    by call site and annotation phase. Profiling must have been enabled with
+    :py:data:`parameters["adjoint"]["profile_annotation"] = True`.'''
+    return annotation_profile.table()
+
+def adj_profile_json(filename=None):
+    '''Return the annotation profile (see :py:func:`adj_profile_table`) as a JSON string,
+    and write it to filename if one is given.'''
+
+    out = json.dumps(annotation_profile.to_dict(), indent=2)
+    if filename is not None:
+        with open(filename, "w") as f:
+            f.write(out)
+    return out
+
+def adj_profile_reset():
+    '''Discard the annotation profile gathered so far.'''
+    annotation_profile.reset()
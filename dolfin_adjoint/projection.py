@@ -49,7 +49,7 @@ def project_dolfin(v, V=None, bcs=None, mesh=None, solver_type="lu", preconditio
         solving.annotate(a == L, out, bcs, solver_parameters={"linear_solver": solver_type, "preconditioner": preconditioner_type, "symmetric": True})
 
         if backend.parameters["adjoint"]["record_all"]:
-            adjglobals.adjointer.record_variable(adjglobals.adj_variables[out], libadjoint.MemoryStorage(adjlinalg.Vector(out)))
+            adjglobals.adjointer.record_variable(adjglobals.adj_variables[out], libadjoint.MemoryStorage(adjlinalg.storage_vector(out)))
 
     return out
 
@@ -4,7 +4,7 @@ import hashlib
 import libadjoint
 from . import utils
 from backend import Function, Constant, info_red, info_green, File
-from dolfin_adjoint import drivers, compatibility
+from dolfin_adjoint import drivers, compatibility, adjlinalg
 from dolfin_adjoint.adjglobals import adjointer, mem_checkpoints, disk_checkpoints, adj_reset_cache
 from .functional import Functional
 from .enlisting import enlist, delist
@@ -145,8 +145,8 @@ class ReducedFunctional(object):
 
         # Make sure we do not annotate
 
-        # Reset any cached data in dolfin-adjoint
-        adj_reset_cache()
+        # Reset the cached data that depends on the controls
+        adj_reset_cache(self.controls)
 
         #: The control values at which the reduced functional is to be evaluated.
         value = enlist(value)
@@ -180,23 +180,23 @@ class ReducedFunctional(object):
             # in the initial forward run
             if adjointer.get_checkpoint_strategy() != None:
                 if str(fwd_var) in mem_checkpoints:
-                    storage = libadjoint.MemoryStorage(output, cs = True)
+                    storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output.data), cs = True)
                     storage.set_overwrite(True)
                     adjointer.record_variable(fwd_var, storage)
                 if str(fwd_var) in disk_checkpoints:
-                    storage = libadjoint.MemoryStorage(output)
+                    storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output.data))
                     adjointer.record_variable(fwd_var, storage)
                     storage = libadjoint.DiskStorage(output, cs = True)
                     storage.set_overwrite(True)
                     adjointer.record_variable(fwd_var, storage)
                 if not str(fwd_var) in mem_checkpoints and not str(fwd_var) in disk_checkpoints:
-                    storage = libadjoint.MemoryStorage(output)
+                    storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output.data))
                     storage.set_overwrite(True)
                     adjointer.record_variable(fwd_var, storage)
 
             # No checkpointing, so we record everything
             else:
-                storage = libadjoint.MemoryStorage(output)
+                storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output.data))
                 storage.set_overwrite(True)
                 adjointer.record_variable(fwd_var, storage)
 
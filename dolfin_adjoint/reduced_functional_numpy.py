@@ -45,7 +45,7 @@ class ReducedFunctionalNumPy(ReducedFunctional):
             solving.adj_reset()
 
         # We move in control space, so we also need to reset the factorisation cache
-        adj_reset_cache()
+        adj_reset_cache(self.controls)
 
         # Now its time to update the control values using the given array
         m = self.rf.controls.__class__([p.data() for p in self.controls])
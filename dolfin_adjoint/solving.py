@@ -24,11 +24,19 @@ from . import adjlinalg
 from . import misc
 from . import utils
 from . import caching
+from . import profiling
+from . import tape
 
 def annotate(*args, **kwargs):
     '''This routine handles all of the annotation, recording the solves as they
     happen so that libadjoint can rewind them later.'''
 
+    with profiling.annotation_profile.call_site():
+        return annotate_solve(*args, **kwargs)
+
+def annotate_solve(*args, **kwargs):
+    '''Annotate a solve; see annotate.'''
+
     if 'matrix_class' in kwargs:
         matrix_class = kwargs['matrix_class']
         del kwargs['matrix_class']
@@ -46,11 +54,14 @@ def annotate(*args, **kwargs):
         replace_map = kwargs['replace_map']
         del kwargs['replace_map']
 
+    profile = profiling.annotation_profile
+
     if isinstance(args[0], ufl.classes.Equation):
         # annotate !
 
         # Unpack the arguments, using the same routine as the real Dolfin solve call
-        unpacked_args = compatibility._extract_args(*args, **kwargs)
+        with profile.phase("extract_args"):
+            unpacked_args = compatibility._extract_args(*args, **kwargs)
         eq = unpacked_args[0]
         u  = unpacked_args[1]
         bcs = unpacked_args[2]
@@ -122,7 +133,8 @@ def annotate(*args, **kwargs):
     # so that libadjoint records the dependencies with the right timestep number.
     if not linear:
         # Register the initial condition before the first nonlinear solve
-        register_initial_conditions([[u, adjglobals.adj_variables[u]],], linear=False)
+        with profile.phase("register_initial_conditions"):
+            register_initial_conditions([[u, adjglobals.adj_variables[u]],], linear=False)
         var = adjglobals.adj_variables.next(u)
     else:
         var = None
@@ -130,23 +142,55 @@ def annotate(*args, **kwargs):
     # Set up the data associated with the matrix on the left-hand side. This goes on the diagonal
     # of the 'large' system that incorporates all of the timelevels, which is why it is prefixed
     # with diag.
-    key = '{}{}{}{}'.format(hash(eq_lhs), hash(eq_rhs), u, random.random()).encode('utf8')
-    diag_name = hashlib.md5(key).hexdigest() # we don't have a useful human-readable name, so take the md5sum of the string representation of the forms
-    diag_deps = [adjglobals.adj_variables[coeff] for coeff in ufl.algorithms.extract_coefficients(eq_lhs) if isinstance(coeff, compatibility.function_type)]
-    diag_coeffs = [coeff for coeff in ufl.algorithms.extract_coefficients(eq_lhs) if isinstance(coeff, compatibility.function_type)]
+    with profile.phase("extract_coefficients"):
+        diag_deps = [adjglobals.adj_variables[coeff] for coeff in ufl.algorithms.extract_coefficients(eq_lhs) if isinstance(coeff, compatibility.function_type)]
+        diag_coeffs = [coeff for coeff in ufl.algorithms.extract_coefficients(eq_lhs) if isinstance(coeff, compatibility.function_type)]
 
     if initial_guess and linear: # if the initial guess matters, we're going to have to add this in as a dependency of the system
-        initial_guess_var = adjglobals.adj_variables[u]
-        diag_deps.append(initial_guess_var)
+        diag_deps.append(adjglobals.adj_variables[u])
         diag_coeffs.append(u)
 
-    diag_block = libadjoint.Block(diag_name, dependencies=diag_deps, test_hermitian=backend.parameters["adjoint"]["test_hermitian"], test_derivative=backend.parameters["adjoint"]["test_derivative"])
+    # Our equation may depend on Expressions, and those Expressions may have parameters
+    # (e.g. for time-dependent boundary conditions).
+    # In order to successfully replay the forward solve, we need to keep those parameters around.
+    # In expressions.py, we overloaded the Expression class to record all of the parameters
+    # as they are set. We're now going to remember the version of those parameters at the
+    # annotation time, so that we can get back to this exact state:
+    with profile.phase("freeze"):
+        frozen_expressions = expressions.freeze_dict()
+        frozen_constants = constant.freeze_dict()
+
+    compact = backend.parameters["adjoint"]["compact_tape"]
+
+    diag_name = None
+    if backend.parameters["adjoint"]["structural_block_names"] or compact:
+        with profile.phase("block_name"):
+            diag_name = structural_block_name(eq_lhs, u, eq_bcs, diag_coeffs, linear, matrix_class,
+                                              solver_parameters, initial_guess, replace_map)
+
+    # When compacting the tape, an equation that matches an earlier one structurally
+    # reuses its template: the forms, boundary conditions and frozen state are then
+    # only stored once, and only the block dependencies are recorded per equation.
+    template = None
+    if compact and diag_name is not None:
+        template = adjglobals.equation_templates.get(diag_name)
+
+    if template is None:
+        if diag_name is None:
+            key = '{}{}{}{}'.format(hash(eq_lhs), hash(eq_rhs), u, random.random()).encode('utf8')
+            diag_name = hashlib.md5(key).hexdigest() # we don't have a useful human-readable name, so take the md5sum of the string representation of the forms
+
+        template = EquationTemplate(diag_name, eq_lhs, diag_coeffs, eq_bcs, u, matrix_class, solver_parameters,
+                                    initial_guess, replace_map, frozen_expressions, frozen_constants)
+        if compact:
+            adjglobals.equation_templates[diag_name] = template
 
     # Similarly, create the object associated with the right-hand side data.
-    if linear:
-        rhs = adjrhs.RHS(eq_rhs)
-    else:
-        rhs = adjrhs.NonlinearRHS(eq_rhs, F, u, bcs, mass=eq_lhs, solver_parameters=solver_parameters, J=J)
+    with profile.phase("extract_coefficients"):
+        if linear:
+            rhs = adjrhs.RHS(eq_rhs)
+        else:
+            rhs = adjrhs.NonlinearRHS(eq_rhs, F, u, bcs, mass=eq_lhs, solver_parameters=solver_parameters, J=J)
 
 
     # We need to check if this is the first equation,
@@ -155,8 +199,9 @@ def annotate(*args, **kwargs):
     # relevant adjoint equations for the adjoint variables associated with
     # the initial conditions.
     assert len(rhs.coefficients()) == len(rhs.dependencies())
-    register_initial_conditions(chain(
-        zip(rhs.coefficients(),rhs.dependencies()), zip(diag_coeffs, diag_deps)), linear=linear, var=var)
+    with profile.phase("register_initial_conditions"):
+        register_initial_conditions(chain(
+            zip(rhs.coefficients(),rhs.dependencies()), zip(diag_coeffs, diag_deps)), linear=linear, var=var)
 
     # c.f. the discussion above. In the linear case, we want to bump the
     # timestep number /after/ all of the dependencies' timesteps have been
@@ -164,19 +209,149 @@ def annotate(*args, **kwargs):
     if linear:
         var = adjglobals.adj_variables.next(u)
 
-    # With the initial conditions out of the way, let us now define the callbacks that
-    # define the actions of the operator the user has passed in on the lhs of this equation.
+    # With the initial conditions out of the way, let us now create the block whose
+    # callbacks define the actions of the operator the user has passed in on the lhs
+    # of this equation.
+    with profile.phase("register_equation"):
+        diag_block = template.block(diag_deps)
 
-    # Our equation may depend on Expressions, and those Expressions may have parameters
-    # (e.g. for time-dependent boundary conditions).
-    # In order to successfully replay the forward solve, we need to keep those parameters around.
-    # In expressions.py, we overloaded the Expression class to record all of the parameters
-    # as they are set. We're now going to copy that dictionary as it is at the annotation time,
-    # so that we can get back to this exact state:
-    frozen_expressions = expressions.freeze_dict()
-    frozen_constants = constant.freeze_dict()
+        eqn = libadjoint.Equation(var, blocks=[diag_block], targets=[var], rhs=rhs)
+
+        cs = adjglobals.adjointer.register_equation(eqn)
+        adjglobals.annotated_equations.append((template, rhs))
+
+    with profile.phase("checkpoint"):
+        constants = constant_names(eq_lhs) + constant_names(eq_rhs) + bc_constant_names(eq_bcs)
+        if linear:
+            do_checkpoint(cs, var, rhs, diag_deps, constants=constants, operator_constants=constant_names(eq_lhs))
+        else:
+            # The adjoint of a nonlinear equation is linearised about its solution, so
+            # everything it depends on enters its operator.
+            do_checkpoint(cs, var, rhs, diag_deps + rhs.dependencies(), constants=constants, operator_constants=constants)
+
+    return linear
+
+def solve(*args, **kwargs):
+    '''This solve routine wraps the real Dolfin solve call. Its purpose is to annotate the model,
+    recording what solves occur and what forms are involved, so that the adjoint and tangent linear models may be
+    constructed automatically by libadjoint.
+
+    To disable the annotation, just pass :py:data:`annotate=False` to this routine, and it acts exactly like the
+    Dolfin solve call. This is useful in cases where the solve is known to be irrelevant or diagnostic
+    for the purposes of the adjoint computation (such as projecting fields to other function spaces
+    for the purposes of visualisation).'''
+
+    with profiling.annotation_profile.call_site():
+        # First, decide if we should annotate or not.
+        to_annotate = utils.to_annotate(kwargs.pop("annotate", None))
+        if to_annotate:
+            linear = annotate(*args, **kwargs)
+
+        # Avoid recursive annotation
+        flag = misc.pause_annotation()
+        try:
+            if to_annotate:
+                if tape.loaded is not None and tape.restore_solution(solution_function(*args, **kwargs)):
+                    # Linear algebra solves return their number of iterations
+                    ret = 0 if isinstance(args[0], compatibility.matrix_types()) else None
+                else:
+                    with profiling.annotation_profile.phase("backend solve"):
+                        ret = backend.solve(*args, **kwargs)
+            else:
+                ret = backend.solve(*args, **kwargs)
+        except:
+            raise
+        finally:
+            misc.continue_annotation(flag)
+
+        if to_annotate:
+            # Finally, if we want to record all of the solutions of the real forward model
+            # (for comparison with a libadjoint replay later),
+            # then we should record the value of the variable we just solved for.
+            if backend.parameters["adjoint"]["record_all"]:
+                with profiling.annotation_profile.phase("record"):
+                    u = solution_function(*args, **kwargs)
+                    adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.storage_vector(u)))
+
+        return ret
+
+def solution_function(*args, **kwargs):
+    '''Return the Function solved for by a solve call with the given arguments.'''
 
-    def diag_assembly_cb(dependencies, values, hermitian, coefficient, context):
+    if isinstance(args[0], ufl.classes.Equation):
+        unpacked_args = compatibility._extract_args(*args, **kwargs)
+        return unpacked_args[1]
+    elif isinstance(args[0], compatibility.matrix_types()):
+        return args[1].function
+    else:
+        raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Don't know how to record, sorry")
+
+class EquationTemplate(object):
+    '''The data behind the diagonal block of an annotated equation, and the callbacks
+    that libadjoint uses to assemble it and take its derivatives.
+
+    One template may serve several equations: the callbacks only see the dependencies
+    and values libadjoint passes in, so equations that differ only in those (e.g. the
+    same operator at every timestep) can share it.'''
+
+    def __init__(self, name, eq_lhs, diag_coeffs, eq_bcs, u, matrix_class, solver_parameters,
+                 initial_guess, replace_map, frozen_expressions, frozen_constants):
+        self.name = name
+        self.eq_lhs = eq_lhs
+        self.diag_coeffs = diag_coeffs
+        self.eq_bcs = eq_bcs
+        self.fn_space = u.function_space()
+        self.matrix_class = matrix_class
+        self.solver_parameters = solver_parameters
+        self.initial_guess = initial_guess
+        # The position of the initial guess amongst the block dependencies. Templates may
+        # be shared between equations, so look it up by position rather than by variable.
+        self.initial_guess_idx = len(diag_coeffs) - 1
+        self.replace_map = replace_map
+        self.frozen_expressions = frozen_expressions
+        self.frozen_constants = frozen_constants
+        # The Expressions and Constants the block can see, or None for all of them; those
+        # of the right-hand side are restored by the RHS. Equations sharing the template
+        # (or its name) agree on these, but not necessarily on the others.
+        self.visible_state = block_state(eq_lhs, eq_bcs)
+        # If the operator is its own adjoint, the adjoint solves use the forward matrix, and
+        # share its assembly and factorizations. The "symmetric" solver parameter is no proof
+        # of this: it only asks dolfin to apply the boundary conditions symmetrically.
+        self.self_adjoint = utils.is_self_adjoint_form(eq_lhs)
+        # The derivatives of the operator, built for the first equation that needs them
+        self.derivatives = caching.SymbolicCache()
+
+    def block(self, dependencies):
+        '''Return a libadjoint.Block for an equation with the given dependencies.'''
+
+        block = libadjoint.Block(self.name, dependencies=dependencies, test_hermitian=backend.parameters["adjoint"]["test_hermitian"], test_derivative=backend.parameters["adjoint"]["test_derivative"])
+        block.assemble = self.assemble
+        block.action = self.action
+
+        if len(dependencies) > 0:
+            # If this block is nonlinear (the entries of the matrix on the LHS
+            # depend on any variable previously computed), then that will induce
+            # derivative terms in the adjoint equations.
+            block.derivative_action = self.derivative_action
+            block.derivative_outer_action = self.derivative_outer_action
+            block.second_derivative_action = self.second_derivative_action
+
+        return block
+
+    def restore(self):
+        '''Restore the state, at the time of annotation, of the Expressions and Constants
+        the block can see.'''
+        if self.visible_state is None:
+            expressions.update_expressions(self.frozen_expressions)
+            constant.update_constants(self.frozen_constants)
+        else:
+            expressions.update_expressions(self.frozen_expressions, self.visible_state[0])
+            constant.update_constants(self.frozen_constants, self.visible_state[1])
+
+    def current_form(self, values):
+        return backend.replace(self.eq_lhs, dict(zip(self.diag_coeffs, [v.data for v in values])))
+
+    def assemble(self, dependencies, values, hermitian, coefficient, context):
         '''This callback must conform to the libadjoint Python block assembly
         interface. It returns either the form or its transpose, depending on
         the value of the logical hermitian.'''
@@ -184,197 +359,302 @@ def annotate(*args, **kwargs):
         assert coefficient == 1
 
         value_coeffs=[v.data for v in values]
-        expressions.update_expressions(frozen_expressions)
-        constant.update_constants(frozen_constants)
-        eq_l = backend.replace(eq_lhs, dict(zip(diag_coeffs, value_coeffs)))
+        self.restore()
+        eq_l = backend.replace(self.eq_lhs, dict(zip(self.diag_coeffs, value_coeffs)))
 
         kwargs = {"cache": eq_l in caching.assembled_fwd_forms} # should we cache our matrices on the way backwards?
 
         if hermitian:
             # Homogenise the adjoint boundary conditions. This creates the adjoint
             # solution associated with the lifted discrete system that is actually solved.
-            adjoint_bcs = [utils.homogenize(bc) for bc in eq_bcs if isinstance(bc, backend.DirichletBC)] + [bc for bc in eq_bcs if not isinstance(bc, backend.DirichletBC)]
+            adjoint_bcs = [utils.homogenize(bc) for bc in self.eq_bcs if isinstance(bc, backend.DirichletBC)] + [bc for bc in self.eq_bcs if not isinstance(bc, backend.DirichletBC)]
             if len(adjoint_bcs) == 0:
                 adjoint_bcs = None
             else:
                 adjoint_bcs = misc.uniq(adjoint_bcs)
 
             kwargs['bcs'] = adjoint_bcs
-            kwargs['solver_parameters'] = solver_parameters
+            kwargs['solver_parameters'] = self.solver_parameters
             kwargs['adjoint'] = True
 
-            if initial_guess:
-                kwargs['initial_guess'] = value_coeffs[dependencies.index(initial_guess_var)]
+            if self.initial_guess:
+                kwargs['initial_guess'] = value_coeffs[self.initial_guess_idx]
 
-            if replace_map:
-                kwargs['replace_map'] = dict(zip(diag_coeffs, value_coeffs))
+            if self.replace_map:
+                kwargs['replace_map'] = dict(zip(self.diag_coeffs, value_coeffs))
 
-            return (matrix_class(backend.adjoint(eq_l, reordered_arguments=ufl.algorithms.extract_arguments(eq_l)), **kwargs), adjlinalg.Vector(None, fn_space=u.function_space()))
+            if self.self_adjoint:
+                A = self.matrix_class(eq_l, **kwargs)
+            else:
+                A = self.matrix_class(backend.adjoint(eq_l, reordered_arguments=ufl.algorithms.extract_arguments(eq_l)), **kwargs)
+            # What the matrix is the adjoint of, so that solves with it can use (the transpose
+            # of) a forward factorization
+            A.forward_data = eq_l
+            A.forward_bcs = misc.uniq(self.eq_bcs)
+            A.self_adjoint = self.self_adjoint
+
+            return (A, adjlinalg.Vector(None, fn_space=self.fn_space))
         else:
 
-            kwargs['bcs'] = misc.uniq(eq_bcs)
-            kwargs['solver_parameters'] = solver_parameters
+            kwargs['bcs'] = misc.uniq(self.eq_bcs)
+            kwargs['solver_parameters'] = self.solver_parameters
             kwargs['adjoint'] = False
 
-            if initial_guess:
-                kwargs['initial_guess'] = value_coeffs[dependencies.index(initial_guess_var)]
+            if self.initial_guess:
+                kwargs['initial_guess'] = value_coeffs[self.initial_guess_idx]
 
-            if replace_map:
-                kwargs['replace_map'] = dict(zip(diag_coeffs, value_coeffs))
+            if self.replace_map:
+                kwargs['replace_map'] = dict(zip(self.diag_coeffs, value_coeffs))
 
-            return (matrix_class(eq_l, **kwargs), adjlinalg.Vector(None, fn_space=u.function_space()))
-    diag_block.assemble = diag_assembly_cb
+            return (self.matrix_class(eq_l, **kwargs), adjlinalg.Vector(None, fn_space=self.fn_space))
 
-    def diag_action_cb(dependencies, values, hermitian, coefficient, input, context):
-        value_coeffs = [v.data for v in values]
-        expressions.update_expressions(frozen_expressions)
-        constant.update_constants(frozen_constants)
-        eq_l = backend.replace(eq_lhs, dict(zip(diag_coeffs, value_coeffs)))
+    def action(self, dependencies, values, hermitian, coefficient, input, context):
+        self.restore()
+        eq_l = self.current_form(values)
 
-        if hermitian:
+        # If the operator is assembled, this is a matrix-vector product
+        output = adjlinalg.operator_action(eq_l, input.data, transpose=hermitian)
+        if output is not None:
+            output.vector()._scale(coefficient)
+            return adjlinalg.Vector(output)
+
+        if hermitian and not self.self_adjoint:
             eq_l = backend.adjoint(eq_l)
 
         output = coefficient * backend.action(eq_l, input.data)
 
         return adjlinalg.Vector(output)
 
-    diag_block.action = diag_action_cb
-
-    if len(diag_deps) > 0:
-        # If this block is nonlinear (the entries of the matrix on the LHS
-        # depend on any variable previously computed), then that will induce
-        # derivative terms in the adjoint equations. Here, we define the
-        # callback libadjoint will need to compute such terms.
-        def derivative_action(dependencies, values, variable, contraction_vector, hermitian, input, coefficient, context):
-            dolfin_variable = values[dependencies.index(variable)].data
-            dolfin_values = [val.data for val in values]
-            expressions.update_expressions(frozen_expressions)
-            constant.update_constants(frozen_constants)
-
-            current_form = backend.replace(eq_lhs, dict(zip(diag_coeffs, dolfin_values)))
-
-            deriv = backend.derivative(current_form, dolfin_variable)
+    def derivative_action(self, dependencies, values, variable, contraction_vector, hermitian, input, coefficient, context):
+        self.restore()
+        output = self.derivative_action_form(dependencies.index(variable), hermitian, [v.data for v in values],
+                                             contraction_vector.data, input.data)
+        if output is None or coefficient == 0:
+            return adjlinalg.Vector(None)
+
+        return adjlinalg.Vector(coefficient * output)
+
+    def derivative_outer_action(self, dependencies, values, variable, contraction_vector, hermitian, input, coefficient, context):
+        self.restore()
+        output = self.derivative_outer_action_form(dependencies.index(variable), hermitian, [v.data for v in values],
+                                                   contraction_vector.data, input.data)
+        if output is None or coefficient == 0:
+            return adjlinalg.Vector(None)
+
+        return adjlinalg.Vector(coefficient * output)
+
+    def second_derivative_action(self, dependencies, values, inner_variable, inner_contraction_vector, outer_variable, outer_contraction_vector, hermitian, input, coefficient, context):
+        self.restore()
+        output = self.second_derivative_action_form(dependencies.index(inner_variable), dependencies.index(outer_variable),
+                                                    hermitian, [v.data for v in values], inner_contraction_vector.data,
+                                                    outer_contraction_vector.data, input.data)
+        if output is None or coefficient == 0:
+            return adjlinalg.Vector(None)
+
+        return adjlinalg.Vector(coefficient * output)
+
+    def derivative_action_form(self, j, hermitian, values, contraction, input):
+        def build(contraction, input):
+            deriv = backend.derivative(self.eq_lhs, self.diag_coeffs[j])
             args = ufl.algorithms.extract_arguments(deriv)
-            deriv = backend.replace(deriv, {args[1]: contraction_vector.data}) # contract over the middle index
-
-            # Assemble the G-matrix now, so that we can apply the Dirichlet BCs to it
-            if len(ufl.algorithms.extract_arguments(ufl.algorithms.expand_derivatives(coefficient*deriv))) == 0:
-                return adjlinalg.Vector(None)
-
-            G = coefficient * deriv
-
-            if hermitian:
-                output = backend.action(backend.adjoint(G), input.data)
-            else:
-                output = backend.action(G, input.data)
-
-            return adjlinalg.Vector(output)
-        diag_block.derivative_action = derivative_action
+            deriv = backend.replace(deriv, {args[1]: contraction}) # contract over the middle index
+            return block_action(deriv, hermitian, input)
 
-        def derivative_outer_action(dependencies, values, variable, contraction_vector, hermitian, input, coefficient, context):
-            dolfin_variable = values[dependencies.index(variable)].data
-            dolfin_values = [val.data for val in values]
-            expressions.update_expressions(frozen_expressions)
-            constant.update_constants(frozen_constants)
+        return self.derivatives.form(("derivative_action", j, hermitian), build, self.diag_coeffs,
+                                     values, [contraction, input])
 
-            current_form = backend.replace(eq_lhs, dict(zip(diag_coeffs, dolfin_values)))
-
-            deriv = backend.derivative(current_form, dolfin_variable)
+    def derivative_outer_action_form(self, j, hermitian, values, contraction, input):
+        def build(contraction, input):
+            deriv = backend.derivative(self.eq_lhs, self.diag_coeffs[j])
             args = ufl.algorithms.extract_arguments(deriv)
-            deriv = backend.replace(deriv, {args[2]: contraction_vector.data}) # contract over the outer index
-
-            # Assemble the G-matrix now, so that we can apply the Dirichlet BCs to it
-            if len(ufl.algorithms.extract_arguments(ufl.algorithms.expand_derivatives(coefficient*deriv))) == 0:
-                return adjlinalg.Vector(None)
-
-            G = coefficient * deriv
+            deriv = backend.replace(deriv, {args[2]: contraction}) # contract over the outer index
+            return block_action(deriv, hermitian, input)
 
-            if hermitian:
-                output = backend.action(backend.adjoint(G), input.data)
-            else:
-                output = backend.action(G, input.data)
-
-            return adjlinalg.Vector(output)
-        diag_block.derivative_outer_action = derivative_outer_action
+        return self.derivatives.form(("derivative_outer_action", j, hermitian), build, self.diag_coeffs,
+                                     values, [contraction, input])
 
-        def second_derivative_action(dependencies, values, inner_variable, inner_contraction_vector, outer_variable, outer_contraction_vector, hermitian, input, coefficient, context):
-            dolfin_inner_variable = values[dependencies.index(inner_variable)].data
-            dolfin_outer_variable = values[dependencies.index(outer_variable)].data
-            dolfin_values = [val.data for val in values]
-            expressions.update_expressions(frozen_expressions)
-            constant.update_constants(frozen_constants)
-
-            current_form = backend.replace(eq_lhs, dict(zip(diag_coeffs, dolfin_values)))
-
-            deriv = backend.derivative(current_form, dolfin_inner_variable)
+    def second_derivative_action_form(self, j_inner, j_outer, hermitian, values, inner_contraction, outer_contraction, input):
+        def build(inner_contraction, outer_contraction, input):
+            deriv = backend.derivative(self.eq_lhs, self.diag_coeffs[j_inner])
             args = ufl.algorithms.extract_arguments(deriv)
-            deriv = backend.replace(deriv, {args[1]: inner_contraction_vector.data}) # contract over the middle index
+            deriv = backend.replace(deriv, {args[1]: inner_contraction}) # contract over the middle index
 
-            deriv = backend.derivative(deriv, dolfin_outer_variable)
+            deriv = backend.derivative(deriv, self.diag_coeffs[j_outer])
             args = ufl.algorithms.extract_arguments(deriv)
-            deriv = backend.replace(deriv, {args[1]: outer_contraction_vector.data}) # contract over the middle index
+            deriv = backend.replace(deriv, {args[1]: outer_contraction}) # contract over the middle index
+            return block_action(deriv, hermitian, input)
 
-            # Assemble the G-matrix now, so that we can apply the Dirichlet BCs to it
-            if len(ufl.algorithms.extract_arguments(ufl.algorithms.expand_derivatives(coefficient*deriv))) == 0:
-                return adjlinalg.Vector(None)
+        return self.derivatives.form(("second_derivative_action", j_inner, j_outer, hermitian), build, self.diag_coeffs,
+                                     values, [inner_contraction, outer_contraction, input])
 
-            G = coefficient * deriv
+    def backward_forms(self, hessian=False):
+        '''Return the forms the adjoint sweeps assemble for this block, built in its own
+        coefficients, so that they can be compiled before the sweeps need them. If hessian,
+        also return those of the tangent linear and second order adjoint sweeps.'''
 
-            if hermitian:
-                output = backend.action(backend.adjoint(G), input.data)
-            else:
-                output = backend.action(G, input.data)
+        (test, trial) = [backend.Function(arg.function_space()) for arg in ufl.algorithms.extract_arguments(self.eq_lhs)]
+        coeffs = list(self.diag_coeffs)
+        hermitians = [True, False] if hessian else [True]
 
-            return adjlinalg.Vector(output)
-        diag_block.second_derivative_action = second_derivative_action
+        if self.self_adjoint:
+            forms = [self.eq_lhs]
+        else:
+            forms = [backend.adjoint(self.eq_lhs, reordered_arguments=ufl.algorithms.extract_arguments(self.eq_lhs))]
 
-    eqn = libadjoint.Equation(var, blocks=[diag_block], targets=[var], rhs=rhs)
+        for (j, coeff) in enumerate(coeffs):
+            for hermitian in hermitians:
+                other = test if hermitian else backend.Function(coeff.function_space())
+                forms.append(self.derivative_action_form(j, hermitian, coeffs, trial, other))
 
-    cs = adjglobals.adjointer.register_equation(eqn)
-    do_checkpoint(cs, var, rhs)
+                if not hessian:
+                    continue
 
-    return linear
+                other = test if hermitian else trial
+                forms.append(self.derivative_outer_action_form(j, hermitian, coeffs, backend.Function(coeff.function_space()), other))
 
-def solve(*args, **kwargs):
-    '''This solve routine wraps the real Dolfin solve call. Its purpose is to annotate the model,
-    recording what solves occur and what forms are involved, so that the adjoint and tangent linear models may be
-    constructed automatically by libadjoint.
+                for (k, outer_coeff) in enumerate(coeffs):
+                    other = test if hermitian else backend.Function(outer_coeff.function_space())
+                    forms.append(self.second_derivative_action_form(j, k, hermitian, coeffs, trial,
+                                                                    backend.Function(coeff.function_space()), other))
 
-    To disable the annotation, just pass :py:data:`annotate=False` to this routine, and it acts exactly like the
-    Dolfin solve call. This is useful in cases where the solve is known to be irrelevant or diagnostic
-    for the purposes of the adjoint computation (such as projecting fields to other function spaces
-    for the purposes of visualisation).'''
+        return [form for form in forms if form is not None]
 
-    # First, decide if we should annotate or not.
-    to_annotate = utils.to_annotate(kwargs.pop("annotate", None))
-    if to_annotate:
-        linear = annotate(*args, **kwargs)
-
-    # Avoid recursive annotation
-    flag = misc.pause_annotation()
-    try:
-        ret = backend.solve(*args, **kwargs)
-    except:
-        raise
-    finally:
-        misc.continue_annotation(flag)
-
-    if to_annotate:
-        # Finally, if we want to record all of the solutions of the real forward model
-        # (for comparison with a libadjoint replay later),
-        # then we should record the value of the variable we just solved for.
-        if backend.parameters["adjoint"]["record_all"]:
-            if isinstance(args[0], ufl.classes.Equation):
-                unpacked_args = compatibility._extract_args(*args, **kwargs)
-                u  = unpacked_args[1]
-                adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.Vector(u)))
-            elif isinstance(args[0], compatibility.matrix_types()):
-                u = args[1].function
-                adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.Vector(u)))
-            else:
-                raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Don't know how to record, sorry")
+def block_action(G, hermitian, input):
+    '''Return the action of the bilinear form G (or, if hermitian, of its adjoint) on input,
+    or None if G is zero.'''
 
-    return ret
+    G = ufl.algorithms.expand_derivatives(G)
+    if len(ufl.algorithms.extract_arguments(G)) == 0:
+        return None
+
+    if hermitian:
+        return backend.action(backend.adjoint(G), input)
+    else:
+        return backend.action(G, input)
+
+def structural_block_name(eq_lhs, u, bcs, diag_coeffs, linear, matrix_class, solver_parameters,
+                          initial_guess, replace_map):
+    '''Derive the name of the diagonal block of an equation from its structure, rather
+    than from a random number. libadjoint registers block callbacks by name, so two
+    equations may only share a name if their callbacks are interchangeable: the same
+    form signature, the same objects bound to the coefficient slots, the same boundary
+    conditions and solver, and the same frozen state of the Expressions and Constants the
+    block can see. Repeated timestep operators then resolve to a single block, even with a
+    time-dependent source.
+
+    Returns None if the equation cannot safely share its block.'''
+
+    # Matrix classes created on the fly (e.g. by the Krylov solver overloads) close over
+    # data of their own; only share them if they tell us what that data is.
+    if matrix_class is adjlinalg.Matrix:
+        matrix_key = "Matrix"
+    else:
+        matrix_key = getattr(matrix_class, "block_key", None)
+        if matrix_key is None:
+            return None
+
+    def object_key(obj):
+        if isinstance(obj, compatibility.function_type):
+            return str(obj)
+        elif hasattr(obj, "count"):
+            return "%s" % obj.count()
+        elif hasattr(obj, "id"):
+            return "%s" % obj.id()
+        else:
+            return "%s" % id(obj)
+
+    # The values of Functions and untracked Constants that Expressions of the block refer
+    # to are not recorded anywhere, so such blocks cannot be told apart
+    (coeffs, complete) = block_coefficients(eq_lhs, bcs)
+    direct = set(ufl.algorithms.extract_coefficients(eq_lhs))
+    direct.update(getattr(bc, "function_arg", None) for bc in bcs)
+    for coeff in coeffs.difference(direct):
+        if not (isinstance(coeff, backend.Expression) or hasattr(coeff, "adj_name")):
+            return None
+
+    # The state that the block callbacks restore must match, too. That is only the state
+    # the block can see: the right-hand side restores its own, so a time-dependent source
+    # does not stop the operator from being shared.
+    visible = block_state(eq_lhs, bcs)
+    if visible is None:
+        (visible_expressions, visible_constants) = (expressions.expression_store.objects(), constant.constant_store.objects())
+    else:
+        (visible_expressions, visible_constants) = visible
+
+    # This is called at annotation time, so the state frozen for the equation is the
+    # latest one recorded.
+    state = []
+    for expression in visible_expressions:
+        state.append((object_key(expression), sorted((k, repr(v)) for (k, v) in expressions.expression_store.current(expression).items())))
+    for name in visible_constants:
+        state.append((object_key(constant.constant_objects[name]), repr(constant.constant_store.current(name)["value"])))
+
+    if solver_parameters is None:
+        parameters = None
+    else:
+        parameters = compatibility.to_dict(solver_parameters)
+
+    key = repr((eq_lhs.signature(),
+                [object_key(coeff) for coeff in ufl.algorithms.extract_coefficients(eq_lhs)],
+                [object_key(coeff) for coeff in diag_coeffs],
+                str(u), [object_key(bc) for bc in bcs], linear, matrix_key, repr(parameters),
+                bool(initial_guess), bool(replace_map), sorted(state)))
+
+    return hashlib.md5(key.encode('utf8')).hexdigest()
+
+def block_coefficients(eq_lhs, bcs):
+    '''Return the coefficients that the block of an equation with operator eq_lhs and
+    boundary conditions bcs can see, including those that the parameters of its Expressions
+    are set to, and whether those are all of them: the values of some Dirichlet conditions
+    may not be visible.'''
+
+    visible = set(ufl.algorithms.extract_coefficients(eq_lhs))
+    complete = True
+    for bc in bcs:
+        if hasattr(bc, "function_arg"):
+            visible.add(bc.function_arg)
+        else:
+            complete = False
+
+    stack = [coeff for coeff in visible if isinstance(coeff, backend.Expression)]
+    while len(stack) > 0:
+        for coeff in expressions.parameter_coefficients(stack.pop()):
+            if coeff not in visible:
+                visible.add(coeff)
+                if isinstance(coeff, backend.Expression):
+                    stack.append(coeff)
+
+    return (visible, complete)
+
+def block_state(eq_lhs, bcs):
+    '''Return the Expressions, and the names of the Constants, with recorded parameters that
+    the block of an equation with operator eq_lhs and boundary conditions bcs can see; or
+    None if that cannot be told, as the values of some Dirichlet conditions are not visible.'''
+
+    (visible, complete) = block_coefficients(eq_lhs, bcs)
+    if not complete:
+        return None
+
+    return ([expression for expression in expressions.expression_store.objects() if expression in visible],
+            [name for name in constant.constant_store.objects() if constant.constant_objects[name] in visible])
+
+def constant_names(form):
+    '''Return the names of the Constants in form.'''
+    if not isinstance(form, ufl.Form):
+        return []
+    return [coeff.adj_name for coeff in ufl.algorithms.extract_coefficients(form) if hasattr(coeff, "adj_name")]
+
+def bc_constant_names(bcs):
+    '''Return the names of the Constants the boundary conditions bcs take their values from.'''
+    names = []
+    for bc in bcs:
+        try:
+            value = bc.value()
+        except AttributeError:
+            continue
+        if hasattr(value, "adj_name"):
+            names.append(value.adj_name)
+    return names
 
 def define_nonlinear_equation(F, u):
     # Given an F := 0,
@@ -429,7 +709,7 @@ def register_initial_condition(coeff, dep):
     identity_block = utils.get_identity_block(fn_space)
 
     if backend.parameters["adjoint"]["record_all"]:
-        adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.Vector(coeff)))
+        adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.storage_vector(coeff)))
 
     init_rhs=adjlinalg.Vector(coeff).duplicate()
     init_rhs.axpy(1.0,adjlinalg.Vector(coeff))
@@ -440,13 +720,23 @@ def register_initial_condition(coeff, dep):
     assert adjglobals.adjointer.variable_known(dep)
     do_checkpoint(cs, dep, rhs)
 
-def do_checkpoint(cs, var, rhs):
+def do_checkpoint(cs, var, rhs, deps=[], constants=None, operator_constants=[]):
+    # var has just had its equation registered, so the adjointer knows about it now.
+    adjglobals.adj_variables.mark_known(var)
+
+    # Record what its equation depends on: the dependencies of the right-hand side,
+    # and those of the operator, deps; and the names of the Constants in the equation
+    # and its operator, where known.
+    coeff = adjglobals.adj_variables.coefficient(var.name)
+    fn_space = coeff.function_space() if hasattr(coeff, "function_space") else None
+    if constants is None and isinstance(getattr(rhs, "form", None), adjlinalg.Vector):
+        constants = operator_constants
+    adjglobals.tape_graph.add(var, rhs.dependencies(), fn_space, operator_deps=deps,
+                              constants=constants, operator_constants=operator_constants)
+
     if cs == int(libadjoint.constants.adj_constants["ADJ_CHECKPOINT_STORAGE_MEMORY"]):
-        for coeff in adjglobals.adj_variables.keys():
-            dep = adjglobals.adj_variables[coeff]
-            # Do not checkpoint variables which are (yet) unknown to libadjoint
-            if not adjglobals.adjointer.variable_known(dep):
-                continue
+        # Only variables which are known to libadjoint can be checkpointed
+        for coeff, dep in adjglobals.adj_variables.known_variables():
 
             # Handle the Newton solve case:
             if dep == var:
@@ -456,21 +746,13 @@ def do_checkpoint(cs, var, rhs):
                     dep = rhs.ic_var
                 else:
                     continue
-                    for rdep in rhs.dependencies():
-                        if rdep.name == dep.name:
-                            dep = rdep
-                            break
 
             adjglobals.mem_checkpoints.add(str(dep))
-            adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.Vector(coeff), cs=True))
+            adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.storage_vector(coeff), cs=True))
 
     elif cs == int(libadjoint.constants.adj_constants["ADJ_CHECKPOINT_STORAGE_DISK"]):
 
-        for coeff in adjglobals.adj_variables.keys():
-            dep = adjglobals.adj_variables[coeff]
-            # Do not checkpoint variables which are (yet) unknown to libadjoint
-            if not adjglobals.adjointer.variable_known(dep):
-                continue
+        for coeff, dep in adjglobals.adj_variables.known_variables():
 
             if dep == var:
                 # We may need to checkpoint another variable if rhs is a NonlinearRHS and we need
@@ -485,4 +767,6 @@ def do_checkpoint(cs, var, rhs):
 
 
 def record(val):
-    adjglobals.adjointer.record_variable(adjglobals.adj_variables[val], libadjoint.MemoryStorage(adjlinalg.Vector(val)))
+    var = adjglobals.adj_variables[val]
+    adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.storage_vector(val)))
+    adjglobals.adj_variables.mark_known(var)
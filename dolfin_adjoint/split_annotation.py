@@ -63,7 +63,7 @@ def annotate_split(bigfn, idx, smallfn, bcs):
     if backend.parameters["adjoint"]["record_all"]:
         smallfn_record = backend.Function(fn_space)
         assignment.dolfin_assign(smallfn_record, smallfn)
-        adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.Vector(smallfn_record)))
+        adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.storage_vector(smallfn_record)))
 
 class SplitRHS(adjrhs.RHS):
     def __init__(self, test, function, index):
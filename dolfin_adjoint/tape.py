@@ -0,0 +1,142 @@
+import json
+
+import numpy
+
+import backend
+import libadjoint
+import libadjoint.exceptions
+
+from . import adjglobals
+from . import adjlinalg
+from . import compatibility
+
+# Saving the tape to a file, so that the adjoint can be run in another process.
+#
+# The equations themselves are made of forms and callbacks, which cannot be written
+# out; what is expensive about a forward run is the solves, not the annotation. So a
+# saved tape holds the values of the forward variables, and the tape is loaded by
+# running the forward model again after adj_load_tape: the equations are annotated
+# as usual, but each annotated solve takes its solution from the file instead of
+# solving.
+
+format_version = 1
+
+class Tape(object):
+    '''The forward values read from a tape file.'''
+
+    def __init__(self, manifest, values):
+        self.manifest = manifest
+        self.values = values
+
+    def value(self, var):
+        return self.values.get((var.name, var.timestep, var.iteration))
+
+    def check_equation(self, i, var):
+        '''Check that equation i of the model being run solves for var, as the equation
+        of the run that saved the tape did.'''
+
+        equations = self.manifest["equations"]
+        if i >= len(equations) or tuple(equations[i]) != (var.name, var.timestep, var.iteration):
+            raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Equation %d solves for %s, which is not the variable it solved for "
+                                                                     "on the tape: the model run does not match the one that saved the tape." % (i, var))
+
+# The tape loaded with adj_load_tape, if any
+loaded = None
+
+def tape_filename(filename):
+    # The values saved are local to each process
+    if compatibility.size(backend.comm_world) > 1:
+        return "%s.%d" % (filename, compatibility.rank(backend.comm_world))
+    return filename
+
+def adj_save_tape(filename):
+    '''Save the values of the forward variables recorded on the tape to filename, so
+    that the adjoint can be computed in another process with :py:func:`adj_load_tape`.
+
+    Only the values the adjointer still holds are saved, so call this before
+    computing adjoints with :py:data:`forget=True`; values that are not saved are
+    recomputed when the tape is loaded. In parallel, each process writes its own
+    file, with its rank appended to the name.'''
+
+    adjointer = adjglobals.adjointer
+
+    manifest = {"format": format_version, "equations": [], "values": []}
+    arrays = {}
+
+    for i in range(adjointer.equation_count):
+        var = adjointer.get_forward_variable(i)
+        key = [var.name, var.timestep, var.iteration]
+        manifest["equations"].append(key)
+
+        try:
+            value = adjointer.get_variable_value(var).data
+        except (libadjoint.exceptions.LibadjointErrorNeedValue, libadjoint.exceptions.LibadjointErrorInvalidInputs):
+            continue
+
+        if not isinstance(value, backend.Function):
+            continue
+
+        arrays["value_%d" % len(manifest["values"])] = value.vector().get_local()
+        manifest["values"].append(key)
+
+    with open(tape_filename(filename), "wb") as f:
+        numpy.savez(f, manifest=numpy.array(json.dumps(manifest)), **arrays)
+
+def adj_load_tape(filename):
+    '''Load a tape saved with :py:func:`adj_save_tape`. The forward model must then
+    be run again, exactly as it was when the tape was saved: the solves are
+    annotated as usual, but take their solutions from the tape instead of solving.
+    Afterwards, the adjoint and gradients can be computed as if the forward model
+    had been solved in this process.
+
+    Functions are identified by their names, so give the Functions you solve for
+    names, or create them in the same order as in the run that saved the tape.'''
+
+    global loaded
+
+    with open(tape_filename(filename), "rb") as f:
+        data = numpy.load(f)
+        manifest = json.loads(str(data["manifest"]))
+
+        if manifest.get("format") != format_version:
+            raise libadjoint.exceptions.LibadjointErrorInvalidInputs("%s is not a tape saved by this version of dolfin-adjoint." % filename)
+
+        values = {}
+        for i, key in enumerate(manifest["values"]):
+            values[tuple(key)] = numpy.array(data["value_%d" % i])
+
+    loaded = Tape(manifest, values)
+
+def adj_unload_tape():
+    '''Go back to solving the annotated equations, after :py:func:`adj_load_tape`.'''
+
+    global loaded
+    loaded = None
+
+def restore_solution(u):
+    '''If a tape is loaded and holds the value of u that is about to be computed,
+    set u to it and return True. The caller then skips the solve.'''
+
+    if loaded is None:
+        return False
+
+    var = adjglobals.adj_variables[u]
+    loaded.check_equation(adjglobals.adjointer.equation_count - 1, var)
+    values = loaded.value(var)
+    if values is None:
+        return False
+
+    vec = u.vector()
+    if vec.local_size() != len(values):
+        raise libadjoint.exceptions.LibadjointErrorInvalidInputs("The value of %s on the tape does not fit its function space: "
+                                                                 "the model run does not match the one that saved the tape." % var)
+
+    vec.set_local(values)
+    vec.apply("insert")
+
+    # Keep the value, as the solve would have left it to be checkpointed; this saves
+    # the adjoint from solving for it again.
+    if not backend.parameters["adjoint"]["record_all"]:
+        adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.storage_vector(u)))
+
+    return True
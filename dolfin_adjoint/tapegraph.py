@@ -0,0 +1,100 @@
+class TapeGraph(object):
+    '''This object records, for each equation registered with the adjointer, the
+    variable it solves for and the variables it depends on, so that the equations
+    that can influence a functional can be found without asking libadjoint to
+    assemble anything.
+
+    Variables are identified by (name, timestep, iteration). Equation i of the graph
+    is equation i of the adjointer, as long as every equation is registered through
+    solving.do_checkpoint.'''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.variables = []
+        self.dependencies = []
+        self.fn_spaces = []
+        # The dependencies of the operator of each equation, a subset of its dependencies
+        self.operator_dependencies = []
+        # The names of the Constants in each equation, and in its operator; None if unknown
+        self.constants = []
+        self.operator_constants = []
+        # Map from variable to the index of the equation that solves for it
+        self.index = {}
+
+    def __len__(self):
+        return len(self.variables)
+
+    def add(self, var, deps, fn_space=None, operator_deps=[], constants=None, operator_constants=None):
+        '''Record the equation for var, which depends on the variables deps, of which
+        operator_deps enter its operator. constants and operator_constants are the names of
+        the Constants in the equation and in its operator, if known. Equations for which
+        fn_space is None are never skipped.'''
+
+        key = variable_key(var)
+        self.index[key] = len(self.variables)
+        self.variables.append(key)
+        operator_deps = set(variable_key(dep) for dep in operator_deps)
+        self.dependencies.append(set(variable_key(dep) for dep in deps) | operator_deps)
+        self.operator_dependencies.append(operator_deps)
+        self.fn_spaces.append(fn_space)
+        self.constants.append(None if constants is None else set(constants))
+        self.operator_constants.append(None if operator_constants is None else set(operator_constants))
+
+    def fn_space(self, i):
+        return self.fn_spaces[i]
+
+    def backward_slice(self, targets):
+        '''Return the set of indices of the equations whose solutions the variables
+        targets depend on, directly or through other equations.'''
+
+        needed = set(variable_key(var) for var in targets)
+        active = set()
+
+        for i in range(len(self.variables) - 1, -1, -1):
+            if self.variables[i] in needed or self.fn_spaces[i] is None:
+                active.add(i)
+                needed.update(self.dependencies[i])
+
+        return active
+
+    def forward_slice(self, sources):
+        '''Return the set of indices of the equations whose solutions depend on the
+        variables sources, directly or through other equations.'''
+
+        reached = set(variable_key(var) for var in sources)
+        active = set()
+
+        for i in range(len(self.variables)):
+            if self.variables[i] in reached or not self.dependencies[i].isdisjoint(reached) or self.fn_spaces[i] is None:
+                active.add(i)
+                reached.add(self.variables[i])
+
+        return active
+
+    def affected(self, sources, constants):
+        '''Work out what changes when the values of the variables sources and of the Constants
+        named in constants change. Returns (variables, operators): the set of variables whose
+        values may change, and the set of variables whose equations have operators that may
+        change.'''
+
+        reached = set(variable_key(var) for var in sources)
+        constants = set(constants)
+        operators = set()
+
+        def uses(names):
+            # Unknown Constants may be any of them
+            return len(constants) > 0 and (names is None or not names.isdisjoint(constants))
+
+        for i in range(len(self.variables)):
+            if not self.operator_dependencies[i].isdisjoint(reached) or uses(self.operator_constants[i]):
+                operators.add(self.variables[i])
+                reached.add(self.variables[i])
+            elif not self.dependencies[i].isdisjoint(reached) or uses(self.constants[i]):
+                reached.add(self.variables[i])
+
+        return (reached, operators)
+
+def variable_key(var):
+    return (var.name, var.timestep, var.iteration)
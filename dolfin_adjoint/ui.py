@@ -15,8 +15,13 @@ from .gst import compute_gst, compute_propagator_matrix, perturbed_replay
 from .utils import convergence_order, DolfinAdjointVariable
 from .utils import taylor_test
 from .utils import taylor_test_expression
-from .drivers import replay_dolfin, compute_adjoint, compute_tlm, compute_gradient, hessian, compute_gradient_tlm
+from .drivers import replay_dolfin, compute_adjoint, compute_tlm, compute_gradient, compute_gradients, hessian, compute_gradient_tlm
 from .misc import annotations
+from .profiling import adj_profile_table, adj_profile_json, adj_profile_reset
+from .tape import adj_save_tape, adj_load_tape, adj_unload_tape
+from .caching import adj_cache_stats
+from .warmstart import adj_krylov_iterations
+from .jit import adj_jit_warmup
 
 from .variational_solver import NonlinearVariationalSolver, NonlinearVariationalProblem, LinearVariationalSolver, LinearVariationalProblem
 from .projection import project
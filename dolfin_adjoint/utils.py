@@ -3,6 +3,8 @@ import math
 import numpy
 
 import libadjoint
+import ufl
+import ufl.algorithms
 from backend import info_red, info_blue, info, warning
 import backend
 from . import adjglobals
@@ -138,10 +140,11 @@ def test_initial_condition_adjoint(J, ic, final_adjoint, seed=0.01, perturbation
     return min(convergence_order(with_gradient))
 
 def tlm_dolfin(control, forget=False):
+    from . import adjlinalg
     for i in range(adjglobals.adjointer.equation_count):
         (tlm_var, output) = adjglobals.adjointer.get_tlm_solution(i, control)
 
-        storage = libadjoint.MemoryStorage(output)
+        storage = libadjoint.MemoryStorage(adjlinalg.storage_vector(output))
         storage.set_overwrite(True)
         adjglobals.adjointer.record_variable(tlm_var, storage)
 
@@ -834,3 +837,23 @@ def _has_multimesh(form):
             return True
 
     return False
+
+def is_self_adjoint_form(form):
+    '''Return whether the bilinear form is its own adjoint. May return false negatives.'''
+
+    if not isinstance(form, ufl.Form) or _has_multimesh(form):
+        return False
+
+    args = ufl.algorithms.extract_arguments(form)
+    if len(args) != 2 or args[0].ufl_function_space() != args[1].ufl_function_space():
+        return False
+
+    def expand(form):
+        return ufl.algorithms.expand_indices(ufl.algorithms.expand_compounds(ufl.algorithms.expand_derivatives(form)))
+
+    # With both arguments on the same space, the adjoint numbers its arguments as the
+    # form does, so the two can be compared directly.
+    try:
+        return expand(backend.adjoint(form)).equals(expand(form))
+    except (ufl.UFLException, AttributeError, TypeError):
+        return False
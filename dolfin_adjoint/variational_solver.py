@@ -5,6 +5,8 @@ from . import adjglobals
 from . import adjlinalg
 from . import utils
 from . import compatibility
+from . import profiling
+from . import tape
 
 class NonlinearVariationalProblem(backend.NonlinearVariationalProblem):
     '''This object is overloaded so that solves using this class are automatically annotated,
@@ -29,18 +31,26 @@ class NonlinearVariationalSolver(backend.NonlinearVariationalSolver):
         for the purposes of the adjoint computation (such as projecting fields to other function spaces
         for the purposes of visualisation).'''
 
-        annotate = utils.to_annotate(annotate)
+        with profiling.annotation_profile.call_site():
+            annotate = utils.to_annotate(annotate)
 
-        if annotate:
-            problem = self.problem
-            solving.annotate(problem.F == 0, problem.u, problem.bcs, J=problem.J, solver_parameters=compatibility.to_dict(self.parameters))
+            if annotate:
+                problem = self.problem
+                solving.annotate(problem.F == 0, problem.u, problem.bcs, J=problem.J, solver_parameters=compatibility.to_dict(self.parameters))
 
-        out = backend.NonlinearVariationalSolver.solve(self)
+            if annotate and tape.loaded is not None and tape.restore_solution(self.problem.u):
+                # (number of iterations, converged), as the solve would have returned
+                out = (0, True)
+            elif annotate:
+                with profiling.annotation_profile.phase("backend solve"):
+                    out = backend.NonlinearVariationalSolver.solve(self)
+            else:
+                out = backend.NonlinearVariationalSolver.solve(self)
 
-        if annotate and backend.parameters["adjoint"]["record_all"]:
-            adjglobals.adjointer.record_variable(adjglobals.adj_variables[self.problem.u], libadjoint.MemoryStorage(adjlinalg.Vector(self.problem.u)))
+            if annotate and backend.parameters["adjoint"]["record_all"]:
+                adjglobals.adjointer.record_variable(adjglobals.adj_variables[self.problem.u], libadjoint.MemoryStorage(adjlinalg.storage_vector(self.problem.u)))
 
-        return out
+            return out
 
 class LinearVariationalProblem(backend.LinearVariationalProblem):
     '''This object is overloaded so that solves using this class are automatically annotated,
@@ -65,15 +75,22 @@ class LinearVariationalSolver(backend.LinearVariationalSolver):
         for the purposes of the adjoint computation (such as projecting fields to other function spaces
         for the purposes of visualisation).'''
 
-        annotate = utils.to_annotate(annotate)
+        with profiling.annotation_profile.call_site():
+            annotate = utils.to_annotate(annotate)
 
-        if annotate:
-            problem = self.problem
-            solving.annotate(problem.a == problem.L, problem.u, problem.bcs, solver_parameters=compatibility.to_dict(self.parameters))
+            if annotate:
+                problem = self.problem
+                solving.annotate(problem.a == problem.L, problem.u, problem.bcs, solver_parameters=compatibility.to_dict(self.parameters))
 
-        out = backend.LinearVariationalSolver.solve(self)
+            if annotate and tape.loaded is not None and tape.restore_solution(self.problem.u):
+                out = None
+            elif annotate:
+                with profiling.annotation_profile.phase("backend solve"):
+                    out = backend.LinearVariationalSolver.solve(self)
+            else:
+                out = backend.LinearVariationalSolver.solve(self)
 
-        if annotate and backend.parameters["adjoint"]["record_all"]:
-            adjglobals.adjointer.record_variable(adjglobals.adj_variables[self.problem.u], libadjoint.MemoryStorage(adjlinalg.Vector(self.problem.u)))
+            if annotate and backend.parameters["adjoint"]["record_all"]:
+                adjglobals.adjointer.record_variable(adjglobals.adj_variables[self.problem.u], libadjoint.MemoryStorage(adjlinalg.storage_vector(self.problem.u)))
 
-        return out
+            return out
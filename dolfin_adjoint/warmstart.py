@@ -0,0 +1,65 @@
+import collections
+
+import backend
+
+# Warm starts for the iterative solves of the adjoint and tangent linear models. Enable
+# them with
+#
+#   parameters["adjoint"]["warm_start_krylov"] = True
+#
+# Each Krylov solve for an adjoint (or tangent linear) variable then starts from the
+# solution of the last solve for the same variable, at the neighbouring timestep,
+# rather than from zero: these change little from one timestep to the next. The number
+# of Krylov iterations is counted either way, so that the saving can be seen with
+# adj_krylov_iterations.
+
+warm_types = ['ADJ_TLM', 'ADJ_ADJOINT', 'ADJ_SOA']
+
+# (solver, variable name, variable type) -> the last solution
+previous = {}
+
+# variable type -> [solves, iterations, warm-started solves]
+iterations = collections.OrderedDict()
+
+def enabled(var):
+    return backend.parameters["adjoint"]["warm_start_krylov"] and var.type in warm_types
+
+def initial_guess(solver_key, var, x):
+    '''Set the vector x to the last solution for var, if warm starts are enabled and
+    there is one. Returns whether it did, in which case the solver must be told to use
+    a nonzero initial guess.'''
+
+    if not enabled(var):
+        return False
+
+    guess = previous.get((solver_key, var.name, var.type))
+    if guess is None or guess.size() != x.size():
+        return False
+
+    x.zero()
+    x.axpy(1.0, guess)
+    return True
+
+def record(solver_key, var, x, its, warm):
+    '''Record the solution x for var, found in its iterations.'''
+
+    counts = iterations.setdefault(var.type, [0, 0, 0])
+    counts[0] += 1
+    counts[1] += its if isinstance(its, int) else 0
+    counts[2] += 1 if warm else 0
+
+    if enabled(var):
+        previous[(solver_key, var.name, var.type)] = x.copy()
+
+def reset():
+    previous.clear()
+    iterations.clear()
+
+def adj_krylov_iterations():
+    '''Return, for each type of variable ("ADJ_FORWARD", "ADJ_TLM", "ADJ_ADJOINT", ...),
+    the number of Krylov solves of the annotated equations made for it, the total number
+    of iterations they took, and how many of them were warm-started
+    (see :py:data:`parameters["adjoint"]["warm_start_krylov"]`).'''
+
+    return dict((var_type, {"solves": solves, "iterations": its, "warm_started": warm})
+                for (var_type, (solves, its, warm)) in iterations.items())
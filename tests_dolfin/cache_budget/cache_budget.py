@@ -0,0 +1,56 @@
+"""
+Two heat equations with different diffusivities, with the adjoint factorizations
+cached under a budget that only holds one of them, computing the gradient twice. The cache must evict, and the
+gradient must match the one computed with an unbounded cache.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+    w_0 = Function(V, name="Other")
+
+    dt = Constant(0.1)
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    for i in range(4):
+        solve((u*v + dt*inner(grad(u), grad(v)))*dx == u_0*v*dx, u_0, bc)
+        solve((u*v + 2*dt*inner(grad(u), grad(v)))*dx == (u_0 + w_0)*v*dx, w_0, bc)
+
+    return w_0
+
+def gradient(budget):
+    adj_reset()
+    parameters["adjoint"]["cache_factorizations"] = True
+    parameters["adjoint"]["cache_budget"] = budget
+
+    ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="InitialCondition")
+    w = main(ic)
+
+    # The second gradient reuses the factorizations of the first, if they are still cached
+    J = Functional(w*w*dx*dt[FINISH_TIME])
+    compute_gradient(J, Control(ic), forget=False)
+    dJdic = compute_gradient(J, Control(ic), forget=False)
+    return (dJdic, adj_cache_stats()["lu_solvers"])
+
+if __name__ == "__main__":
+    (reference, stats) = gradient(0.0)
+    assert stats["evictions"] == 0
+    assert stats["hits"] > 0
+
+    (dJdic, stats) = gradient(1.0)
+    assert stats["evictions"] > 0
+    assert stats["entries"] <= 1
+
+    assert (dJdic.vector() - reference.vector()).norm("linf") < 1.0e-12 * reference.vector().norm("linf")
+
+    parameters["adjoint"]["cache_factorizations"] = False
+    parameters["adjoint"]["cache_budget"] = 0.0
@@ -0,0 +1,59 @@
+"""
+Burgers' equation with a nonlinear solve in each timestep, annotated with
+the compacted tape: every timestep shares one equation template.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjglobals
+
+parameters["adjoint"]["compact_tape"] = True
+
+n = 30
+mesh = UnitIntervalMesh(n)
+V = FunctionSpace(mesh, "CG", 2)
+
+def main(ic, annotate=False):
+
+    u_ = ic.copy(deepcopy=True, name="Velocity")
+    u = Function(V, name="VelocityNext")
+    v = TestFunction(V)
+
+    nu = Constant(0.0001)
+
+    timestep = Constant(1.0/n)
+
+    F = ((u - u_)/timestep*v
+         + u*u.dx(0)*v + nu*u.dx(0)*v.dx(0))*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    t = 0.0
+    end = 0.2
+    while (t <= end):
+        solve(F == 0, u, bc, annotate=annotate)
+        u_.assign(u, annotate=annotate)
+
+        t += float(timestep)
+        adj_inc_timestep()
+
+    return u_
+
+if __name__ == "__main__":
+
+    ic = project(Expression("sin(2*pi*x[0])", degree=1),  V)
+    forward = main(ic, annotate=True)
+
+    assert len(adjglobals.equation_templates) == 1
+
+    assert replay_dolfin(forget=False, tol=0.0)
+
+    J = Functional(forward*forward*dx*dt[FINISH_TIME])
+    Jic = assemble(forward*forward*dx)
+    dJdic = compute_gradient(J, FunctionControl("Velocity"), forget=False)
+
+    def Jfunc(ic):
+        forward = main(ic, annotate=False)
+        return assemble(forward*forward*dx)
+
+    minconv = taylor_test(Jfunc, FunctionControl("Velocity"), Jic, dJdic)
+    assert minconv > 1.9
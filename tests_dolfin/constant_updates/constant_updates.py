@@ -0,0 +1,33 @@
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(4,4)
+V = FunctionSpace(mesh, "CG", 1)
+
+u = TrialFunction(V)
+v = TestFunction(V)
+
+u_ = Function(V, name="previous")
+u1 = Function(V, name="solution")
+
+bc = DirichletBC(V, 0, "on_boundary")
+
+# Both the Constant and the Expression change every timestep, and only
+# one of them changes on the last one: replay has to restore each of them
+# to the right version.
+dt = Constant(0.1, name="dt")
+source = Expression("t*sin(x[0])*sin(x[1])", t=0.0, degree=2)
+
+a = u*v*dx + dt*inner(grad(u), grad(v))*dx
+L = u_*v*dx + dt*source*v*dx
+
+t = 0.0
+for i in range(4):
+    if i < 3:
+        dt.assign(0.1*(i + 1))
+    t += float(dt)
+    source.t = t
+    solve(a == L, u1, bc)
+    u_.assign(u1)
+
+assert replay_dolfin(tol=0.0, stop=True)
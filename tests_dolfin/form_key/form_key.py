@@ -0,0 +1,33 @@
+"""
+The keys of the assembly caches: the same form built twice must have the same key,
+and the key must change with the coefficients of the form and the values of its
+Constants.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import caching
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def form(c, f):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+    return c*f*u*v*dx
+
+if __name__ == "__main__":
+    c = Constant(1.0)
+    f = Function(V)
+    g = Function(V)
+
+    assert caching.form_key(form(c, f)) == caching.form_key(form(c, f))
+    assert caching.form_key(form(c, f)) != caching.form_key(form(c, g))
+
+    key = caching.form_key(form(c, f))
+    c.assign(2.0)
+    assert caching.form_key(form(c, f)) != key
+
+    assemble(form(c, f), annotate=False)
+    assert form(c, f) in caching.assembled_fwd_forms
+    assert form(c, g) not in caching.assembled_fwd_forms
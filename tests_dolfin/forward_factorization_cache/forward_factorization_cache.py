@@ -0,0 +1,55 @@
+"""
+A heat equation driven by a source term control, followed by a reaction
+equation whose operator depends on the control. Replaying the forward model
+for new control values can reuse the factorization of the heat operator, but
+must refactorize the reaction operator. The timesteps share the factorizations
+of the two operators, although the boundary values of the heat equation change
+every timestep. The functional values must match those computed without the
+cache.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(f):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    w = Function(V, name="Reaction")
+    dt = Constant(0.1)
+    a = (u*v + dt*inner(grad(u), grad(v)))*dx
+    L = (u_0 + dt*f)*v*dx
+    g = Expression("t*x[0]", t=0.0, degree=1)
+    bc = DirichletBC(V, g, "on_boundary")
+
+    for i in range(4):
+        g.t = (i + 1)*0.1
+        solve(a == L, u_0, bc, solver_parameters={"linear_solver": "lu"})
+        solve((u*v + f*f*u*v)*dx == u_0*v*dx, w, solver_parameters={"linear_solver": "lu"})
+
+    return w
+
+def evaluate(cache):
+    adj_reset()
+    parameters["adjoint"]["cache_forward_factorizations"] = cache
+
+    f = interpolate(Expression("x[0]*x[1]", degree=2), V, name="Source")
+    w = main(f)
+
+    Jhat = ReducedFunctional(Functional(w*w*dx*dt[FINISH_TIME]), Control(f))
+    values = [Jhat(interpolate(Constant(c), V)) for c in [1.0, 2.0, 2.0, 3.0]]
+    return (values, adj_cache_stats()["fwd_lu_solvers"])
+
+if __name__ == "__main__":
+    (reference, stats) = evaluate(False)
+    (values, stats) = evaluate(True)
+    assert stats["entries"] == 2
+
+    for (value, ref) in zip(values, reference):
+        assert abs(value - ref) < 1.0e-12 * abs(ref)
+
+    parameters["adjoint"]["cache_forward_factorizations"] = False
@@ -0,0 +1,56 @@
+"""
+The heat equation with the forward values stored in arenas, in memory and
+memory-mapped. The recorded values must be held in arena rows, and the
+gradients must match those computed with the values stored as Functions.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import arena
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, annotate=True):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic, annotate=False)
+
+    dt = Constant(0.1)
+    F = ((u - u_0)/dt*v + inner(grad(u), grad(v)) + u_0*u_0*v)*dx
+    a, L = lhs(F), rhs(F)
+    bc = DirichletBC(V, 1.0, "on_boundary")
+
+    for i in range(5):
+        solve(a == L, u_0, bc, annotate=annotate)
+
+    return u_0
+
+def gradient(storage):
+    adj_reset()
+    parameters["adjoint"]["record_all"] = True
+    parameters["adjoint"]["forward_storage"] = storage
+
+    ic = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="InitialCondition")
+    u = main(ic)
+
+    assert replay_dolfin(tol=0.0, stop=True)
+
+    rows = sum(a.used for a in arena.arenas.values())
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    return (compute_gradient(J, Control(ic), forget=False), rows)
+
+if __name__ == "__main__":
+    (reference, rows) = gradient("function")
+    assert rows == 0
+
+    for storage in ["arena", "arena_mmap"]:
+        (dJdic, rows) = gradient(storage)
+        assert rows > 0
+        assert (dJdic.vector() - reference.vector()).norm("linf") == 0.0
+
+    parameters["adjoint"]["record_all"] = False
+    parameters["adjoint"]["forward_storage"] = "function"
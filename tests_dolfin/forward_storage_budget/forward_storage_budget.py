@@ -0,0 +1,62 @@
+"""
+The heat equation with the forward values stored in arenas under a memory
+budget of a few values, so that most of them are spilled to disk during the
+forward run and read back during the adjoint. Values must have been spilled
+and read back, and the gradients must match those computed with the values
+stored as Functions.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import arena
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, annotate=True):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic, annotate=False)
+
+    dt = Constant(0.1)
+    F = ((u - u_0)/dt*v + inner(grad(u), grad(v)) + u_0*u_0*v)*dx
+    a, L = lhs(F), rhs(F)
+    bc = DirichletBC(V, 1.0, "on_boundary")
+
+    for i in range(10):
+        solve(a == L, u_0, bc, annotate=annotate)
+
+    return u_0
+
+def gradient(storage, budget):
+    adj_reset()
+    parameters["adjoint"]["record_all"] = True
+    parameters["adjoint"]["forward_storage"] = storage
+    parameters["adjoint"]["forward_storage_budget"] = budget
+
+    ic = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="InitialCondition")
+    u = main(ic)
+
+    assert replay_dolfin(tol=0.0, stop=True)
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    dJdic = compute_gradient(J, Control(ic), forget=False)
+    return (dJdic, arena.budget)
+
+if __name__ == "__main__":
+    (reference, budget) = gradient("function", 0.0)
+    assert budget.spills == 0
+
+    # Room for three values, of the ten recorded
+    limit = 3 * V.dim() * 8.0
+    for storage in ["function", "arena", "arena_mmap"]:
+        (dJdic, budget) = gradient(storage, limit)
+        assert budget.spills > 0
+        assert budget.unspills > 0
+        assert (dJdic.vector() - reference.vector()).norm("linf") == 0.0
+
+    parameters["adjoint"]["record_all"] = False
+    parameters["adjoint"]["forward_storage"] = "function"
+    parameters["adjoint"]["forward_storage_budget"] = 0.0
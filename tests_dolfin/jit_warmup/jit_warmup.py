@@ -0,0 +1,46 @@
+"""
+A nonlinear diffusion equation solved at several timesteps, whose adjoint and
+Hessian forms are compiled ahead of the sweeps, in two processes. The gradient
+and Hessian action must match those computed without compiling ahead.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(m):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(m)
+
+    for i in range(4):
+        a = (u*v + Constant(0.1)*(1 + u_0**2)*inner(grad(u), grad(v)))*dx
+        solve(a == u_0*v*dx, u_0)
+
+    return u_0
+
+def derivatives(warmup):
+    adj_reset()
+
+    m = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="Parameter")
+    u = main(m)
+
+    compiled = adj_jit_warmup(hessian=True, processes=2) if warmup else 0
+
+    J = Functional(inner(u, u)*dx*dt[FINISH_TIME])
+    dJdm = compute_gradient(J, Control(m), forget=False)
+    HJm = hessian(J, Control(m), warn=False)
+    return (compiled, dJdm, HJm(interpolate(Constant(1.0), V)))
+
+if __name__ == "__main__":
+    (compiled, ref_gradient, ref_hessian) = derivatives(False)
+    (compiled, gradient, hessian_action) = derivatives(True)
+
+    assert compiled > 0
+
+    for (value, ref) in [(gradient, ref_gradient), (hessian_action, ref_hessian)]:
+        assert (value.vector() - ref.vector()).norm("linf") < 1.0e-12 * ref.vector().norm("linf")
@@ -0,0 +1,53 @@
+"""
+A heat equation solved with conjugate gradients over many timesteps. With warm
+starts, each adjoint solve starts from the adjoint solution at the previous
+backward step, which must take fewer Krylov iterations overall and give the same
+gradient.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(16, 16)
+V = FunctionSpace(mesh, "CG", 1)
+
+solver_parameters = {"linear_solver": "cg", "preconditioner": "jacobi",
+                     "krylov_solver": {"relative_tolerance": 1.0e-12, "absolute_tolerance": 1.0e-16}}
+
+def main(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+
+    dt = Constant(0.01)
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    for i in range(10):
+        solve((u*v + dt*inner(grad(u), grad(v)))*dx == u_0*v*dx, u_0, bc, solver_parameters=solver_parameters)
+
+    return u_0
+
+def gradient(warm):
+    adj_reset()
+    parameters["adjoint"]["warm_start_krylov"] = warm
+
+    ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="InitialCondition")
+    u = main(ic)
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    dJdic = compute_gradient(J, Control(ic), forget=False)
+    return (dJdic, adj_krylov_iterations()["ADJ_ADJOINT"])
+
+if __name__ == "__main__":
+    (reference, cold) = gradient(False)
+    assert cold["warm_started"] == 0
+
+    (dJdic, warm) = gradient(True)
+    assert warm["warm_started"] > 0
+    assert warm["iterations"] < cold["iterations"]
+
+    assert (dJdic.vector() - reference.vector()).norm("linf") < 1.0e-8 * reference.vector().norm("linf")
+
+    parameters["adjoint"]["warm_start_krylov"] = False
@@ -0,0 +1,51 @@
+"""
+An advection-diffusion equation, whose operator is not symmetric, solved with
+an LUSolver that reuses its factorization. The adjoint solves use the transpose
+of the forward factorization; the gradient must match the one computed without
+reusing factorizations.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, reuse_factorization):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+
+    dt = Constant(0.1)
+    velocity = Constant((1.0, 0.5))
+    a = (u*v + dt*inner(grad(u), grad(v)) + dt*inner(velocity, grad(u))*v)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    A = assemble(a)
+    bc.apply(A)
+    solver = LUSolver(A)
+    solver.parameters["reuse_factorization"] = reuse_factorization
+
+    for i in range(4):
+        b = assemble(u_0*v*dx)
+        bc.apply(b)
+        solver.solve(u_0.vector(), b)
+
+    return u_0
+
+def gradient(reuse_factorization):
+    adj_reset()
+
+    ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="InitialCondition")
+    u = main(ic, reuse_factorization)
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    return compute_gradient(J, Control(ic), forget=False)
+
+if __name__ == "__main__":
+    reference = gradient(False)
+    dJdic = gradient(True)
+
+    assert (dJdic.vector() - reference.vector()).norm("linf") < 1.0e-12 * reference.vector().norm("linf")
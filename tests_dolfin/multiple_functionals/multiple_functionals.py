@@ -0,0 +1,40 @@
+"""
+Two functionals of a heat equation, whose gradients are computed in one backward
+sweep. The adjoint solves for the second functional must reuse the factorizations
+made for the first, and the gradients must match those computed one by one.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+
+    dt = Constant(0.1)
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    for i in range(4):
+        solve((u*v + dt*inner(grad(u), grad(v)))*dx == u_0*v*dx, u_0, bc)
+
+    return u_0
+
+if __name__ == "__main__":
+    ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="InitialCondition")
+    u = main(ic)
+
+    Js = [Functional(u*u*dx*dt[FINISH_TIME]), Functional(u*dx*dt[FINISH_TIME])]
+    reference = [compute_gradient(J, Control(ic), forget=False) for J in Js]
+
+    hits = adj_cache_stats()["lu_solvers"]["hits"]
+    dJdics = compute_gradients(Js, Control(ic), forget=False)
+    assert adj_cache_stats()["lu_solvers"]["hits"] > hits
+
+    for (dJdic, ref) in zip(dJdics, reference):
+        assert (dJdic.vector() - ref.vector()).norm("linf") < 1.0e-12 * ref.vector().norm("linf")
@@ -0,0 +1,53 @@
+"""
+A heat equation whose operator is assembled once by the forward model and
+solved with solve(A, x, b), with the hermitian of each block tested. The tests
+take actions of the blocks and of their adjoints, which must be matrix-vector
+products with the cached operator, and the gradient must match the one computed
+without them.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+
+    dt = Constant(0.1)
+    A = assemble((u*v + dt*inner(grad(u), grad(v)) + dt*u.dx(0)*v)*dx)
+
+    adj_start_timestep()
+    for i in range(4):
+        b = assemble(u_0*v*dx)
+        solve(A, u_0.vector(), b)
+        adj_inc_timestep(time=(i+1)*0.1, finished=(i == 3))
+
+    return u_0
+
+def gradient(test_hermitian):
+    adj_reset()
+    parameters["adjoint"]["test_hermitian"] = test_hermitian
+
+    ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="InitialCondition")
+    u = main(ic)
+
+    J = Functional(inner(u, u)*dx*dt[FINISH_TIME])
+    dJdic = compute_gradient(J, Control(ic), forget=False)
+    return (dJdic, adj_cache_stats()["assembled_operators"])
+
+if __name__ == "__main__":
+    (reference, stats) = gradient(False)
+
+    (dJdic, stats) = gradient((10, 1.0e-12))
+    assert stats["entries"] > 0
+    assert stats["hits"] > 0
+
+    assert (dJdic.vector() - reference.vector()).norm("linf") < 1.0e-12 * reference.vector().norm("linf")
+
+    parameters["adjoint"]["test_hermitian"] = False
@@ -0,0 +1,60 @@
+"""
+A heat equation with a source that changes every timestep, whose gradient is
+computed with the adjoint forms pre-assembled. The static adjoint operator and
+the terms linear in the adjoint and forward solutions must come from the cache,
+and the gradient must match the one computed without pre-assembly. The
+tracking functional's derivative has a term that is affine, not linear, in the
+solution, which must not be taken as a matrix action.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+
+    dt = Constant(0.1)
+    kappa = Constant(0.5)
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    adj_start_timestep()
+    for i in range(4):
+        f = interpolate(Expression("t*x[0]*x[1]", t=(i+1)*0.1, degree=2), V, name="Source")
+        solve((u*v + dt*kappa*inner(grad(u), grad(v)))*dx == (u_0*v + dt*f*u_0*v)*dx, u_0, bc)
+        adj_inc_timestep(time=(i+1)*0.1, finished=(i == 3))
+
+    return u_0
+
+def gradient(preassemble, tracking):
+    adj_reset()
+    parameters["adjoint"]["preassemble_forms"] = preassemble
+
+    ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="InitialCondition")
+    u = main(ic)
+
+    if tracking:
+        J = Functional(inner(u - Constant(1.0), u - Constant(1.0))*dx*dt[FINISH_TIME])
+    else:
+        J = Functional(inner(u, u)*dx*dt[FINISH_TIME])
+    dJdic = compute_gradient(J, Control(ic), forget=False)
+    return (dJdic, adj_cache_stats()["preassembled_terms"])
+
+if __name__ == "__main__":
+    for tracking in [False, True]:
+        (reference, stats) = gradient(False, tracking)
+        assert stats["entries"] == 0
+
+        (dJdic, stats) = gradient(True, tracking)
+        assert stats["entries"] > 0
+        assert stats["hits"] > 0
+
+        assert (dJdic.vector() - reference.vector()).norm("linf") < 1.0e-12 * reference.vector().norm("linf")
+
+    parameters["adjoint"]["preassemble_forms"] = False
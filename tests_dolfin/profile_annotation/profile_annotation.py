@@ -0,0 +1,41 @@
+import json
+
+from dolfin import *
+from dolfin_adjoint import *
+
+parameters["adjoint"]["profile_annotation"] = True
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+u = TrialFunction(V)
+v = TestFunction(V)
+
+u_0 = Function(V, name="Solution")
+dt = Constant(0.1)
+
+F = ((u - u_0)/dt*v + inner(grad(u), grad(v)) + v)*dx
+a, L = lhs(F), rhs(F)
+bc = DirichletBC(V, 1.0, "on_boundary")
+
+for i in range(3):
+    solve(a == L, u_0, bc)
+
+table = adj_profile_table()
+print(table)
+
+profile = json.loads(adj_profile_json())
+
+# All three solves come from the same line of this file
+assert len(profile) == 1
+site = list(profile.keys())[0]
+assert "profile_annotation.py" in site
+
+phases = profile[site]
+for phase in ["extract_args", "extract_coefficients", "freeze", "register_initial_conditions",
+              "register_equation", "checkpoint", "backend solve", "record"]:
+    assert phase in phases, phase
+assert phases["backend solve"]["calls"] == 3
+
+adj_profile_reset()
+assert json.loads(adj_profile_json()) == {}
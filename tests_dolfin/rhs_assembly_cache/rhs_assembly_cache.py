@@ -0,0 +1,65 @@
+"""
+A heat equation with a functional that compares the solution to an observation
+at every timestep, computing the gradient twice with the assembled right-hand
+sides cached. The second gradient must take right-hand sides from the cache, and
+both must match the gradient computed without it. With room for only two
+right-hand sides, the cache must evict the others and still give the same
+gradients.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+
+    dt = Constant(0.1)
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    adj_start_timestep()
+    for i in range(4):
+        solve((u*v + dt*inner(grad(u), grad(v)))*dx == u_0*v*dx, u_0, bc)
+        adj_inc_timestep(time=(i+1)*0.1, finished=(i == 3))
+
+    return u_0
+
+def gradients(cache, entries=32):
+    adj_reset()
+    parameters["adjoint"]["cache_rhs_assembly"] = cache
+    parameters["adjoint"]["cache_rhs_entries"] = entries
+
+    ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="InitialCondition")
+    u = main(ic)
+
+    observation = interpolate(Expression("x[0]*(1 - x[0])", degree=2), V)
+    J = Functional(inner(u - observation, u - observation)*dx*dt + inner(ic, ic)*dx*dt[START_TIME])
+    out = [compute_gradient(J, Control(ic), forget=False) for i in range(2)]
+    return (out, adj_cache_stats()["assembled_rhs_vectors"])
+
+if __name__ == "__main__":
+    (reference, stats) = gradients(False)
+    assert stats["entries"] == 0
+
+    (dJdic, stats) = gradients(True)
+    assert stats["hits"] > 0
+
+    for (grad, ref) in zip(dJdic, reference):
+        assert (grad.vector() - ref.vector()).norm("linf") < 1.0e-12 * ref.vector().norm("linf")
+
+    evictions = stats["evictions"]
+    (dJdic, stats) = gradients(True, entries=2)
+    assert stats["entries"] <= 2
+    assert stats["evictions"] > evictions
+
+    for (grad, ref) in zip(dJdic, reference):
+        assert (grad.vector() - ref.vector()).norm("linf") < 1.0e-12 * ref.vector().norm("linf")
+
+    parameters["adjoint"]["cache_rhs_assembly"] = False
+    parameters["adjoint"]["cache_rhs_entries"] = 32
@@ -0,0 +1,64 @@
+"""
+A heat equation driven by a source term control, followed by a reaction
+equation whose operator depends on the control, with the adjoint factorizations
+cached. Evaluating the reduced functional at a new control value must only
+discard the factorizations of the reaction operator, and the gradients must
+match those computed after discarding every cached factorization.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(f):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    w = Function(V, name="Reaction")
+    dt = Constant(0.1)
+    a = (u*v + dt*inner(grad(u), grad(v)))*dx
+    L = (u_0 + dt*f)*v*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    for i in range(4):
+        solve(a == L, u_0, bc)
+        solve((u*v + f*f*u*v)*dx == u_0*v*dx, w)
+
+    return w
+
+def gradients(selective):
+    adj_reset()
+    parameters["adjoint"]["cache_factorizations"] = True
+
+    f = interpolate(Expression("x[0]*x[1]", degree=2), V, name="Source")
+    w = main(f)
+
+    Jhat = ReducedFunctional(Functional(w*w*dx*dt[FINISH_TIME]), Control(f))
+
+    out = []
+    entries = []
+    for c in [1.0, 2.0, 3.0]:
+        Jhat(interpolate(Constant(c), V))
+        if not selective:
+            adj_reset_cache()
+        entries.append(adj_cache_stats()["lu_solvers"]["entries"])
+        out.append(Jhat.derivative(forget=False)[0])
+
+    return (out, entries)
+
+if __name__ == "__main__":
+    (reference, entries) = gradients(False)
+    assert entries == [0, 0, 0]
+
+    (dJdf, entries) = gradients(True)
+    # The factorizations of the heat operator survive the new control values
+    assert entries[0] == 0
+    assert entries[1] > 0 and entries[2] == entries[1]
+
+    for (grad, ref) in zip(dJdf, reference):
+        assert (grad.vector() - ref.vector()).norm("linf") < 1.0e-12 * ref.vector().norm("linf")
+
+    parameters["adjoint"]["cache_factorizations"] = False
@@ -0,0 +1,71 @@
+"""
+A heat equation, whose operator is self-adjoint, so that its adjoint solves use
+the forward matrix and factorization. After a replay that caches the forward
+factorizations, the adjoint solves must use those factorizations themselves.
+The gradient must match the one computed with the same operator written so that
+it is not recognised as self-adjoint.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import caching
+from dolfin_adjoint.utils import is_self_adjoint_form
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def operator(recognisable):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    dt = Constant(0.1)
+    a = (u*v + dt*inner(grad(u), grad(v)))*dx
+    if not recognisable:
+        velocity = Constant((1.0, 0.5))
+        a = a + Constant(0.0)*inner(velocity, grad(u))*v*dx
+    return a
+
+def main(ic, a):
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    for i in range(4):
+        solve(a == u_0*v*dx, u_0, bc)
+
+    return u_0
+
+def gradient(recognisable):
+    adj_reset()
+    parameters["adjoint"]["cache_factorizations"] = True
+    parameters["adjoint"]["cache_forward_factorizations"] = True
+
+    ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V, name="InitialCondition")
+    u = main(ic, operator(recognisable))
+
+    # The replay factorizes the forward operator, for the adjoint solves to reuse
+    assert replay_dolfin(forget=False)
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    dJdic = compute_gradient(J, Control(ic), forget=False)
+
+    forward_solvers = list(caching.fwd_lu_solvers.values())
+    shared = [solver for solver in caching.lu_solvers.values() if any(solver is f for f in forward_solvers)]
+    return (dJdic, len(forward_solvers), len(shared))
+
+if __name__ == "__main__":
+    assert is_self_adjoint_form(operator(True))
+    assert not is_self_adjoint_form(operator(False))
+
+    (reference, factorized, shared) = gradient(False)
+    assert shared == 0
+    (dJdic, factorized, shared) = gradient(True)
+    # All four timesteps share one forward factorization, which every adjoint solve uses
+    assert factorized == 1
+    assert shared == 4
+
+    assert (dJdic.vector() - reference.vector()).norm("linf") < 1.0e-12 * reference.vector().norm("linf")
+
+    parameters["adjoint"]["cache_factorizations"] = False
+    parameters["adjoint"]["cache_forward_factorizations"] = False
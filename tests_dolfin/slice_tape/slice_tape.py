@@ -0,0 +1,65 @@
+"""
+The heat equation with a diagnostic field solved for alongside it, which the
+functional does not depend on. Slicing the tape must skip the adjoint solves
+for the diagnostic and give the same gradient, and the gradient with respect to
+the diagnostic, which no solve left in the slice reaches, must be zero.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjglobals
+from dolfin_adjoint.drivers import adjoint_slice
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+    diagnostic = Function(V, name="Diagnostic")
+
+    dt = Constant(0.1)
+    F = ((u - u_0)/dt*v + inner(grad(u), grad(v)) + u_0*u_0*v)*dx
+    a, L = lhs(F), rhs(F)
+    bc = DirichletBC(V, 1.0, "on_boundary")
+
+    for i in range(3):
+        solve(a == L, u_0, bc)
+        solve(u*v*dx == u_0*u_0*v*dx, diagnostic)
+
+    return (u_0, diagnostic)
+
+def gradient(slice_tape):
+    adj_reset()
+    parameters["adjoint"]["slice_tape"] = slice_tape
+
+    ic = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="InitialCondition")
+    (u, diagnostic) = main(ic)
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    dJdic = compute_gradient(J, Control(ic), forget=False)
+    dJddiagnostic = compute_gradient(J, Control(diagnostic), forget=False)
+
+    active = adjoint_slice(J)
+    skipped = adjglobals.adjointer.equation_count - len(active) if active is not None else 0
+
+    adjoints = [adj for (adj, var) in compute_adjoint(J, forget=False) if var.name == "Diagnostic"]
+    return (dJdic, dJddiagnostic, skipped, adjoints)
+
+if __name__ == "__main__":
+    (reference, _, skipped, _) = gradient(False)
+    assert skipped == 0
+
+    (dJdic, dJddiagnostic, skipped, adjoints) = gradient(True)
+    assert skipped == 3
+
+    assert (dJdic.vector() - reference.vector()).norm("linf") == 0.0
+    assert isinstance(dJddiagnostic, Function)
+    assert dJddiagnostic.vector().norm("linf") == 0.0
+    assert len(adjoints) == 3
+    assert all(adj.vector().norm("linf") == 0.0 for adj in adjoints)
+
+    parameters["adjoint"]["slice_tape"] = False
@@ -0,0 +1,53 @@
+"""
+Two heat equations solved side by side, one of which does not depend on the
+control. Slicing the tape must skip its tangent linear solves, give zero
+tangent linear solutions for it, and leave the action of the gradient unchanged.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic)
+    w_0 = interpolate(Expression("x[1]", degree=1), V, name="Independent")
+
+    dt = Constant(0.1)
+    bc = DirichletBC(V, 1.0, "on_boundary")
+
+    for i in range(3):
+        solve((u - u_0)/dt*v*dx + inner(grad(u), grad(v))*dx == w_0*v*dx, u_0, bc)
+        solve((u - w_0)/dt*v*dx + inner(grad(u), grad(v))*dx == 0, w_0, bc)
+
+    return u_0
+
+def tlm(slice_tape):
+    adj_reset()
+    parameters["adjoint"]["slice_tape"] = slice_tape
+
+    ic = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="InitialCondition")
+    u = main(ic)
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    m = Control(ic)
+    direction = interpolate(Expression("x[0]*x[1]", degree=2), V)
+    dJdm = compute_gradient_tlm(J, m, forget=False).inner(direction.vector())
+
+    independent = [out for (out, var) in compute_tlm(m.set_perturbation(direction), forget=False) if var.name == "Independent"]
+    return (dJdm, independent)
+
+if __name__ == "__main__":
+    (reference, _) = tlm(False)
+    (dJdm, independent) = tlm(True)
+
+    assert dJdm == reference
+    assert len(independent) > 0
+    assert all(out.vector().norm("linf") == 0.0 for out in independent)
+
+    parameters["adjoint"]["slice_tape"] = False
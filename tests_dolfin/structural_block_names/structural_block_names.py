@@ -0,0 +1,57 @@
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjglobals
+
+parameters["adjoint"]["structural_block_names"] = True
+
+f = Expression("t*x[0]*(x[0]-1)*x[1]*(x[1]-1)", t=0.0, degree=4)
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, annotate=True):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic, annotate=False)
+
+    dt = Constant(0.1)
+
+    # The operator is the same at every timestep, but the source is not:
+    # the blocks are shared, and each right-hand side keeps its own source.
+    F = ( (u - u_0)/dt*v + inner(grad(u), grad(v)) + f*v)*dx
+
+    bc = DirichletBC(V, 1.0, "on_boundary")
+
+    a, L = lhs(F), rhs(F)
+
+    t = float(dt)
+    T = 1.0
+
+    while t <= T:
+        f.t = t
+        solve(a == L, u_0, bc, annotate=annotate)
+        t += float(dt)
+
+    return u_0
+
+if __name__ == "__main__":
+
+    ic = Function(V, name="InitialCondition")
+    u = main(ic)
+
+    assert len(set(template.name for (template, rhs) in adjglobals.annotated_equations)) == 1
+
+    assert replay_dolfin(tol=0.0, stop=True)
+
+    J = Functional(u*u*u*u*dx*dt[FINISH_TIME])
+    m = Control(u)
+    Jm = assemble(u*u*u*u*dx)
+    dJdm = compute_gradient(J, m, forget=False)
+
+    def J(ic):
+        u = main(ic, annotate=False)
+        return assemble(u*u*u*u*dx)
+
+    minconv = taylor_test(J, m, Jm, dJdm, seed=100)
+    assert minconv > 1.9
@@ -0,0 +1,26 @@
+"""
+Adding a subfunction of a mixed Function to a Function on the collapsed subspace,
+as the adjoint accumulation does. The values must be copied with one cached
+FunctionAssigner, and match those of a projection.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjlinalg, caching
+
+mesh = UnitSquareMesh(8, 8)
+P1 = FiniteElement("CG", triangle, 1)
+W = FunctionSpace(mesh, MixedElement([P1, P1]))
+V = W.sub(1).collapse()
+
+if __name__ == "__main__":
+    w = interpolate(Expression(("x[0]", "x[0]*x[1]"), degree=2), W, annotate=False)
+    reference = project(w.sub(1), V, annotate=False)
+
+    caching.function_assigners.clear()
+    out = adjlinalg.Vector(Function(V))
+    for i in range(2):
+        out.axpy(0.5, adjlinalg.Vector(w.sub(1)))
+
+    assert len(caching.function_assigners) == 1
+    assert (out.data.vector() - reference.vector()).norm("linf") < 1.0e-10
@@ -0,0 +1,57 @@
+"""
+A nonlinear equation solved at several timesteps, whose operator and right-hand
+side both depend on the solution at the previous timestep, so that the adjoint
+and Hessian sweeps take the same derivatives of them at every timestep. The
+derivatives are built once per block and variable and reused, and the second
+order Taylor test must still converge.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjglobals
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+test = TestFunction(V)
+trial = TrialFunction(V)
+
+def main(m):
+    u = Function(V, name="Solution")
+    u_prev = Function(V, name="Previous")
+
+    for i in range(3):
+        u_prev.assign(u)
+        a = (1 + u_prev**2)*inner(trial, test)*dx + Constant(0.1)*inner(grad(trial), grad(test))*dx
+        L = inner(sin(u_prev) + m, test)*dx
+        solve(a == L, u)
+
+    return u
+
+if __name__ == "__main__":
+    parameters["adjoint"]["compact_tape"] = True
+
+    m = interpolate(Expression("x[0]*x[1]", degree=2), V, name="Parameter")
+    u = main(m)
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    J = Functional(inner(u, u)**2*dx)
+    Jm = assemble(inner(u, u)**2*dx)
+    dJdm = compute_gradient(J, Control(m), forget=None)
+    HJm = hessian(J, Control(m), warn=False)
+
+    # The blocks of the solves share one template on the compacted tape, and so one set of
+    # derivatives
+    templates = list(adjglobals.equation_templates.values())
+    assert sum(len(template.derivatives) for template in templates) > 0
+
+    def Jhat(m):
+        u = main(m)
+        return assemble(inner(u, u)**2*dx)
+
+    minconv = taylor_test(Jhat, Control(m), Jm, dJdm, HJm=HJm,
+                          perturbation_direction=interpolate(Constant(0.1), V))
+    assert minconv > 2.9
+
+    parameters["adjoint"]["compact_tape"] = False
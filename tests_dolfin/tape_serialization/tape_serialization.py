@@ -0,0 +1,64 @@
+"""
+Save the tape of a nonlinear heat equation, then load it after forgetting
+everything and compute the gradient again. The forward solves must be taken
+from the tape, and the gradient must match. A model that solves for other
+variables than the one that saved the tape must be refused.
+"""
+
+import os
+import tempfile
+
+from dolfin import *
+from dolfin_adjoint import *
+import libadjoint.exceptions
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, annotate=True, name="Solution"):
+    u = Function(V, name=name)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Previous")
+    u_0.assign(ic, annotate=annotate)
+
+    dt = Constant(0.1)
+    F = ((u - u_0)/dt*v + inner(grad(u), grad(v)) + u*u*v)*dx
+    bc = DirichletBC(V, 1.0, "on_boundary")
+
+    for i in range(3):
+        solve(F == 0, u, bc, annotate=annotate)
+        u_0.assign(u, annotate=annotate)
+
+    return u_0
+
+def gradient(name="Solution"):
+    ic = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="InitialCondition")
+    u = main(ic, name=name)
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    return (u, compute_gradient(J, Control(ic), forget=False))
+
+if __name__ == "__main__":
+    (fd, filename) = tempfile.mkstemp(suffix=".npz")
+    os.close(fd)
+
+    (u, reference) = gradient()
+    adj_save_tape(filename)
+    adj_reset()
+
+    adj_load_tape(filename)
+    (restored, dJdic) = gradient()
+    adj_reset()
+
+    try:
+        gradient(name="Other")
+        assert False, "a model that does not match the tape was run from it"
+    except libadjoint.exceptions.LibadjointErrorInvalidInputs:
+        pass
+    adj_unload_tape()
+    adj_reset()
+    os.remove(filename)
+
+    assert (restored.vector() - u.vector()).norm("linf") == 0.0
+    assert (dJdic.vector() - reference.vector()).norm("linf") == 0.0
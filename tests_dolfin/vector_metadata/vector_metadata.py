@@ -0,0 +1,38 @@
+"""
+The size of a Vector holding a form or nothing at all must be worked out from its
+function space, without assembling or making a Function, and must match the size
+of the assembled vector. Duplicating a subfunction must collapse its space once,
+and adding a Function to an empty Vector must give a Function.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjlinalg, caching
+
+mesh = UnitSquareMesh(8, 8)
+P1 = FiniteElement("CG", triangle, 1)
+W = FunctionSpace(mesh, MixedElement([P1, P1]))
+V = FunctionSpace(mesh, "CG", 1)
+
+if __name__ == "__main__":
+    v = TestFunction(V)
+    form = v*dx
+    assert adjlinalg.Vector(form).size() == assemble(form).local_size()
+    assert adjlinalg.Vector(None, fn_space=V).size() == Function(V).vector().local_size()
+
+    w = Function(W)
+    caching.collapsed_spaces.clear()
+    for i in range(2):
+        dup = adjlinalg.Vector(w.sub(0)).duplicate()
+        assert dup.zero
+        assert dup.size() == V.dim()
+    assert len(caching.collapsed_spaces) == 1
+
+    f = interpolate(Expression("x[0]", degree=1), V, annotate=False)
+    empty = adjlinalg.Vector(None)
+    empty.axpy(2.0, adjlinalg.Vector(f))
+    assert isinstance(empty.data, Function)
+    assert (empty.data.vector() - 2.0*f.vector()).norm("linf") == 0.0
+
+    empty.axpy(0.0, adjlinalg.Vector(f))
+    assert (empty.data.vector() - 2.0*f.vector()).norm("linf") == 0.0